@@ -0,0 +1,152 @@
+# bench_disk_write.py
+# So sánh cách ghi file của client: ghi thẳng vào file cấp phát trước (pwrite)
+# với cách cũ ghi từng phần ra .partN rồi ghép lại.
+# Ví dụ: python bench_disk_write.py --file-size 1024
+import argparse
+import multiprocessing
+import os
+import resource
+import shutil
+import tempfile
+import threading
+import time
+
+from bench_tcp_server import BENCH_FILENAME, create_bench_file, start_server, stop_server
+from download_engine import DownloadEngine
+from output_file import OutputFile
+
+STRATEGIES = ('pwrite', 'parts')
+
+
+class PartFilesOutput:
+    """Cách ghi cũ: mỗi phần một file .partN, ghép lại bằng read() toàn bộ phần"""
+
+    def __init__(self, path, size, resume=False, parts=4):
+        self.path = path
+        self.size = size
+        self.part_size = max(1, -(-size // parts))
+        self.parts = max(1, -(-size // self.part_size))
+        self.files = [open(f"{path}.part{i}", 'wb') for i in range(self.parts)]
+        self.locks = [threading.Lock() for _ in range(self.parts)]
+        self.resumed = False
+
+    def write_at(self, offset, data):
+        view = memoryview(data)
+        while view:
+            index = offset // self.part_size
+            take = min(len(view), (index + 1) * self.part_size - offset)
+            with self.locks[index]:
+                self.files[index].seek(offset - index * self.part_size)
+                self.files[index].write(view[:take])
+            view = view[take:]
+            offset += take
+
+    def sync(self):
+        for f, lock in zip(self.files, self.locks):
+            with lock:
+                f.flush()
+                os.fsync(f.fileno())
+
+    def close(self):
+        for f in self.files:
+            f.close()
+
+    def commit(self):
+        self.close()
+        with open(self.path, 'wb') as outfile:
+            for i in range(self.parts):
+                with open(f"{self.path}.part{i}", 'rb') as infile:
+                    outfile.write(infile.read())
+                os.remove(f"{self.path}.part{i}")
+
+    def discard(self):
+        for i, f in enumerate(self.files):
+            f.close()
+            try:
+                os.remove(f"{self.path}.part{i}")
+            except OSError:
+                pass
+
+
+def read_io_counters():
+    """wchar (byte ghi qua syscall) và write_bytes (byte gửi xuống thiết bị) của tiến trình"""
+    counters = {}
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                name, value = line.split(':')
+                counters[name] = int(value)
+    except OSError:
+        pass
+    return counters
+
+
+def run_strategy(strategy, host, port, directory, result_queue):
+    engine = DownloadEngine(host, port, directory, codecs=[])
+    if strategy == 'parts':
+        engine.output_factory = PartFilesOutput
+    else:
+        engine.output_factory = OutputFile
+    before = read_io_counters()
+    start = time.perf_counter()
+    engine.submit(BENCH_FILENAME).wait()
+    # Đưa dữ liệu xuống đĩa để tính cả chi phí ghi thật
+    fd = os.open(os.path.join(directory, BENCH_FILENAME), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    elapsed = time.perf_counter() - start
+    after = read_io_counters()
+    result_queue.put({
+        'elapsed': elapsed,
+        'wchar': after.get('wchar', 0) - before.get('wchar', 0),
+        'write_bytes': after.get('write_bytes', 0) - before.get('write_bytes', 0),
+        'max_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cách ghi file của download_engine")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5602)
+    parser.add_argument('--file-size', type=int, default=1024, help="Kích thước file (MB)")
+    parser.add_argument('--strategies', nargs='+', choices=STRATEGIES, default=list(STRATEGIES))
+    parser.add_argument('--dir', help="Thư mục lưu file tải về (mặc định thư mục tạm)")
+    args = parser.parse_args()
+
+    size = args.file_size * 1024 * 1024
+    context = multiprocessing.get_context('spawn')
+    results = []
+    with tempfile.TemporaryDirectory() as server_dir:
+        create_bench_file(server_dir, size)
+        proc = start_server(server_dir, args.host, args.port, 'thread')
+        try:
+            for strategy in args.strategies:
+                download_dir = tempfile.mkdtemp(dir=args.dir)
+                try:
+                    # Mỗi cách ghi chạy trong tiến trình riêng để đo bộ nhớ đỉnh riêng
+                    queue = context.Queue()
+                    worker = context.Process(target=run_strategy,
+                                             args=(strategy, args.host, args.port,
+                                                   download_dir, queue))
+                    worker.start()
+                    stats = queue.get()
+                    worker.join()
+                    results.append((strategy, stats))
+                finally:
+                    shutil.rmtree(download_dir, ignore_errors=True)
+        finally:
+            stop_server(proc)
+
+    mb = 1024 * 1024
+    print(f"{'strategy':<10}{'time (s)':>10}{'MB/s':>10}{'wchar MB':>11}"
+          f"{'disk MB':>10}{'peak RSS MB':>13}")
+    for strategy, stats in results:
+        print(f"{strategy:<10}{stats['elapsed']:>10.2f}{size / mb / stats['elapsed']:>10.1f}"
+              f"{stats['wchar'] / mb:>11.1f}{stats['write_bytes'] / mb:>10.1f}"
+              f"{stats['max_rss'] / mb:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# bench_recv.py
+# Micro-benchmark đường nhận dữ liệu TCP: recv() cấp phát bytes mới mỗi lần so
+# với recv_into() vào buffer dùng lại, với các kích thước đọc và SO_RCVBUF khác nhau.
+# Ví dụ: python bench_recv.py --size-mb 512 --read-sizes 4K 64K 256K 1M --rcvbuf 0 4M
+import argparse
+import multiprocessing
+import socket
+import time
+
+from ratelimit import parse_rate
+from tcp_protocol import SocketOptions, open_connection
+
+MODES = ('recv', 'recv_into')
+SEND_BLOCK = 1024 * 1024
+
+
+def _send(port, size, sndbuf):
+    """Tiến trình gửi: đẩy size byte qua kết nối tới port rồi đóng"""
+    sock = open_connection('127.0.0.1', port, options=SocketOptions(sndbuf=sndbuf))
+    block = memoryview(bytes(SEND_BLOCK))
+    remaining = size
+    with sock:
+        while remaining:
+            n = min(remaining, SEND_BLOCK)
+            sock.sendall(block[:n])
+            remaining -= n
+
+
+def _receive_recv(sock, read_size):
+    calls = received = 0
+    while True:
+        data = sock.recv(read_size)
+        calls += 1
+        if not data:
+            return received, calls
+        received += len(data)
+
+
+def _receive_recv_into(sock, read_size):
+    buffer = memoryview(bytearray(read_size))
+    calls = received = 0
+    while True:
+        n = sock.recv_into(buffer, read_size)
+        calls += 1
+        if not n:
+            return received, calls
+        received += n
+
+
+def run_once(mode, read_size, rcvbuf, sndbuf, size, context):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    # Đặt trước listen để kết nối được accept thừa hưởng kích thước buffer
+    SocketOptions(rcvbuf=rcvbuf).apply(listener)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    sender = context.Process(target=_send, args=(listener.getsockname()[1], size, sndbuf))
+    sender.start()
+    try:
+        sock, _ = listener.accept()
+        with sock:
+            receive = _receive_recv if mode == 'recv' else _receive_recv_into
+            start = time.perf_counter()
+            received, calls = receive(sock, read_size)
+            elapsed = time.perf_counter() - start
+    finally:
+        listener.close()
+        sender.join()
+    if received != size:
+        raise RuntimeError(f"Chỉ nhận được {received}/{size} bytes")
+    mb = size / (1024 * 1024)
+    return mb / elapsed, calls / mb
+
+
+def format_size(n):
+    if not n:
+        return 'default'
+    for unit, scale in (('M', 1024 * 1024), ('K', 1024)):
+        if n >= scale and n % scale == 0:
+            return f"{n // scale}{unit}"
+    return str(n)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark recv và recv_into trên loopback")
+    parser.add_argument('--size-mb', type=int, default=512, help="Số MB gửi cho mỗi lần đo")
+    parser.add_argument('--read-sizes', nargs='+', type=parse_rate,
+                        default=[4096, 16384, 65536, 262144, 1048576])
+    parser.add_argument('--rcvbuf', nargs='+', type=parse_rate, default=[0],
+                        help="Các giá trị SO_RCVBUF cần đo (0 = mặc định hệ thống)")
+    parser.add_argument('--sndbuf', type=parse_rate, default=0)
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    args = parser.parse_args()
+
+    size = args.size_mb * 1024 * 1024
+    context = multiprocessing.get_context('spawn')
+    print(f"{'mode':<11}{'read size':>10}{'rcvbuf':>10}{'MB/s':>10}{'recv/MB':>10}")
+    for rcvbuf in args.rcvbuf:
+        for read_size in args.read_sizes:
+            for mode in args.modes:
+                rate, calls = run_once(mode, read_size, rcvbuf, args.sndbuf, size, context)
+                print(f"{mode:<11}{format_size(read_size):>10}{format_size(rcvbuf):>10}"
+                      f"{rate:>10.1f}{calls:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+# bench_tcp_server.py
+# Đo số kết nối/giây và throughput tổng của tcp_server ở các chế độ khác nhau.
+# Ví dụ: python bench_tcp_server.py --modes thread async --concurrency 10 100 1000
+#        python bench_tcp_server.py --modes thread --workers 1 2 4 --clients 4
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from tcp_protocol import HEADER_SIZE, MSG_DATA, MSG_GET, pack_header, unpack_header
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tcp_server.py')
+BENCH_FILENAME = 'bench.bin'
+
+
+def create_bench_file(directory, size):
+    """Tạo file dữ liệu ngẫu nhiên và files.txt tương ứng"""
+    path = os.path.join(directory, BENCH_FILENAME)
+    block = os.urandom(1024 * 1024)
+    with open(path, 'wb') as f:
+        remaining = size
+        while remaining > 0:
+            f.write(block[:remaining])
+            remaining -= len(block)
+    with open(os.path.join(directory, 'files.txt'), 'w', encoding='utf-8') as f:
+        f.write(f"{BENCH_FILENAME} {size}\n")
+
+
+def start_server(directory, host, port, mode, workers=1, extra_args=()):
+    cmd = [
+        sys.executable, SERVER_SCRIPT,
+        '--host', host, '--port', str(port), '--mode', mode,
+        '--workers', str(workers),
+        '--backlog', '4096', '--max-connections', '4096',
+        '--log-level', 'WARNING',
+        *extra_args,
+    ]
+    proc = subprocess.Popen(cmd, cwd=directory)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"Server {mode} không khởi động được")
+
+
+def stop_server(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+async def fetch_segment(host, port, offset, length):
+    """Một kết nối segment: yêu cầu một đoạn của file và đọc hết dữ liệu"""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        body = json.dumps({'filename': BENCH_FILENAME}).encode()
+        writer.write(pack_header(MSG_GET, request_id=1, offset=offset,
+                                 count=length, length=len(body)) + body)
+        await writer.drain()
+        frame = unpack_header(await reader.readexactly(HEADER_SIZE))
+        if frame.type != MSG_DATA:
+            return 0
+        received = 0
+        while received < frame.length:
+            data = await reader.read(min(256 * 1024, frame.length - received))
+            if not data:
+                break
+            received += len(data)
+        return received
+    finally:
+        writer.close()
+
+
+async def run_load(host, port, concurrency, total_connections, segment_size, file_size):
+    per_worker = max(1, total_connections // concurrency)
+    span = max(1, file_size - segment_size)
+    stats = {'connections': 0, 'bytes': 0, 'errors': 0}
+
+    async def worker(worker_id):
+        for i in range(per_worker):
+            offset = ((worker_id * per_worker + i) * segment_size) % span
+            try:
+                received = await fetch_segment(host, port, offset, segment_size)
+            except (OSError, asyncio.IncompleteReadError):
+                stats['errors'] += 1
+                continue
+            if received != segment_size:
+                stats['errors'] += 1
+            stats['connections'] += 1
+            stats['bytes'] += received
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    stats['elapsed'] = time.perf_counter() - started
+    return stats
+
+
+def _run_load_process(*args):
+    return asyncio.run(run_load(*args))
+
+
+def run_level(args, concurrency):
+    """Chạy tải ở một mức concurrency, chia cho args.clients tiến trình sinh tải"""
+    clients = max(1, min(args.clients, concurrency))
+    if clients == 1:
+        return _run_load_process(args.host, args.port, concurrency, args.connections,
+                                 args.segment_size, args.file_size)
+
+    jobs = [
+        (args.host, args.port, concurrency // clients + (i < concurrency % clients),
+         args.connections // clients, args.segment_size, args.file_size)
+        for i in range(clients)
+    ]
+    with multiprocessing.Pool(clients) as pool:
+        parts = pool.starmap(_run_load_process, jobs)
+    return {
+        'connections': sum(p['connections'] for p in parts),
+        'bytes': sum(p['bytes'] for p in parts),
+        'errors': sum(p['errors'] for p in parts),
+        'elapsed': max(p['elapsed'] for p in parts),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark tcp_server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5900)
+    parser.add_argument('--modes', nargs='+', default=['thread', 'async'])
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[10, 100, 1000])
+    parser.add_argument('--connections', type=int, default=2000,
+                        help="Tổng số kết nối segment cho mỗi mức concurrency")
+    parser.add_argument('--segment-size', type=int, default=256 * 1024)
+    parser.add_argument('--file-size', type=int, default=64 * 1024 * 1024)
+    parser.add_argument('--workers', nargs='+', type=int, default=[1],
+                        help="Số worker của server cần đo, để so sánh speedup")
+    parser.add_argument('--clients', type=int, default=1,
+                        help="Số tiến trình sinh tải")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        create_bench_file(directory, args.file_size)
+        for mode in args.modes:
+            for workers in args.workers:
+                proc = start_server(directory, args.host, args.port, mode, workers)
+                try:
+                    for concurrency in args.concurrency:
+                        stats = run_level(args, concurrency)
+                        results.append((mode, workers, concurrency, stats))
+                        print(format_result(mode, workers, concurrency, stats), flush=True)
+                finally:
+                    stop_server(proc)
+
+    # Throughput của số worker nhỏ nhất làm mốc để tính speedup
+    baseline = {}
+    for mode, workers, concurrency, stats in results:
+        if workers == min(args.workers):
+            baseline[mode, concurrency] = stats['bytes'] / (stats['elapsed'] or 1e-9)
+
+    print()
+    print(f"{'mode':<10}{'workers':>8}{'conc':>6}{'conn/s':>12}{'MB/s':>12}"
+          f"{'speedup':>9}{'errors':>8}")
+    for mode, workers, concurrency, stats in results:
+        elapsed = stats['elapsed'] or 1e-9
+        throughput = stats['bytes'] / elapsed
+        speedup = throughput / baseline[mode, concurrency] if baseline[mode, concurrency] else 0
+        print(f"{mode:<10}{workers:>8}{concurrency:>6}{stats['connections'] / elapsed:>12.1f}"
+              f"{throughput / (1024 * 1024):>12.1f}{speedup:>8.2f}x{stats['errors']:>8}")
+
+
+def format_result(mode, workers, concurrency, stats):
+    elapsed = stats['elapsed'] or 1e-9
+    return (f"[{mode} x{workers}] concurrency={concurrency}: {stats['connections']} kết nối "
+            f"trong {elapsed:.2f}s, {stats['connections'] / elapsed:.1f} conn/s, "
+            f"{stats['bytes'] / elapsed / (1024 * 1024):.1f} MB/s, lỗi={stats['errors']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# bench_udp.py
+# Benchmark truyền file qua UDP (udp_server/udp_client) trên loopback với các
+# bộ điều khiển tắc nghẽn và tỉ lệ mất gói giả lập khác nhau: thông lượng, số
+# lần gửi lại, cửa sổ tắc nghẽn cuối cùng và số lần giảm cửa sổ. Với --fec
+# client xin gói parity (fec.py): thêm số chunk dựng lại và cỡ nhóm cuối cùng.
+# Ví dụ: python bench_udp.py --size-mb 64 --congestion aimd delay --loss 0 0.01 0.05 --fec
+import argparse
+import contextlib
+import io
+import multiprocessing
+import os
+import random
+import socket
+import tempfile
+import time
+
+BENCH_FILENAME = 'bench_udp.bin'
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _serve(directory, port, congestion, loss, results, ready):
+    """Tiến trình server: bỏ ngẫu nhiên tỉ lệ `loss` gói dữ liệu trước khi gửi"""
+    os.chdir(directory)
+    import udp_server
+
+    class LossyServer(udp_server.FileServer):
+        def send_chunk(self, session, chunk_num, chunk_data):
+            if random.random() < loss:
+                return True
+            return super().send_chunk(session, chunk_num, chunk_data)
+
+        def send_parity(self, session, packet):
+            if random.random() >= loss:
+                super().send_parity(session, packet)
+
+        def finish_transfer(self, session, status=None):
+            window, encoder = session.transfer.window, session.transfer.fec
+            super().finish_transfer(session, status)
+            results.put({
+                'retransmissions': window.retransmissions,
+                'cwnd': window.controller.cwnd,
+                'losses': window.controller.losses,
+                'srtt': window.rtt.srtt or 0.0,
+                'rebuilt': encoder.recovered if encoder else 0,
+                'group': encoder.group if encoder else 0,
+            })
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        server = LossyServer(host='127.0.0.1', port=port, congestion=congestion)
+        server.read_available_files()
+        ready.set()
+        server.serve_forever()
+
+
+def _download(directory, port, use_fec, results):
+    os.chdir(directory)
+    from udp_client import FileClient
+
+    client = FileClient('127.0.0.1', port, use_fec=use_fec)
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        ok = client.download_file(BENCH_FILENAME)
+        elapsed = time.perf_counter() - start
+    client.sock.close()
+    results.put((ok, elapsed))
+
+
+def run_once(directory, size, congestion, loss, use_fec, context):
+    port = _free_port()
+    server_results = context.Queue()
+    client_results = context.Queue()
+    ready = context.Event()
+    server = context.Process(target=_serve,
+                             args=(directory, port, congestion, loss, server_results, ready),
+                             daemon=True)
+    server.start()
+    try:
+        if not ready.wait(10):
+            raise RuntimeError("Server UDP không khởi động được")
+        client = context.Process(target=_download, args=(directory, port, use_fec, client_results))
+        client.start()
+        ok, elapsed = client_results.get(timeout=600)
+        client.join()
+        stats = server_results.get(timeout=10)
+    finally:
+        server.terminate()
+        server.join()
+    if not ok:
+        raise RuntimeError(f"Tải không thành công ({congestion}, loss {loss})")
+    with open(os.path.join(directory, 'downloads', BENCH_FILENAME), 'rb') as f, \
+            open(os.path.join(directory, BENCH_FILENAME), 'rb') as g:
+        if f.read() != g.read():
+            raise RuntimeError("File tải về khác file gốc")
+    stats['rate'] = size / (1024 * 1024) / elapsed
+    stats['elapsed'] = elapsed
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark truyền file UDP trên loopback")
+    parser.add_argument('--size-mb', type=int, default=64)
+    parser.add_argument('--congestion', nargs='+', choices=('aimd', 'delay'),
+                        default=['aimd', 'delay'])
+    parser.add_argument('--loss', nargs='+', type=float, default=[0.0, 0.01, 0.05],
+                        help="Tỉ lệ gói dữ liệu bị bỏ (0-1)")
+    parser.add_argument('--fec', action='store_true', help="Client xin gói parity XOR")
+    parser.add_argument('--dir', help="Thư mục tạm chứa file benchmark")
+    args = parser.parse_args()
+
+    size = args.size_mb * 1024 * 1024
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        with open(os.path.join(directory, BENCH_FILENAME), 'wb') as f:
+            f.write(os.urandom(size))
+        with open(os.path.join(directory, 'files.txt'), 'w') as f:
+            f.write(f"{BENCH_FILENAME} {size}\n")
+
+        print(f"{'congestion':<11}{'loss':>6}{'time':>8}{'MB/s':>9}{'resent':>8}"
+              f"{'cwnd':>7}{'cuts':>6}{'srtt ms':>9}{'rebuilt':>9}{'group':>7}")
+        for congestion in args.congestion:
+            for loss in args.loss:
+                stats = run_once(directory, size, congestion, loss, args.fec, context)
+                print(f"{congestion:<11}{loss:>6.2f}{stats['elapsed']:>8.2f}"
+                      f"{stats['rate']:>9.1f}{stats['retransmissions']:>8}"
+                      f"{stats['cwnd']:>7.0f}{stats['losses']:>6}"
+                      f"{stats['srtt'] * 1000:>9.2f}{stats['rebuilt']:>9}{stats['group']:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+# catalog.py
+import logging
+import os
+import threading
+from collections import deque, namedtuple
+
+from fswatch import watch_directory
+
+CatalogEntry = namedtuple('CatalogEntry', 'size mtime_ns')
+
+# Số diff gần nhất được giữ lại để gửi cho client đang theo dõi
+HISTORY_SIZE = 64
+# Thời gian chờ cho tới khi không còn sự kiện mới trước khi cập nhật
+SETTLE_TIME = 0.05
+
+
+class Catalog:
+    """Danh sách file được phục vụ, kích thước lấy từ os.stat.
+
+    files.txt chỉ quyết định tên file nào được chia sẻ; cột kích thước
+    trong đó (nếu có) bị bỏ qua. Sau lần nạp đầu, refresh() chỉ stat lại
+    những file được watcher báo là thay đổi, nên chi phí tỉ lệ với số file
+    thay đổi thay vì tổng số file.
+    """
+
+    def __init__(self, list_file='files.txt', root='.', poll_interval=1.0):
+        self.list_file = list_file
+        self.root = root
+        self.poll_interval = poll_interval
+        self.entries = {}
+        self.version = 0
+        self._listed = set()
+        self._history = deque(maxlen=HISTORY_SIZE)
+        self._watcher = None
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def load(self):
+        """Nạp toàn bộ catalog (quét tất cả các file)"""
+        self._scan(full=True)
+
+    def start_watching(self):
+        """Bật watcher rồi quét lại một lần: thay đổi xảy ra giữa load() và lúc
+        watcher bắt đầu theo dõi không tạo sự kiện nào nên sẽ bị bỏ sót"""
+        if self._watcher is None:
+            self._watcher = watch_directory(self.root, self.poll_interval)
+            self._scan()
+
+    def _scan(self, full=False):
+        listed = self._read_list()
+        changes = {name: self._stat(name) for name in listed}
+        if full:
+            for name in sorted(name for name, entry in changes.items() if entry is None):
+                logging.warning(f"File {name} không tồn tại trong thư mục")
+        for name in self.entries:
+            changes.setdefault(name, None)
+        return self._apply(listed, changes, full)
+
+    def refresh(self, timeout=0):
+        """Chờ thay đổi tối đa timeout giây rồi cập nhật catalog.
+
+        Trả về diff {'version', 'updated', 'removed'} nếu catalog thay đổi,
+        ngược lại trả về None.
+        """
+        self.start_watching()
+        names = self._watcher.poll(timeout)
+        # Gom các sự kiện liền nhau (ví dụ files.txt đang được ghi dở) rồi mới áp dụng
+        while names:
+            more = self._watcher.poll(SETTLE_TIME)
+            if not more:
+                names = more if more is None else names
+                break
+            names |= more
+        if names is None:
+            # Không biết file nào thay đổi: quét lại toàn bộ
+            listed = self._read_list()
+            changed = listed | self._listed
+        else:
+            if not names:
+                return None
+            listed = self._listed
+            changed = names & listed
+            if os.path.basename(self.list_file) in names:
+                listed = self._read_list()
+                # Tên bị thêm vào hoặc bỏ khỏi files.txt cũng cần xét lại
+                changed |= (names & listed) | (listed ^ self._listed)
+
+        changes = {name: self._stat(name) if name in listed else None for name in changed}
+        return self._apply(listed, changes)
+
+    def _apply(self, listed, changes, full=False):
+        """Áp dụng {tên: CatalogEntry hoặc None (bị xóa)} vào catalog"""
+        updated = {}
+        removed = []
+        with self._lock:
+            self._listed = listed
+            for name, entry in changes.items():
+                old = self.entries.get(name)
+                if entry is None:
+                    if old is not None:
+                        del self.entries[name]
+                        removed.append(name)
+                elif old != entry:
+                    self.entries[name] = entry
+                    updated[name] = entry._asdict()
+            if not updated and not removed and not full:
+                return None
+            self.version += 1
+            diff = {'version': self.version, 'updated': updated, 'removed': removed}
+            self._history.append(diff)
+            self._changed.notify_all()
+        if not full:
+            logging.info(f"Catalog v{self.version}: cập nhật {list(updated)}, xóa {removed}")
+        return diff
+
+    def _read_list(self):
+        names = set()
+        with open(self.list_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.split()
+                if not parts:
+                    continue
+                if len(parts) > 2:
+                    logging.error(f"Định dạng không hợp lệ trong {self.list_file}: {line}")
+                    continue
+                names.add(parts[0])
+        return names
+
+    def _stat(self, name):
+        try:
+            st = os.stat(os.path.join(self.root, name))
+        except OSError:
+            return None
+        return CatalogEntry(st.st_size, st.st_mtime_ns)
+
+    def get(self, name):
+        return self.entries.get(name)
+
+    def sizes(self):
+        """Dạng cũ {tên file: kích thước}"""
+        with self._lock:
+            return {name: entry.size for name, entry in self.entries.items()}
+
+    def snapshot(self):
+        """Toàn bộ catalog để gửi cho client"""
+        with self._lock:
+            return {
+                'version': self.version,
+                'files': {name: entry._asdict() for name, entry in self.entries.items()},
+            }
+
+    def changes_since(self, version):
+        """Gộp các diff sau version; None nếu lịch sử không còn đủ để tính"""
+        with self._lock:
+            if version == self.version:
+                return {'version': version, 'updated': {}, 'removed': []}
+            diffs = [d for d in self._history if d['version'] > version]
+            if not diffs or diffs[0]['version'] != version + 1:
+                return None
+        updated = {}
+        removed = set()
+        for diff in diffs:
+            for name in diff['removed']:
+                updated.pop(name, None)
+                removed.add(name)
+            for name, meta in diff['updated'].items():
+                removed.discard(name)
+                updated[name] = meta
+        return {'version': diffs[-1]['version'], 'updated': updated, 'removed': sorted(removed)}
+
+    def wait_for_change(self, version, timeout=None):
+        """Chờ tới khi catalog có version mới hơn version, trả về version hiện tại"""
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    def close(self):
+        if self._watcher is not None:
+            self._watcher.close()
+            self._watcher = None
@@ -0,0 +1,145 @@
+# compression.py
+# Nén theo block cố định cho response DATA: mỗi block được nén độc lập nên
+# một đoạn bất kỳ vẫn ánh xạ thẳng vào các block của file.
+import lzma
+import os
+import threading
+import zlib
+from collections import OrderedDict
+
+COMPRESSION_BLOCK_SIZE = 256 * 1024
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+# Chi phí ước tính của mỗi entry trong cache, kể cả dấu hiệu block không nén được
+ENTRY_OVERHEAD = 128
+
+# Mã codec nằm trong trường flags của frame DATA, 0 là dữ liệu thô
+CODEC_RAW = 0
+CODECS = {f'zlib:{level}': level for level in range(1, 10)}
+CODECS['lzma'] = 10
+CODEC_NAMES = {codec_id: name for name, codec_id in CODECS.items()}
+
+# Các định dạng đã nén sẵn, không nén lại
+INCOMPRESSIBLE_EXTENSIONS = {
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.lzma', '.zst', '.7z', '.rar',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.mp3', '.mp4', '.mkv', '.avi',
+    '.mov', '.webm', '.pdf',
+}
+# Nén thử phần đầu file, tỉ lệ lớn hơn ngưỡng thì coi như không nén được
+SAMPLE_SIZE = 64 * 1024
+SAMPLE_RATIO = 0.9
+
+
+def compress(codec_id, data):
+    if codec_id == CODECS['lzma']:
+        return lzma.compress(data)
+    return zlib.compress(data, codec_id)
+
+
+def decompress(codec_id, data, max_size):
+    """Giải nén, báo lỗi nếu kết quả dài hơn max_size byte"""
+    if codec_id == CODECS['lzma']:
+        decompressor = lzma.LZMADecompressor()
+    elif codec_id in CODEC_NAMES:
+        decompressor = zlib.decompressobj()
+    else:
+        raise ValueError(f"Codec không hỗ trợ: {codec_id}")
+    result = decompressor.decompress(data, max_size + 1)
+    if len(result) > max_size:
+        raise ValueError(f"Dữ liệu giải nén dài hơn {max_size} bytes")
+    return result
+
+
+class BlockCompressor:
+    """Chọn codec cho từng request và cache các block đã nén, giới hạn theo bộ nhớ"""
+
+    def __init__(self, max_cache_bytes=DEFAULT_CACHE_BYTES, block_size=COMPRESSION_BLOCK_SIZE):
+        self.max_cache_bytes = max_cache_bytes
+        self.block_size = block_size
+        self.cache_bytes = 0
+        self._blocks = OrderedDict()
+        self._compressible = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def choose_codec(self, path, entry, accepted):
+        """Codec đầu tiên client chấp nhận mà server hỗ trợ, None nếu không nên nén"""
+        if not accepted:
+            return None
+        codec_id = next((CODECS[name] for name in accepted if name in CODECS), None)
+        if codec_id is None or not self._is_compressible(path, entry):
+            return None
+        return codec_id
+
+    def _is_compressible(self, path, entry):
+        if os.path.splitext(path)[1].lower() in INCOMPRESSIBLE_EXTENSIONS:
+            return False
+        key = (path, entry.signature)
+        result = self._compressible.get(key)
+        if result is None:
+            sample = entry.view(0, min(SAMPLE_SIZE, entry.size))
+            result = len(zlib.compress(sample, 1)) < SAMPLE_RATIO * len(sample)
+            with self._lock:
+                if len(self._compressible) > 4096:
+                    self._compressible.clear()
+                self._compressible[key] = result
+        return result
+
+    def pieces(self, offset, count):
+        """Chia đoạn [offset, offset + count) theo lưới block, trả về các (offset, count)"""
+        end = offset + count
+        while offset < end:
+            block_end = (offset // self.block_size + 1) * self.block_size
+            piece_end = min(block_end, end)
+            yield offset, piece_end - offset
+            offset = piece_end
+
+    def compress_piece(self, path, entry, codec_id, offset, count):
+        """Nén một phần nằm trong một block, trả về (codec_id, payload).
+
+        Nếu bản nén không nhỏ hơn dữ liệu gốc thì trả về (CODEC_RAW, None)
+        để người gọi gửi dữ liệu thô. Chỉ các block đầy đủ được cache.
+        """
+        whole_block = offset % self.block_size == 0 and (
+            count == self.block_size or offset + count == entry.size)
+        key = (path, entry.signature, codec_id, offset)
+        if whole_block:
+            with self._lock:
+                payload = self._blocks.get(key)
+                if payload is not None:
+                    self._blocks.move_to_end(key)
+                    self.hits += 1
+                    return self._result(codec_id, payload)
+                self.misses += 1
+
+        payload = compress(codec_id, entry.view(offset, count))
+        if len(payload) >= count:
+            # Block không nén được: chỉ cache dấu hiệu rỗng thay vì cả bản nén
+            payload = b''
+        if whole_block:
+            self._store(key, payload)
+        return self._result(codec_id, payload)
+
+    def _result(self, codec_id, payload):
+        if not payload:
+            return CODEC_RAW, None
+        return codec_id, payload
+
+    def _store(self, key, payload):
+        with self._lock:
+            if key in self._blocks or len(payload) > self.max_cache_bytes:
+                return
+            self._blocks[key] = payload
+            self.cache_bytes += len(payload) + ENTRY_OVERHEAD
+            while self.cache_bytes > self.max_cache_bytes:
+                _, old = self._blocks.popitem(last=False)
+                self.cache_bytes -= len(old) + ENTRY_OVERHEAD
+
+    def stats(self):
+        with self._lock:
+            return {
+                'blocks': len(self._blocks),
+                'bytes': self.cache_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
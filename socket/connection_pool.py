@@ -0,0 +1,171 @@
+# connection_pool.py
+# Giữ lại các kết nối tới tcp_server sau mỗi lượt dùng để các segment và các
+# file sau dùng lại, không phải bắt tay TCP và khởi động chậm (slow start)
+# lại từ đầu cho mỗi segment.
+import select
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from tcp_protocol import DEFAULT_READ_SIZE, ProtocolError, ServerConnection
+
+# Số kết nối mở tối đa (đang dùng và đang rảnh)
+DEFAULT_MAX_SIZE = 32
+# Kết nối rảnh lâu hơn chừng này bị đóng
+IDLE_TIMEOUT = 30.0
+# Kết nối rảnh lâu hơn chừng này được PING trước khi dùng lại
+PING_AFTER = 5.0
+PING_TIMEOUT = 2.0
+
+
+class ConnectionPool:
+    """Pool các ServerConnection tới một server.
+
+    Kết nối lấy ra bằng connection(); nếu khối lệnh lỗi (ví dụ hủy giữa
+    chừng khi server còn đang gửi) kết nối bị đóng thay vì trả lại pool,
+    vì trên đó có thể còn dữ liệu chưa đọc.
+    """
+
+    def __init__(self, host, port, max_size=DEFAULT_MAX_SIZE, idle_timeout=IDLE_TIMEOUT,
+                 connect_timeout=None, ping_after=PING_AFTER, socket_options=None,
+                 read_size=DEFAULT_READ_SIZE):
+        self.host = host
+        self.port = port
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.ping_after = ping_after
+        self.socket_options = socket_options
+        self.read_size = read_size
+        # (kết nối, thời điểm trả lại), kết nối dùng gần nhất ở cuối
+        self._idle = deque()
+        self._open = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        # Số kết nối đã tạo mới và số lần dùng lại kết nối có sẵn
+        self.created = 0
+        self.reused = 0
+        self._reaper = None
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        except BaseException:
+            self.release(conn, reusable=False)
+            raise
+        self.release(conn)
+
+    def acquire(self, timeout=None):
+        """Lấy một kết nối rảnh còn tốt hoặc mở kết nối mới; chờ nếu pool đã đầy"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            idle = self._take(deadline)
+            if idle is None:
+                try:
+                    conn = ServerConnection(self.host, self.port,
+                                            connect_timeout=self.connect_timeout,
+                                            options=self.socket_options,
+                                            read_size=self.read_size)
+                except BaseException:
+                    self._forget()
+                    raise
+                self.created += 1
+                return conn
+            conn, released = idle
+            if self._healthy(conn, time.monotonic() - released):
+                self.reused += 1
+                return conn
+            conn.close()
+            self._forget()
+
+    def _take(self, deadline):
+        """Lấy (kết nối, thời điểm trả lại) rảnh, hoặc None sau khi đã giữ chỗ cho kết nối mới"""
+        stale = []
+        try:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise ConnectionError("Pool kết nối đã đóng")
+                    stale += self._expire_idle(time.monotonic())
+                    if self._idle:
+                        return self._idle.pop()
+                    if self._open < self.max_size:
+                        self._open += 1
+                        return None
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError(f"Không có kết nối rảnh tới {self.host}:{self.port}")
+                    self._cond.wait(remaining)
+        finally:
+            self._close_all(stale)
+
+    def release(self, conn, reusable=True):
+        """Trả kết nối về pool, hoặc đóng nếu không dùng lại được"""
+        with self._cond:
+            if reusable and not self._closed:
+                self._idle.append((conn, time.monotonic()))
+                self._start_reaper()
+                self._cond.notify()
+                return
+        conn.close()
+        self._forget()
+
+    def close(self):
+        """Đóng các kết nối rảnh; kết nối đang dùng bị đóng khi được trả lại"""
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._open -= len(idle)
+            self._cond.notify_all()
+        self._stop.set()
+        for conn in idle:
+            conn.close()
+
+    def _healthy(self, conn, idle):
+        # Kết nối rảnh không được có dữ liệu chờ đọc: nếu đọc được thì server
+        # đã đóng kết nối (EOF/RST) hoặc gửi dữ liệu thừa
+        try:
+            readable, _, _ = select.select([conn.sock], [], [], 0)
+            if readable:
+                return False
+            if idle >= self.ping_after:
+                conn.ping(PING_TIMEOUT)
+        except (OSError, ValueError, ProtocolError):
+            return False
+        return True
+
+    def _forget(self):
+        with self._cond:
+            self._open -= 1
+            self._cond.notify()
+
+    def _expire_idle(self, now):
+        """Lấy ra các kết nối rảnh quá idle_timeout (gọi khi giữ _cond)"""
+        stale = []
+        while self._idle and now - self._idle[0][1] >= self.idle_timeout:
+            stale.append(self._idle.popleft()[0])
+        self._open -= len(stale)
+        return stale
+
+    def _close_all(self, conns):
+        for conn in conns:
+            conn.close()
+
+    def _start_reaper(self):
+        # Thread nền đóng kết nối rảnh quá lâu cả khi không ai dùng pool nữa
+        if self._reaper is None:
+            self._reaper = threading.Thread(target=self._reap, daemon=True)
+            self._reaper.start()
+
+    def _reap(self):
+        while not self._stop.wait(self.idle_timeout / 2):
+            with self._cond:
+                stale = self._expire_idle(time.monotonic())
+                if stale:
+                    self._cond.notify_all()
+            self._close_all(stale)
@@ -0,0 +1,171 @@
+# delta.py
+# Đồng bộ kiểu rsync cho file mà client đã có một bản cũ: client gửi chữ ký
+# (checksum yếu trượt được và checksum mạnh) của từng block trong bản cũ,
+# server quét bản mới bằng cửa sổ trượt và chỉ gửi các byte mới cùng tham
+# chiếu tới những block client đã có.
+import hashlib
+import json
+import math
+import struct
+import zlib
+
+# Kích thước block của chữ ký: khoảng căn bậc hai kích thước file như rsync
+MIN_BLOCK_SIZE = 2 * 1024
+MAX_BLOCK_SIZE = 256 * 1024
+# Chữ ký lớn hơn chừng này thì tăng kích thước block (phải vừa một frame điều khiển)
+MAX_SIGNATURE_BYTES = 8 * 1024 * 1024
+# Mỗi block: Adler-32 (checksum yếu) và 16 byte BLAKE2b (checksum mạnh)
+STRONG_SIZE = 16
+SIGNATURE_ENTRY = struct.Struct(f'!I{STRONG_SIZE}s')
+ADLER_MOD = 65521
+# Đoạn dữ liệu mới dài được gửi thành nhiều phần tối đa chừng này byte
+LITERAL_CHUNK = 256 * 1024
+# Trượt từng byte chạy bằng Python nên chậm: sau chừng này byte trượt liên
+# tiếp không khớp (nội dung hoàn toàn mới) chỉ thử các vị trí cách nhau một
+# block, tới khi khớp lại thì trượt tiếp
+ROLL_LIMIT = 4 * 1024 * 1024
+
+OP_COPY = 'copy'        # chép count byte từ vị trí source của bản cũ
+OP_LITERAL = 'literal'  # gửi count byte dữ liệu mới
+
+
+def choose_block_size(size):
+    """Kích thước block cho chữ ký của file size byte (lũy thừa của 2)"""
+    block_size = 1 << max(0, math.isqrt(size).bit_length() - 1)
+    block_size = min(MAX_BLOCK_SIZE, max(MIN_BLOCK_SIZE, block_size))
+    while math.ceil(size / block_size) * SIGNATURE_ENTRY.size > MAX_SIGNATURE_BYTES:
+        block_size *= 2
+    return block_size
+
+
+def strong_checksum(data):
+    return hashlib.blake2b(data, digest_size=STRONG_SIZE).digest()
+
+
+def file_signature(path, block_size):
+    """Chữ ký của file: các SIGNATURE_ENTRY liên tiếp, mỗi block một entry"""
+    entries = []
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            entries.append(SIGNATURE_ENTRY.pack(zlib.adler32(block), strong_checksum(block)))
+    return b''.join(entries)
+
+
+def encode_request(request, signature):
+    """Body của request DELTA: một dòng JSON rồi tới chữ ký dạng nhị phân"""
+    return json.dumps(request).encode() + b'\n' + signature
+
+
+def decode_request(body):
+    """Tách body DELTA thành (request, chữ ký), báo ValueError nếu sai định dạng"""
+    header, _, signature = bytes(body).partition(b'\n')
+    request = json.loads(header)
+    if not isinstance(request, dict):
+        raise ValueError("Request DELTA phải là object JSON")
+    return request, signature
+
+
+class Signature:
+    """Chữ ký bản cũ của client, tra cứu theo checksum yếu"""
+
+    def __init__(self, block_size, size, data):
+        if not isinstance(block_size, int) or block_size < MIN_BLOCK_SIZE:
+            raise ValueError(f"Kích thước block không hợp lệ: {block_size}")
+        if not isinstance(size, int) or size < 0:
+            raise ValueError(f"Kích thước file không hợp lệ: {size}")
+        count = math.ceil(size / block_size)
+        if len(data) != count * SIGNATURE_ENTRY.size:
+            raise ValueError(f"Chữ ký dài {len(data)} bytes, mong đợi {count} block")
+        self.block_size = block_size
+        self.size = size
+        # checksum yếu -> {checksum mạnh: block}, chỉ các block đủ block_size byte
+        self.blocks = {}
+        # (checksum yếu, checksum mạnh, block, độ dài) của block cuối nếu ngắn hơn
+        self.tail = None
+        for index, (weak, strong) in enumerate(SIGNATURE_ENTRY.iter_unpack(data)):
+            if index == count - 1 and size % block_size:
+                self.tail = (weak, strong, index, size % block_size)
+            else:
+                self.blocks.setdefault(weak, {}).setdefault(strong, index)
+
+
+def delta_ops(data, signature, roll_limit=ROLL_LIMIT):
+    """Các thao tác dựng lại data (bản mới) từ bản cũ của client, theo thứ tự vị trí.
+
+    Mỗi thao tác là (OP_COPY, offset, count, source) hoặc
+    (OP_LITERAL, offset, count, None) với dữ liệu là data[offset:offset + count].
+    Các block khớp liên tiếp trong cả hai bản được gộp thành một OP_COPY.
+    """
+    position = 0
+    copy = None
+    for offset, source, count in _matches(data, signature, roll_limit):
+        if copy is not None and offset == position and source == copy[1] + copy[2]:
+            copy[2] += count
+            position += count
+            continue
+        if copy is not None:
+            yield OP_COPY, copy[0], copy[2], copy[1]
+        yield from _literals(position, offset)
+        copy = [offset, source, count]
+        position = offset + count
+    if copy is not None:
+        yield OP_COPY, copy[0], copy[2], copy[1]
+    yield from _literals(position, len(data))
+
+
+def _literals(start, end):
+    for offset in range(start, end, LITERAL_CHUNK):
+        yield OP_LITERAL, offset, min(LITERAL_CHUNK, end - offset), None
+
+
+def _matches(data, signature, roll_limit):
+    """Các (offset, source, count) của data trùng một block trong bản cũ"""
+    size = len(data)
+    n = signature.block_size
+    blocks = signature.blocks
+    position = 0
+    matched_end = 0
+    # Số byte đã trượt kể từ lần khớp gần nhất
+    rolled = 0
+    while position + n <= size:
+        window = data[position:position + n]
+        weak = zlib.adler32(window)
+        candidates = blocks.get(weak)
+        if candidates:
+            index = candidates.get(strong_checksum(window))
+            if index is not None:
+                yield position, index * n, n
+                position += n
+                matched_end = position
+                rolled = 0
+                continue
+        if rolled >= roll_limit:
+            position += n
+            continue
+
+        # Trượt cửa sổ từng byte, cập nhật Adler-32 trong O(1), tới vị trí có
+        # checksum yếu trùng một block
+        a, b = weak & 0xFFFF, weak >> 16
+        start = position
+        limit = min(size - n, position + roll_limit - rolled)
+        while position < limit:
+            old, new = data[position], data[position + n]
+            a = (a - old + new) % ADLER_MOD
+            b = (b - n * old + a - 1) % ADLER_MOD
+            position += 1
+            if (b << 16 | a) in blocks:
+                break
+        if position == start:
+            # Cửa sổ đã chạm cuối file
+            break
+        rolled += position - start
+
+    if signature.tail is not None:
+        weak, strong, index, length = signature.tail
+        if size - matched_end >= length:
+            tail = data[size - length:]
+            if zlib.adler32(tail) == weak and strong_checksum(tail) == strong:
+                yield size - length, index * n, length
@@ -0,0 +1,613 @@
+# download_engine.py
+# Bộ tải file theo segment từ tcp_server, không phụ thuộc giao diện: dùng
+# được từ tcp_client (GUI), từ dòng lệnh hoặc từ script.
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+
+from connection_pool import ConnectionPool
+from delta import choose_block_size, file_signature
+from file_scheduler import ORDER_FIFO, ORDER_SMALLEST, ORDERS, ConnectionBudget, FileScheduler
+from integrity import StreamVerifier
+from journal import CompletedFiles, DownloadJournal
+from output_file import OutputFile
+from progress import ProgressAggregator
+from segments import Segment, SegmentScheduler
+from ratelimit import parse_rate
+from tcp_protocol import DEFAULT_READ_SIZE, ProtocolError, ServerConnection, SocketOptions
+
+# Số segment (kết nối song song) tối đa cho mỗi file. Lượt tải bắt đầu với
+# INITIAL_SEGMENTS kết nối và thêm dần sau mỗi PROBE_INTERVAL giây nếu tốc độ
+# tổng tăng ít nhất MIN_RATE_GAIN so với lần thêm trước
+DEFAULT_SEGMENTS = 8
+INITIAL_SEGMENTS = 2
+PROBE_INTERVAL = 0.5
+MIN_RATE_GAIN = 0.1
+# Mỗi segment (và phần bị lấy bớt) dài ít nhất chừng này
+MIN_SEGMENT_SIZE = 4 * 1024 * 1024
+# Số file được tải cùng lúc, các file khác chờ tới lượt
+DEFAULT_MAX_ACTIVE = 4
+# Tổng số kết nối tải dữ liệu của mọi file đang tải
+DEFAULT_MAX_CONNECTIONS = 16
+# Mỗi segment được tải thành các đoạn PIECE_SIZE, gửi trước tối đa PIPELINE_WINDOW request
+PIECE_SIZE = 1024 * 1024
+PIPELINE_WINDOW = 8
+# Số lần tải lại các block sai hash trước khi bỏ cuộc
+MAX_BLOCK_RETRIES = 3
+# Codec nén chấp nhận từ server, theo thứ tự ưu tiên (để trống để tắt nén)
+ACCEPT_CODECS = ['zlib:6']
+CONNECT_TIMEOUT = 5
+CATALOG_RETRY_DELAY = 5
+
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+class DownloadError(Exception):
+    """Tải file không thành công"""
+
+
+class DownloadCancelled(DownloadError):
+    """Lượt tải bị hủy bằng cancel()"""
+
+
+class DownloadTask:
+    """Một lượt tải file, do DownloadEngine.submit trả về.
+
+    on_progress(task) được gọi từ thread tổng hợp tiến độ của engine, mỗi
+    progress.PROGRESS_INTERVAL giây khi có thay đổi; on_done(task) được gọi
+    một lần khi lượt tải kết thúc.
+    """
+
+    def __init__(self, filename, path, on_progress=None, on_done=None, priority=0,
+                 deadline=None, size=None):
+        self.filename = filename
+        self.path = path
+        # Kích thước đã biết từ catalog, dùng để xếp lịch file nhỏ trước
+        self.size = size
+        # priority lớn chạy trước; deadline (time.time()) cho thứ tự theo hạn chót
+        self.priority = priority
+        self.deadline = deadline
+        # Các Segment được tải song song
+        self.segments = []
+        # Số byte đã có từ lần tải trước (tải tiếp) hoặc đã dựng bằng DELTA, không tính vào tốc độ
+        self.resumed = 0
+        # Số byte lấy từ bản cũ (COPY) trong lúc đang dựng bằng DELTA, không đi qua mạng
+        self.reused = 0
+        # Số byte DELTA đã nhận qua mạng, vẫn tính vào tốc độ sau khi DELTA xong
+        self.delta_received = 0
+        # True nếu file đã được tải xong từ trước nên không phải tải lại
+        self.skipped = False
+        # {"literal", "copied"} (byte) nếu file được dựng từ bản cũ bằng DELTA
+        self.delta = None
+        self.state = QUEUED
+        self.error = None
+        self.started = None
+        self.finished = None
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self._cancelled = threading.Event()
+        self._done = threading.Event()
+
+    @property
+    def received(self):
+        """Số byte đã có, cộng từ bộ đếm của từng segment"""
+        return (self.resumed + self.reused
+                + sum(segment.received for segment in list(self.segments)))
+
+    @property
+    def progress(self):
+        """Tỉ lệ đã tải, từ 0 tới 1"""
+        if self.state == COMPLETED:
+            return 1.0
+        if not self.size:
+            return 0.0
+        return min(1.0, self.received / self.size)
+
+    @property
+    def speed(self):
+        """Tốc độ trung bình (byte/giây) từ lúc bắt đầu tải, chỉ tính byte nhận qua mạng"""
+        if self.started is None:
+            return 0.0
+        elapsed = (self.finished or time.monotonic()) - self.started
+        transferred = self.delta_received + sum(segment.received
+                                                for segment in list(self.segments))
+        return transferred / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def wait(self, timeout=None):
+        """Chờ lượt tải kết thúc; báo lỗi nếu tải hỏng hoặc bị hủy"""
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"{self.filename} chưa tải xong")
+        if self.state == CANCELLED:
+            raise DownloadCancelled(f"Đã hủy tải {self.filename}")
+        if self.state == FAILED:
+            raise DownloadError(f"Lỗi tải {self.filename}: {self.error}") from self.error
+        return self
+
+    async def wait_async(self):
+        """Như wait(), dùng được trong asyncio"""
+        return await asyncio.get_running_loop().run_in_executor(None, self.wait)
+
+    def _check_cancelled(self):
+        if self._cancelled.is_set():
+            raise DownloadCancelled(f"Đã hủy tải {self.filename}")
+
+    def _finish(self, state, error=None):
+        self.state = state
+        self.error = error
+        self.finished = time.monotonic()
+        self._done.set()
+        if self.on_done:
+            self.on_done(self)
+
+
+class DownloadEngine:
+    """Tải file từ tcp_server, mỗi file qua nhiều kết nối song song.
+
+    Mỗi lượt tải chạy trong thread riêng; submit() trả về ngay một
+    DownloadTask để theo dõi, hủy hoặc chờ. Lượt tải bị ngắt để lại file
+    .partial và nhật ký, lần sau chỉ tải các phần còn thiếu; file đã tải
+    xong đúng phiên bản trên server thì được bỏ qua. Các kết nối được giữ
+    trong một ConnectionPool và dùng lại giữa các segment và các file.
+    """
+
+    def __init__(self, host='localhost', port=5000, download_dir='downloads',
+                 segments=DEFAULT_SEGMENTS, max_active=DEFAULT_MAX_ACTIVE,
+                 codecs=ACCEPT_CODECS, timeout=CONNECT_TIMEOUT,
+                 max_connections=DEFAULT_MAX_CONNECTIONS, order=ORDER_FIFO,
+                 socket_options=None, read_size=DEFAULT_READ_SIZE, delta=True):
+        self.host = host
+        self.port = port
+        self.download_dir = download_dir
+        self.segments = segments
+        self.codecs = codecs
+        # Có bản cũ trong download_dir thì chỉ tải phần khác (DELTA) thay vì cả file
+        self.delta = delta
+        # Tạo file đích (path, size), thay được để so sánh cách ghi khác
+        self.output_factory = OutputFile
+        self.timeout = timeout
+        self.tasks = {}
+        # Kích thước file theo catalog đã biết, cho thứ tự file nhỏ trước
+        self.file_sizes = {}
+        # Mỗi file đang tải cần ít nhất một kết nối
+        self.budget = ConnectionBudget(max(max_connections, max_active))
+        self.queue = FileScheduler(self._start, max_active, order)
+        # Một thread duy nhất đọc bộ đếm của các worker và báo tiến độ theo lô
+        self.progress = ProgressAggregator(lambda: list(self.tasks.values()))
+        self.progress.add_listener(self._notify_progress)
+        # Đủ cho ngân sách kết nối cộng một kết nối lấy hash cho mỗi file đang tải
+        self.socket_options = socket_options
+        self.pool = ConnectionPool(host, port, max_size=self.budget.limit + max_active,
+                                   connect_timeout=timeout, socket_options=socket_options,
+                                   read_size=read_size)
+        os.makedirs(download_dir, exist_ok=True)
+        self.completed = CompletedFiles(download_dir)
+        self._lock = threading.Lock()
+
+    def list_files(self):
+        """{tên file: {"size", "mtime_ns"}} từ catalog của server"""
+        with self.pool.connection() as conn:
+            files = conn.request_catalog()['files']
+        self.file_sizes = {name: meta['size'] for name, meta in files.items()}
+        return files
+
+    def watch_catalog(self, on_update, stop=None):
+        """Gọi on_update(files, diff) mỗi khi catalog thay đổi, tự kết nối lại khi bị ngắt.
+
+        Chạy cho tới khi stop (threading.Event) được set.
+        """
+        stop = stop or threading.Event()
+
+        def update(files, diff):
+            self.file_sizes = {name: meta['size'] for name, meta in files.items()}
+            on_update(files, diff)
+
+        while not stop.is_set():
+            try:
+                with ServerConnection(self.host, self.port,
+                                      options=self.socket_options) as conn:
+                    conn.subscribe_catalog(update)
+            except Exception as e:
+                print(f"Mất kết nối theo dõi catalog: {str(e)}")
+            stop.wait(CATALOG_RETRY_DELAY)
+
+    def submit(self, filename, on_progress=None, on_done=None, priority=0, deadline=None,
+               size=None):
+        """Xếp filename vào hàng đợi tải, trả về DownloadTask (hoặc lượt tải đang có của file đó).
+
+        priority lớn được chạy trước; deadline (thời điểm time.time()) dùng cho
+        thứ tự 'deadline'; size là kích thước đã biết, mặc định lấy theo catalog.
+        """
+        with self._lock:
+            task = self.tasks.get(filename)
+            if task is not None and not task.done:
+                return task
+            path = os.path.join(self.download_dir, filename)
+            if size is None:
+                size = self.file_sizes.get(filename)
+            task = self.tasks[filename] = DownloadTask(filename, path, on_progress, on_done,
+                                                       priority, deadline, size)
+        self.queue.add(task)
+        self.progress.wake()
+        return task
+
+    def add_progress_listener(self, listener):
+        """listener(updates) nhận danh sách progress.ProgressUpdate của các file vừa thay đổi"""
+        self.progress.add_listener(listener)
+
+    def _notify_progress(self, updates):
+        for update in updates:
+            task = self.tasks.get(update.filename)
+            if task is not None and task.on_progress and not task.done:
+                task.on_progress(task)
+
+    def cancel(self, filename):
+        task = self.tasks.get(filename)
+        if task is not None:
+            task.cancel()
+            # Task còn trong hàng đợi thì kết thúc ngay, không chờ tới lượt
+            if self.queue.remove(task):
+                task._finish(CANCELLED)
+
+    def wait_all(self, timeout=None):
+        """Chờ mọi lượt tải đã submit kết thúc, trả về danh sách task"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        tasks = list(self.tasks.values())
+        for task in tasks:
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            if not task._done.wait(remaining):
+                raise TimeoutError(f"{task.filename} chưa tải xong")
+        return tasks
+
+    def _start(self, task):
+        threading.Thread(target=self._run, args=(task,), daemon=True).start()
+
+    def _run(self, task):
+        try:
+            task._check_cancelled()
+            task.state = RUNNING
+            task.started = time.monotonic()
+            self._download(task)
+        except DownloadCancelled:
+            task._finish(CANCELLED)
+        except Exception as e:
+            print(f"Lỗi download {task.filename}: {str(e)}")
+            task._finish(FAILED, e)
+        else:
+            task._finish(COMPLETED)
+        finally:
+            self.queue.done(task)
+
+    def close(self):
+        """Đóng các kết nối đang rảnh trong pool"""
+        self.pool.close()
+
+    def completed_files(self):
+        """Tên các file đã tải xong vào download_dir (kể cả ở lần chạy trước)"""
+        return self.completed.names()
+
+    def _download(self, task):
+        # Lấy hash từng block để kiểm tra dữ liệu ngay khi đang tải
+        with self.pool.connection() as conn:
+            hashes = conn.request_hashes(task.filename)
+        task.size = hashes.size
+        if self.completed.is_complete(task.filename, task.path, hashes):
+            task.resumed = task.size
+            task.skipped = True
+            return
+        self.completed.discard(task.filename)
+
+        journal = DownloadJournal(task.path, hashes)
+        done = journal.load()
+        # Các segment ghi thẳng vào file đích đã cấp phát trước, không cần ghép
+        output = self.output_factory(task.path, task.size, resume=bool(done))
+        if done and not output.resumed:
+            # Mất file .partial nên nhật ký không còn đúng
+            journal = DownloadJournal(task.path, hashes)
+            done = 0
+        elif done:
+            print(f"Tải tiếp {task.filename} từ {done}/{task.size} bytes")
+        task.resumed = done
+
+        try:
+            if self.delta and not done and task.size:
+                self._try_delta(task, hashes, output, journal)
+            missing = journal.ranges(missing=True)
+            scheduler = SegmentScheduler(task.size, hashes.block_size, PIECE_SIZE,
+                                         MIN_SEGMENT_SIZE, ranges=missing)
+            task.segments = scheduler.segments
+            # File nhỏ không đáng mở nhiều kết nối
+            remaining = sum(end - start for start, end in missing)
+            max_workers = max(1, min(self.segments, remaining // MIN_SEGMENT_SIZE))
+            self._run_workers(task, scheduler, hashes, output, journal, max_workers)
+            if task.size and not journal.complete:
+                raise DownloadError(f"Còn thiếu {task.size - journal.completed_bytes()} bytes")
+        except BaseException:
+            # Giữ file .partial và nhật ký để lần sau tải tiếp
+            try:
+                journal.save(output, force=True)
+                output.close()
+            except OSError:
+                output.discard()
+            raise
+        output.commit()
+        journal.remove()
+        self.completed.add(task.filename, hashes)
+
+    def _try_delta(self, task, hashes, output, journal):
+        """Dựng file từ bản cũ ở task.path bằng DELTA nếu có bản cũ.
+
+        Block nào đúng hash được đánh dấu trong nhật ký; phần còn thiếu (DELTA
+        lỗi hoặc block sai hash) được tải bình thường sau đó.
+        """
+        try:
+            local_size = os.path.getsize(task.path)
+        except OSError:
+            return
+        if not local_size:
+            return
+        segment = Segment(0, 0, task.size)
+        task.segments = [segment]
+        self.budget.acquire()
+        try:
+            task.delta = self._download_delta(task, hashes, output, journal, segment,
+                                              local_size)
+        except DownloadCancelled:
+            raise
+        except (OSError, ValueError, ProtocolError, DownloadError) as e:
+            print(f"Không dựng được {task.filename} từ bản cũ, tải các phần còn thiếu: {str(e)}")
+        finally:
+            self.budget.release()
+            # Các block đã đúng hash coi như đã có sẵn, phần còn lại được tải lại
+            task.delta_received = segment.received
+            task.segments = []
+            task.resumed = journal.completed_bytes()
+            task.reused = 0
+
+    def _download_delta(self, task, hashes, output, journal, segment, local_size):
+        block_size = choose_block_size(local_size)
+        signature = file_signature(task.path, block_size)
+        verifier = StreamVerifier(hashes, 0, task.size, journal.mark)
+
+        def write(offset, data):
+            task._check_cancelled()
+            output.write_at(offset, data)
+            verifier.update(data)
+            journal.save(output)
+
+        def on_data(offset, data):
+            write(offset, data)
+            segment.received += len(data)
+
+        with open(task.path, 'rb') as source, self.pool.connection() as conn:
+            def on_copy(offset, position, count):
+                source.seek(position)
+                while count:
+                    data = source.read(min(PIECE_SIZE, count))
+                    if not data:
+                        raise DownloadError(f"Bản cũ của {task.filename} bị thay đổi")
+                    write(offset, data)
+                    # Dữ liệu lấy từ bản cũ, không tính vào tốc độ
+                    task.reused += len(data)
+                    offset += len(data)
+                    count -= len(data)
+
+            stats = conn.request_delta(task.filename, local_size, block_size, signature,
+                                       on_data, on_copy, codecs=self.codecs)
+        if verifier.bad_blocks:
+            print(f"{len(verifier.bad_blocks)} block của {task.filename} sai hash sau DELTA, "
+                  f"tải lại")
+        return stats
+
+    def _run_workers(self, task, scheduler, hashes, output, journal, max_workers):
+        errors = []
+
+        def spawn(segment):
+            scheduler.worker_started()
+            threading.Thread(
+                target=self._worker,
+                args=(task, scheduler, segment, hashes, output, journal, errors),
+                daemon=True,
+            ).start()
+
+        for i in range(min(INITIAL_SEGMENTS, max_workers)):
+            # Kết nối đầu tiên chờ tới khi có trong ngân sách, các kết nối sau chỉ lấy nếu còn
+            if i == 0:
+                self.budget.acquire()
+            elif not self.budget.try_acquire():
+                break
+            segment = scheduler.next_segment()
+            if segment is None:
+                self.budget.release()
+                break
+            spawn(segment)
+        if not scheduler.workers:
+            return
+
+        # Thêm kết nối chừng nào tốc độ tổng còn tăng rõ rệt
+        best_rate = 0.0
+        growing = True
+        last_bytes, last_time = task.received, time.monotonic()
+        while not scheduler.finished.wait(PROBE_INTERVAL):
+            journal.save(output)
+            now = time.monotonic()
+            rate = (task.received - last_bytes) / (now - last_time)
+            last_bytes, last_time = task.received, now
+            if not growing or scheduler.workers >= max_workers or errors or task.cancelled:
+                continue
+            if not self.budget.try_acquire():
+                # Hết ngân sách kết nối, thử lại ở lần sau
+                continue
+            segment = None
+            if rate > best_rate * (1 + MIN_RATE_GAIN):
+                best_rate = rate
+                segment = scheduler.next_segment()
+            else:
+                growing = False
+            if segment is not None:
+                spawn(segment)
+            else:
+                self.budget.release()
+
+        task._check_cancelled()
+        if errors:
+            raise DownloadError(f"Các phần {sorted(errors)} tải không thành công")
+
+    def _worker(self, task, scheduler, segment, hashes, output, journal, errors):
+        """Tải segment được giao, rồi nhận segment khác hoặc lấy bớt của segment chậm nhất.
+
+        Worker dừng sớm để nhả kết nối cho file khác đang chờ ngân sách, miễn
+        là file này vẫn còn worker khác.
+        """
+        left = False
+        try:
+            with self.pool.connection() as conn:
+                while segment is not None and not errors:
+                    self._download_segment(conn, task, scheduler, segment, hashes, output,
+                                           journal)
+                    if self.budget.contended and scheduler.release_worker():
+                        left = True
+                        break
+                    segment = scheduler.next_segment()
+        except DownloadCancelled:
+            pass
+        except Exception as e:
+            errors.append(segment.index)
+            print(f"Lỗi download phần {segment.index} của {task.filename}: {str(e)}")
+        finally:
+            self.budget.release()
+            if not left:
+                scheduler.worker_done()
+
+    def _download_segment(self, conn, task, scheduler, segment, hashes, output, journal):
+        """Tải một segment trên kết nối conn, pipelining các đoạn nhỏ"""
+        verifier = StreamVerifier(hashes, segment.start, segment.end, journal.mark)
+
+        def on_data(offset, data):
+            task._check_cancelled()
+            output.write_at(offset, data)
+            verifier.update(data)
+            # Chỉ worker của segment ghi bộ đếm này, không cần khóa
+            segment.received += len(data)
+
+        conn.fetch_ranges(task.filename, scheduler.pieces(segment), on_data,
+                          window=PIPELINE_WINDOW, codecs=self.codecs)
+
+        # Chỉ tải lại những block sai hash
+        bad_blocks = verifier.bad_blocks
+        for _ in range(MAX_BLOCK_RETRIES):
+            if not bad_blocks:
+                break
+            print(f"Tải lại {len(bad_blocks)} block lỗi của {task.filename} "
+                  f"(phần {segment.index})")
+            bad_blocks = self._refetch_blocks(conn, output, task, hashes, journal, bad_blocks)
+        if bad_blocks:
+            raise DownloadError(f"Các block {bad_blocks} vẫn sai hash")
+
+    def _refetch_blocks(self, conn, output, task, hashes, journal, blocks):
+        """Tải lại các block và ghi đè vào file đích, trả về các block vẫn sai hash"""
+        verifiers = {}
+
+        def on_data(offset, data):
+            task._check_cancelled()
+            block = offset // hashes.block_size
+            if block not in verifiers:
+                block_start, block_len = hashes.block_range(block)
+                verifiers[block] = StreamVerifier(hashes, block_start, block_start + block_len,
+                                                  journal.mark)
+            verifiers[block].update(data)
+            output.write_at(offset, data)
+
+        conn.fetch_ranges(task.filename, [hashes.block_range(b) for b in blocks], on_data,
+                          window=PIPELINE_WINDOW, codecs=self.codecs)
+        return [block for block, verifier in verifiers.items() if verifier.bad_blocks]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tải file từ tcp_server không cần giao diện")
+    parser.add_argument('files', nargs='*', help="Tên các file cần tải")
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--dir', default='downloads', help="Thư mục lưu file")
+    parser.add_argument('--segments', type=int, default=DEFAULT_SEGMENTS,
+                        help="Số kết nối tối đa cho mỗi file")
+    parser.add_argument('--parallel', type=int, default=DEFAULT_MAX_ACTIVE,
+                        help="Số file tải cùng lúc")
+    parser.add_argument('--connections', type=int, default=DEFAULT_MAX_CONNECTIONS,
+                        help="Tổng số kết nối của mọi file đang tải")
+    parser.add_argument('--order', choices=ORDERS, default=ORDER_FIFO,
+                        help="Thứ tự tải các file")
+    parser.add_argument('--rcvbuf', type=parse_rate, default=0,
+                        help="SO_RCVBUF của mỗi kết nối, ví dụ 4M (0 = mặc định hệ thống)")
+    parser.add_argument('--sndbuf', type=parse_rate, default=0,
+                        help="SO_SNDBUF của mỗi kết nối, ví dụ 4M (0 = mặc định hệ thống)")
+    parser.add_argument('--no-nodelay', action='store_true', help="Không bật TCP_NODELAY")
+    parser.add_argument('--read-size', type=parse_rate, default=DEFAULT_READ_SIZE,
+                        help="Số byte tối đa mỗi lần recv_into")
+    parser.add_argument('--quickack', action='store_true',
+                        help="Bật TCP_QUICKACK (Linux), đặt lại sau mỗi lần nhận dữ liệu")
+    parser.add_argument('--no-delta', action='store_true',
+                        help="Luôn tải cả file, không dựng từ bản cũ trong thư mục tải về")
+    parser.add_argument('--list', action='store_true', help="In danh sách file trên server")
+    args = parser.parse_args()
+
+    engine = DownloadEngine(args.host, args.port, args.dir, segments=args.segments,
+                            max_active=args.parallel, max_connections=args.connections,
+                            order=args.order,
+                            socket_options=SocketOptions(args.rcvbuf, args.sndbuf,
+                                                         nodelay=not args.no_nodelay,
+                                                         quickack=args.quickack),
+                            read_size=args.read_size, delta=not args.no_delta)
+    if args.list or args.order == ORDER_SMALLEST:
+        # Thứ tự theo kích thước cần catalog
+        files = engine.list_files()
+    if args.list:
+        for name, meta in sorted(files.items()):
+            print(f"{name}\t{meta['size']}")
+    if not args.files:
+        return 0
+
+    def on_done(task):
+        if task.skipped:
+            print(f"{task.filename}: đã tải xong từ trước, bỏ qua")
+        elif task.state == COMPLETED:
+            delta = ''
+            if task.delta:
+                delta = (f" (DELTA: {task.delta['literal']} bytes mới, "
+                         f"{task.delta['copied']} bytes dùng lại từ bản cũ)")
+            print(f"{task.filename}: xong {task.received} bytes, "
+                  f"{task.speed / (1024 * 1024):.1f} MB/s{delta}")
+        else:
+            print(f"{task.filename}: {task.state} ({task.error})")
+
+    tasks = [engine.submit(name, on_done=on_done) for name in args.files]
+    try:
+        engine.wait_all()
+    except KeyboardInterrupt:
+        for task in tasks:
+            engine.cancel(task.filename)
+        engine.wait_all()
+    finally:
+        engine.close()
+    return 0 if all(task.state == COMPLETED for task in tasks) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,178 @@
+# fec.py
+# Forward error correction for the UDP transfer. After each group of data
+# chunks the server sends one XOR parity chunk; a client that lost a single
+# chunk of the group rebuilds it from the parity and the other chunks instead
+# of waiting a round trip for the retransmission. The client negotiates the
+# range of group sizes (the parity overhead it accepts) and the server picks
+# the group size within it from the loss rate it observes.
+import hashlib
+from bisect import bisect_right, insort
+
+# Parity packet: prefix, then "first|count|length|md5|" and the XOR of the
+# chunks first .. first + count - 1, each zero-padded to the longest one.
+# length is the XOR of their lengths, so a shorter last chunk can be rebuilt
+PARITY_PREFIX = b'PARITY|'
+
+# Group sizes a client asks for by default: one parity per 4 to 32 chunks
+FEC_MIN_GROUP = 4
+FEC_MAX_GROUP = 32
+# Bounds the server accepts
+MIN_GROUP = 2
+MAX_GROUP = 64
+# One parity repairs one loss per group, so groups are sized for this many
+# lost chunks per group on average
+TARGET_LOSSES_PER_GROUP = 0.25
+# New chunks sent between two adjustments of the group size
+ADAPT_INTERVAL = 256
+
+
+def encode_option(min_group, max_group):
+    """Fields appended to DOWNLOAD (and echoed in FILE_INFO) to use FEC"""
+    return f"FEC|{min_group}|{max_group}"
+
+
+def parse_option(fields):
+    """(min_group, max_group) from the fields after the file name, None without FEC"""
+    if len(fields) != 3 or fields[0] != 'FEC':
+        return None
+    try:
+        min_group, max_group = int(fields[1]), int(fields[2])
+    except ValueError:
+        return None
+    min_group = max(MIN_GROUP, min_group)
+    return min_group, max(min_group, min(MAX_GROUP, max_group))
+
+
+def group_size(loss_rate, min_group, max_group):
+    if loss_rate <= 0:
+        return max_group
+    return max(min_group, min(max_group, int(TARGET_LOSSES_PER_GROUP / loss_rate)))
+
+
+def encode_parity(first, count, length, data):
+    checksum = hashlib.md5(data).hexdigest()
+    return PARITY_PREFIX + f"{first}|{count}|{length}|{checksum}|".encode() + data
+
+
+def decode_parity(packet):
+    """Returns (first, count, length, data); raises ValueError if malformed"""
+    fields = packet[len(PARITY_PREFIX):].split(b'|', 4)
+    if not packet.startswith(PARITY_PREFIX) or len(fields) != 5:
+        raise ValueError("Malformed parity packet")
+    first, count, length = (int(field) for field in fields[:3])
+    data = fields[4]
+    if hashlib.md5(data).hexdigest() != fields[3].decode():
+        raise ValueError("Parity checksum mismatch")
+    return first, count, length, data
+
+
+class FecEncoder:
+    """Server side: groups chunks as they are first sent and emits the parity of each group"""
+
+    def __init__(self, min_group, max_group):
+        self.min_group = min_group
+        self.max_group = max_group
+        self.group = min_group
+        self.recovered = 0
+        self.parities = 0
+        self._first = 0
+        self._count = 0
+        self._value = 0
+        self._length = 0
+        self._size = 0
+        # Counters at the last adjustment of the group size
+        self._sent = 0
+        self._mark = (0, 0, 0)
+
+    def add(self, chunk, data, last=False):
+        """Add a chunk sent for the first time; returns the parity packets of
+        the groups it completed (when full, at the end of the file, or when
+        chunks the client already had are skipped so the group would not be
+        contiguous)"""
+        packets = []
+        if self._count and chunk != self._first + self._count:
+            packets.append(self._flush())
+        if not self._count:
+            self._first = chunk
+        self._count += 1
+        self._value ^= int.from_bytes(data, 'little')
+        self._length ^= len(data)
+        self._size = max(self._size, len(data))
+        self._sent += 1
+        if self._count >= self.group or last:
+            packets.append(self._flush())
+        return packets
+
+    def _flush(self):
+        packet = encode_parity(self._first, self._count, self._length,
+                               self._value.to_bytes(self._size, 'little'))
+        self._count = self._value = self._length = self._size = 0
+        self.parities += 1
+        return packet
+
+    def on_recovered(self, total):
+        """Cumulative count of chunks the client rebuilt; returns True if it grew"""
+        if total <= self.recovered:
+            return False
+        self.recovered = total
+        return True
+
+    def adapt(self, retransmissions):
+        """Resize groups from the losses (rebuilt or retransmitted) since the last call,
+        once every ADAPT_INTERVAL new chunks"""
+        sent, recovered, resent = self._mark
+        if self._sent - sent < ADAPT_INTERVAL:
+            return
+        lost = self.recovered - recovered + retransmissions - resent
+        self.group = group_size(lost / (self._sent - sent), self.min_group, self.max_group)
+        self._mark = (self._sent, self.recovered, retransmissions)
+
+
+class FecDecoder:
+    """Client side: keeps the parity of groups still missing chunks and
+    rebuilds a chunk as soon as it is the only one missing from its group"""
+
+    def __init__(self, received, read_chunk):
+        # ChunkBitmap of the chunks received, and a function returning one of them
+        self.received = received
+        self.read_chunk = read_chunk
+        self.recovered = 0
+        # First chunk -> (count, length, data) of the pending groups
+        self._groups = {}
+        self._firsts = []
+
+    def add_parity(self, packet):
+        """Returns (chunk_num, chunk_data) if the parity rebuilt a chunk, None otherwise"""
+        first, count, length, data = decode_parity(packet)
+        if first in self._groups or count < 1 or first + count > self.received.total:
+            return None
+        self._groups[first] = (count, length, data)
+        insort(self._firsts, first)
+        return self._repair(first)
+
+    def on_chunk(self, chunk):
+        """A chunk arrived; returns the chunk its group's parity can now rebuild, if any"""
+        i = bisect_right(self._firsts, chunk) - 1
+        if i < 0 or chunk >= self._firsts[i] + self._groups[self._firsts[i]][0]:
+            return None
+        return self._repair(self._firsts[i])
+
+    def _repair(self, first):
+        count, length, data = self._groups[first]
+        missing = [chunk for chunk in range(first, first + count) if chunk not in self.received]
+        if len(missing) > 1:
+            return None
+        del self._groups[first]
+        self._firsts.remove(first)
+        if not missing:
+            return None
+        value = int.from_bytes(data, 'little')
+        for chunk in range(first, first + count):
+            if chunk != missing[0]:
+                chunk_data = self.read_chunk(chunk)
+                value ^= int.from_bytes(chunk_data, 'little')
+                length ^= len(chunk_data)
+        if length > len(data):
+            return None
+        self.recovered += 1
+        return missing[0], value.to_bytes(len(data), 'little')[:length]
@@ -0,0 +1,134 @@
+# file_cache.py
+import mmap
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+DEFAULT_CACHE_ENTRIES = 128
+
+
+class FileChangedError(OSError):
+    """File đang được dùng bị cắt ngắn, không còn đọc an toàn qua mmap"""
+
+
+class CachedFile:
+    """Một file đang mở trong FileCache, kèm mmap được tạo khi cần"""
+
+    def __init__(self, path, st):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.size = st.st_size
+        self.signature = (st.st_ino, st.st_size, st.st_mtime_ns)
+        self.refs = 0
+        self.evicted = False
+        self._mmap = None
+        self._lock = threading.Lock()
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def view(self, offset, count):
+        """Trả về memoryview (không copy) của đoạn [offset, offset + count).
+
+        Đọc mmap ở phần file đã bị tiến trình khác cắt đi gây SIGBUS làm chết
+        cả server, nên kích thước được fstat lại mỗi lần tạo view và request
+        thất bại nếu file đã ngắn hơn lúc mở.
+        """
+        if count <= 0:
+            return memoryview(b'')
+        if os.fstat(self.file.fileno()).st_size < self.size:
+            raise FileChangedError(f"File {self.path} bị cắt ngắn khi đang dùng")
+        with self._lock:
+            if self._mmap is None:
+                self._mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self._mmap)[offset:offset + count]
+
+    def close(self):
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Vẫn còn memoryview tham chiếu tới, mmap sẽ được đóng khi bị thu hồi
+                pass
+        self.file.close()
+
+
+class FileCache:
+    """Cache LRU các file đang mở (fd và mmap), khóa theo đường dẫn.
+
+    Mỗi lần lấy file đều stat lại để phát hiện file bị thay đổi (inode,
+    kích thước hoặc mtime khác) và mở lại khi cần. Entry bị loại khỏi cache
+    trong lúc còn được dùng sẽ chỉ được đóng khi người dùng cuối cùng trả lại.
+    """
+
+    def __init__(self, max_entries=DEFAULT_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def acquire(self, path):
+        st = os.stat(path)
+        signature = (st.st_ino, st.st_size, st.st_mtime_ns)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None:
+                if entry.signature == signature:
+                    self._entries.move_to_end(path)
+                    entry.refs += 1
+                    self.hits += 1
+                    return entry
+                # File đã thay đổi từ lần mở trước
+                self.invalidations += 1
+                self._discard(path)
+
+            self.misses += 1
+            entry = CachedFile(path, st)
+            entry.refs = 1
+            if self.max_entries > 0:
+                self._entries[path] = entry
+                while len(self._entries) > self.max_entries:
+                    self.evictions += 1
+                    self._discard(next(iter(self._entries)))
+            else:
+                entry.evicted = True
+            return entry
+
+    def release(self, entry):
+        with self._lock:
+            entry.refs -= 1
+            if entry.evicted and entry.refs == 0:
+                entry.close()
+
+    @contextmanager
+    def open(self, path):
+        entry = self.acquire(path)
+        try:
+            yield entry
+        finally:
+            self.release(entry)
+
+    def _discard(self, path):
+        entry = self._entries.pop(path)
+        entry.evicted = True
+        if entry.refs == 0:
+            entry.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+    def clear(self):
+        with self._lock:
+            for path in list(self._entries):
+                self._discard(path)
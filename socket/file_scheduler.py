@@ -0,0 +1,112 @@
+# file_scheduler.py
+# Xếp lịch các file chờ tải của download_engine: chạy đồng thời tối đa
+# max_active file theo độ ưu tiên và thứ tự đã chọn, và chia một ngân sách
+# kết nối chung cho tất cả các file đang tải.
+import heapq
+import itertools
+import threading
+
+# Thứ tự chạy các file cùng độ ưu tiên
+ORDER_FIFO = 'fifo'          # theo thứ tự submit
+ORDER_SMALLEST = 'smallest'  # file nhỏ trước, file chưa biết kích thước xếp cuối
+ORDER_DEADLINE = 'deadline'  # hạn chót sớm trước, file không có hạn chót xếp cuối
+ORDERS = (ORDER_FIFO, ORDER_SMALLEST, ORDER_DEADLINE)
+
+
+class ConnectionBudget:
+    """Số kết nối tối đa mà mọi file đang tải được dùng cùng lúc"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """Chờ tới khi có một kết nối trong ngân sách"""
+        with self._cond:
+            self.waiting += 1
+            try:
+                while self.used >= self.limit:
+                    self._cond.wait()
+            finally:
+                self.waiting -= 1
+            self.used += 1
+
+    def try_acquire(self):
+        with self._cond:
+            if self.used >= self.limit or self.waiting:
+                return False
+            self.used += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self.used -= 1
+            self._cond.notify()
+
+    @property
+    def contended(self):
+        """True nếu có file đang chờ kết nối, các file khác nên nhả bớt"""
+        return self.waiting > 0
+
+
+class FileScheduler:
+    """Hàng đợi ưu tiên các lượt tải, mỗi lượt chạy khi có chỗ trong max_active.
+
+    priority lớn chạy trước; cùng priority thì theo order. start(task) được
+    gọi (khi đang giữ lock) cho mỗi task tới lượt, và người gọi phải báo
+    done(task) khi task kết thúc.
+    """
+
+    def __init__(self, start, max_active, order=ORDER_FIFO):
+        if order not in ORDERS:
+            raise ValueError(f"Thứ tự không hỗ trợ: {order}")
+        self.start = start
+        self.max_active = max_active
+        self.order = order
+        self.active = set()
+        self._queue = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def _key(self, task, sequence):
+        if self.order == ORDER_SMALLEST:
+            second = task.size if task.size is not None else float('inf')
+        elif self.order == ORDER_DEADLINE:
+            second = task.deadline if task.deadline is not None else float('inf')
+        else:
+            second = sequence
+        return (-task.priority, second, sequence)
+
+    def add(self, task):
+        with self._lock:
+            sequence = next(self._sequence)
+            heapq.heappush(self._queue, (self._key(task, sequence), task))
+            self._dispatch()
+
+    def remove(self, task):
+        """Bỏ task khỏi hàng đợi, trả về False nếu task đã chạy hoặc không có trong hàng đợi"""
+        with self._lock:
+            for index, (_, queued) in enumerate(self._queue):
+                if queued is task:
+                    self._queue.pop(index)
+                    heapq.heapify(self._queue)
+                    return True
+            return False
+
+    def done(self, task):
+        with self._lock:
+            self.active.discard(task)
+            self._dispatch()
+
+    @property
+    def queued(self):
+        with self._lock:
+            return [task for _, task in sorted(self._queue)]
+
+    def _dispatch(self):
+        while self._queue and len(self.active) < self.max_active:
+            _, task = heapq.heappop(self._queue)
+            self.active.add(task)
+            self.start(task)
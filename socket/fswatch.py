@@ -0,0 +1,240 @@
+# fswatch.py
+# Theo dõi thay đổi trong một thư mục: dùng inotify trên Linux, nếu không
+# có thì quay về so sánh mtime định kỳ. FileTailer dùng cơ chế này để đọc
+# các dòng mới được ghi thêm vào một file.
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+              | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+_EVENT = struct.Struct('iIII')
+# Số byte ngay trước offset được giữ lại để nhận ra file bị ghi đè tại chỗ
+TAIL_CHECK = 64
+
+
+def _load_libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+_libc = _load_libc()
+
+
+class InotifyWatcher:
+    """Nhận sự kiện inotify của một thư mục, trả về tên các file bị thay đổi"""
+
+    def __init__(self, path, mask=WATCH_MASK):
+        if _libc is None:
+            raise OSError(errno.ENOSYS, "inotify không khả dụng")
+        self.path = path
+        self.fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        wd = _libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, os.strerror(err))
+        # poll thay vì select.select, vốn lỗi khi fd vượt FD_SETSIZE (1024)
+        self._poller = select.poll()
+        self._poller.register(self.fd, select.POLLIN)
+
+    def poll(self, timeout=0):
+        """Chờ tối đa timeout giây, trả về tập tên đã thay đổi.
+
+        Trả về None nếu không biết chính xác (hàng đợi sự kiện bị tràn hoặc
+        thư mục bị xóa/di chuyển), khi đó người gọi nên quét lại toàn bộ.
+        """
+        if not self._poller.poll(timeout * 1000):
+            return set()
+        names = set()
+        rescan = False
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+            pos = 0
+            while pos + _EVENT.size <= len(data):
+                _, mask, _, length = _EVENT.unpack_from(data, pos)
+                pos += _EVENT.size
+                name = data[pos:pos + length].rstrip(b'\0')
+                pos += length
+                if mask & (IN_Q_OVERFLOW | IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                    rescan = True
+                elif name:
+                    names.add(os.fsdecode(name))
+        return None if rescan else names
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class PollingWatcher:
+    """Phương án dự phòng: chỉ biết thư mục có thể đã thay đổi sau mỗi chu kỳ"""
+
+    def __init__(self, path, interval=1.0):
+        self.path = path
+        self.interval = interval
+        self._last = 0.0
+
+    def poll(self, timeout=0):
+        # Không biết tên cụ thể, báo người gọi quét lại sau mỗi interval
+        wait = self._last + self.interval - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return set()
+        if wait > 0:
+            time.sleep(wait)
+        self._last = time.monotonic()
+        return None
+
+    def close(self):
+        pass
+
+
+def watch_directory(path, interval=1.0):
+    """Tạo watcher cho thư mục, ưu tiên inotify"""
+    try:
+        return InotifyWatcher(path)
+    except OSError:
+        return PollingWatcher(path, interval)
+
+
+class FileTailer:
+    """Đọc các dòng mới được ghi thêm vào cuối một file văn bản.
+
+    Chỉ đọc phần ghi thêm kể từ offset lần trước. File bị cắt ngắn, bị ghi
+    đè tại chỗ (`>`, các byte ngay trước offset đã khác) hoặc bị thay bằng
+    file khác (đổi tên, editor ghi file mới) được đọc lại từ đầu, sau khi đọc
+    nốt phần còn lại của file cũ. Chỉ các dòng đã có ký tự xuống dòng được trả
+    về; dòng cuối còn dở chỉ được coi là xong khi file cũ bị thay thế.
+    """
+
+    def __init__(self, path, interval=1.0):
+        self.path = path
+        self.name = os.path.basename(path)
+        # Theo dõi thư mục chứa file để thấy cả lúc file được tạo lại
+        self._watcher = watch_directory(os.path.dirname(os.path.abspath(path)), interval)
+        self._file = None
+        self._identity = None
+        self._stat = None
+        self.offset = 0
+        self._partial = b''
+        # TAIL_CHECK byte cuối đã đọc, kết thúc tại offset
+        self._tail = b''
+        self._started = False
+
+    def read_lines(self, timeout=1.0):
+        """Chờ tối đa timeout giây, trả về danh sách các dòng mới"""
+        if not self._started:
+            self._started = True
+            return self._read_new()
+        names = self._watcher.poll(timeout)
+        if names is None or self.name in names:
+            return self._read_new()
+        return []
+
+    def close(self):
+        self._watcher.close()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _read_new(self):
+        lines = []
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            st = None
+        identity = None if st is None else (st.st_dev, st.st_ino)
+        if st is not None and (identity, st.st_size, st.st_mtime_ns) == self._stat:
+            return lines
+        if identity != self._identity:
+            if self._file is not None:
+                # File cũ bị đổi tên hoặc xóa: đọc nốt phần được ghi trước đó,
+                # kể cả dòng cuối không có ký tự xuống dòng
+                lines += self._read_to_end()
+                lines += self._decode([self._partial])
+                self._file.close()
+                self._file = None
+            self._reset()
+            self._identity = identity
+            if st is None:
+                return lines
+            try:
+                self._file = open(self.path, 'rb')
+            except FileNotFoundError:
+                self._identity = None
+                return lines
+        elif st.st_size < self.offset or not self._same_tail():
+            # File bị cắt ngắn hoặc ghi đè rồi ghi lại từ đầu
+            self._reset()
+        self._stat = (identity, st.st_size, st.st_mtime_ns)
+        lines += self._read_to_end()
+        return lines
+
+    def _reset(self):
+        self.offset = 0
+        self._stat = None
+        self._partial = b''
+        self._tail = b''
+
+    def _same_tail(self):
+        """True nếu các byte ngay trước offset vẫn như lúc đọc, tức file chỉ được ghi thêm"""
+        if not self._tail:
+            return True
+        self._file.seek(self.offset - len(self._tail))
+        return self._file.read(len(self._tail)) == self._tail
+
+    def _read_to_end(self):
+        self._file.seek(self.offset)
+        data = self._file.read()
+        self.offset += len(data)
+        if not data:
+            return []
+        self._tail = (self._tail + data)[-TAIL_CHECK:]
+        chunks = (self._partial + data).split(b'\n')
+        self._partial = chunks.pop()
+        return self._decode(chunks)
+
+    def _decode(self, chunks):
+        lines = []
+        for chunk in chunks:
+            line = chunk.decode('utf-8', errors='replace').strip()
+            if line:
+                lines.append(line)
+        return lines
@@ -0,0 +1,206 @@
+# integrity.py
+# Cây hash theo block (Merkle) để client kiểm tra từng đoạn file khi đang tải.
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+HASH_BLOCK_SIZE = 256 * 1024
+HASH_ALGORITHM = 'sha256'
+HASH_DIGEST_SIZE = hashlib.new(HASH_ALGORITHM).digest_size
+DEFAULT_CACHE_DIR = '.hashcache'
+# Số cây hash giữ trong bộ nhớ
+MEMORY_ENTRIES = 64
+
+
+def hash_block(data):
+    return hashlib.new(HASH_ALGORITHM, data).digest()
+
+
+def merkle_root(leaves):
+    """Tính gốc của cây Merkle từ danh sách hash lá"""
+    if not leaves:
+        return hash_block(b'')
+    level = list(leaves)
+    while len(level) > 1:
+        if len(level) % 2:
+            level.append(level[-1])
+        level = [hash_block(level[i] + level[i + 1]) for i in range(0, len(level), 2)]
+    return level[0]
+
+
+class BlockHashes:
+    """Hash của từng block trong một phiên bản (size, mtime_ns) của file"""
+
+    def __init__(self, size, mtime_ns, block_size, leaves):
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.block_size = block_size
+        self.leaves = leaves
+        self.root = merkle_root(leaves)
+
+    def block_range(self, index):
+        start = index * self.block_size
+        return start, min(self.block_size, self.size - start)
+
+    def to_dict(self):
+        return {
+            'algorithm': HASH_ALGORITHM,
+            'size': self.size,
+            'mtime_ns': self.mtime_ns,
+            'block_size': self.block_size,
+            'root': self.root.hex(),
+            'hashes': [leaf.hex() for leaf in self.leaves],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Tạo từ dữ liệu server gửi, báo lỗi nếu danh sách hash không khớp với gốc"""
+        if data.get('algorithm') != HASH_ALGORITHM:
+            raise ValueError(f"Không hỗ trợ thuật toán hash {data.get('algorithm')}")
+        hashes = cls(data['size'], data['mtime_ns'], data['block_size'],
+                     [bytes.fromhex(h) for h in data['hashes']])
+        expected_blocks = max(1, -(-hashes.size // hashes.block_size))
+        if len(hashes.leaves) != expected_blocks or hashes.root.hex() != data['root']:
+            raise ValueError("Danh sách hash không khớp với gốc Merkle")
+        return hashes
+
+
+class HashIndex:
+    """Tính và lưu cache cây hash của các file trong catalog.
+
+    Mỗi file có một sidecar trong cache_dir, gắn với size và mtime của
+    file, nên chỉ phải băm lại khi file thay đổi.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, block_size=HASH_BLOCK_SIZE):
+        self.cache_dir = cache_dir
+        self.block_size = block_size
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._path_locks = {}
+
+    def get(self, path, entry):
+        """Trả về BlockHashes của path cho phiên bản entry (CatalogEntry) của file"""
+        key = (path, entry.size, entry.mtime_ns)
+        with self._lock:
+            hashes = self._memory.get(key)
+            if hashes is not None:
+                self._memory.move_to_end(key)
+                return hashes
+            path_lock = self._path_locks.setdefault(path, threading.Lock())
+
+        # Mỗi file chỉ được băm bởi một thread tại một thời điểm
+        with path_lock:
+            with self._lock:
+                hashes = self._memory.get(key)
+            if hashes is None:
+                hashes = self._load_sidecar(path, entry)
+            if hashes is None:
+                hashes = self._compute(path, entry)
+                self._save_sidecar(path, hashes)
+            with self._lock:
+                self._memory[key] = hashes
+                while len(self._memory) > MEMORY_ENTRIES:
+                    self._memory.popitem(last=False)
+        return hashes
+
+    def _compute(self, path, entry):
+        leaves = []
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            if (st.st_size, st.st_mtime_ns) != (entry.size, entry.mtime_ns):
+                raise ValueError(f"File {path} đã thay đổi so với catalog")
+            buffer = bytearray(self.block_size)
+            view = memoryview(buffer)
+            while True:
+                n = f.readinto(buffer)
+                if not n:
+                    break
+                leaves.append(hash_block(view[:n]))
+        if not leaves:
+            leaves.append(hash_block(b''))
+        logging.info(f"Đã tính {len(leaves)} hash block cho {path}")
+        return BlockHashes(entry.size, entry.mtime_ns, self.block_size, leaves)
+
+    def _sidecar_path(self, path):
+        return os.path.join(self.cache_dir, path.replace(os.sep, '%') + '.blockhash')
+
+    def _load_sidecar(self, path, entry):
+        try:
+            with open(self._sidecar_path(path), 'rb') as f:
+                meta = json.loads(f.readline())
+                data = f.read()
+        except (OSError, ValueError):
+            return None
+        if (meta.get('size'), meta.get('mtime_ns'), meta.get('block_size'),
+                meta.get('algorithm')) != (entry.size, entry.mtime_ns, self.block_size,
+                                           HASH_ALGORITHM):
+            return None
+        leaves = [data[i:i + HASH_DIGEST_SIZE] for i in range(0, len(data), HASH_DIGEST_SIZE)]
+        return BlockHashes(entry.size, entry.mtime_ns, self.block_size, leaves)
+
+    def _save_sidecar(self, path, hashes):
+        meta = {
+            'algorithm': HASH_ALGORITHM,
+            'size': hashes.size,
+            'mtime_ns': hashes.mtime_ns,
+            'block_size': hashes.block_size,
+        }
+        sidecar = self._sidecar_path(path)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp = f"{sidecar}.{os.getpid()}.tmp"
+            with open(tmp, 'wb') as f:
+                f.write(json.dumps(meta).encode() + b'\n')
+                f.write(b''.join(hashes.leaves))
+            os.replace(tmp, sidecar)
+        except OSError as e:
+            logging.warning(f"Không ghi được cache hash của {path}: {str(e)}")
+
+
+class StreamVerifier:
+    """Băm dữ liệu của một đoạn khi đang nhận và so với hash từng block.
+
+    Đoạn phải bắt đầu và kết thúc ở ranh giới block (hoặc cuối file); dữ liệu
+    được đưa vào theo thứ tự. on_verified(block) được gọi với mỗi block đúng hash.
+    """
+
+    def __init__(self, hashes, start, end, on_verified=None):
+        if start % hashes.block_size or (end % hashes.block_size and end != hashes.size):
+            raise ValueError("Đoạn cần kiểm tra phải nằm trên ranh giới block")
+        self.hashes = hashes
+        self.end = end
+        self.bad_blocks = []
+        self.on_verified = on_verified
+        self._block = start // hashes.block_size
+        self._block_end = min(start + hashes.block_size, hashes.size)
+        self._position = start
+        self._hasher = hashlib.new(HASH_ALGORITHM)
+
+    def update(self, data):
+        view = memoryview(data)
+        while view:
+            take = min(len(view), self._block_end - self._position)
+            if take <= 0:
+                raise ValueError("Nhận nhiều dữ liệu hơn kích thước đoạn")
+            self._hasher.update(view[:take])
+            self._position += take
+            view = view[take:]
+            if self._position == self._block_end:
+                self._finish_block()
+
+    def _finish_block(self):
+        if self._hasher.digest() != self.hashes.leaves[self._block]:
+            self.bad_blocks.append(self._block)
+        elif self.on_verified is not None:
+            self.on_verified(self._block)
+        self._block += 1
+        self._block_end = min(self._block_end + self.hashes.block_size, self.hashes.size)
+        self._hasher = hashlib.new(HASH_ALGORITHM)
+
+    @property
+    def complete(self):
+        return self._position >= self.end
@@ -0,0 +1,162 @@
+# journal.py
+# Nhật ký tải dở của từng file và danh sách file đã tải xong, lưu trên đĩa để
+# client bị tắt hoặc mất kết nối giữa chừng vẫn tải tiếp được phần còn thiếu.
+import json
+import os
+import threading
+import time
+
+# Nhật ký nằm cạnh file đích: <file>.journal
+JOURNAL_SUFFIX = '.journal'
+# Danh sách file đã tải xong, nằm trong thư mục tải về
+COMPLETED_FILE = '.completed.json'
+# Khoảng thời gian tối thiểu giữa hai lần ghi nhật ký
+JOURNAL_INTERVAL = 1.0
+
+
+def _version(hashes):
+    """Phiên bản file trên server mà dữ liệu đã tải thuộc về"""
+    return {
+        'size': hashes.size,
+        'mtime_ns': hashes.mtime_ns,
+        'block_size': hashes.block_size,
+        'root': hashes.root.hex(),
+    }
+
+
+def _write_json(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, separators=(',', ':'))
+    os.replace(tmp, path)
+
+
+class DownloadJournal:
+    """Các block đã tải và kiểm tra hash xong của một file.
+
+    Trên đĩa chỉ lưu các đoạn byte [start, end) liên tục đã xong, gắn với
+    size, mtime và gốc Merkle của file trên server; nhật ký của phiên bản
+    khác bị bỏ qua và file được tải lại từ đầu.
+    """
+
+    def __init__(self, path, hashes):
+        self.path = path + JOURNAL_SUFFIX
+        self.hashes = hashes
+        self.blocks = max(1, -(-hashes.size // hashes.block_size))
+        self.done = bytearray(self.blocks)
+        self.done_count = 0
+        self._dirty = False
+        self._saved = 0.0
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Đọc nhật ký cũ nếu cùng phiên bản file, trả về số byte đã xong"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') != _version(self.hashes):
+                return 0
+            block_size = self.hashes.block_size
+            for start, end in data.get('ranges', []):
+                if (start % block_size or start >= end or end > self.hashes.size
+                        or (end % block_size and end != self.hashes.size)):
+                    raise ValueError(f"Đoạn không hợp lệ {start}-{end}")
+                for block in range(start // block_size, -(-end // block_size)):
+                    self.mark(block)
+        except (OSError, ValueError, TypeError, AttributeError):
+            self.done = bytearray(self.blocks)
+            self.done_count = 0
+        self._dirty = False
+        return self.completed_bytes()
+
+    def mark(self, block):
+        """Ghi nhận block đã được ghi vào file và đúng hash"""
+        with self._lock:
+            if not self.done[block]:
+                self.done[block] = 1
+                self.done_count += 1
+                self._dirty = True
+
+    @property
+    def complete(self):
+        return self.done_count == self.blocks
+
+    def completed_bytes(self):
+        return sum(end - start for start, end in self.ranges())
+
+    def ranges(self, missing=False):
+        """Các đoạn byte liên tục đã xong (hoặc còn thiếu nếu missing)"""
+        block_size = self.hashes.block_size
+        wanted = 0 if missing else 1
+        with self._lock:
+            done = bytes(self.done)
+        result = []
+        start = None
+        for block, flag in enumerate(done):
+            if flag == wanted and start is None:
+                start = block
+            elif flag != wanted and start is not None:
+                result.append((start * block_size, block * block_size))
+                start = None
+        if start is not None:
+            result.append((start * block_size, self.hashes.size))
+        return result
+
+    def save(self, output, force=False):
+        """Ghi nhật ký nếu có thay đổi; dữ liệu được đẩy xuống đĩa trước nhật ký"""
+        now = time.monotonic()
+        if not self._dirty or (not force and now - self._saved < JOURNAL_INTERVAL):
+            return
+        self._saved = now
+        self._dirty = False
+        # Các block trong ranges đã được ghi trước khi được đánh dấu, sync sau
+        # khi lấy ranges đảm bảo chúng đã nằm trên đĩa khi nhật ký được ghi
+        ranges = self.ranges()
+        output.sync()
+        _write_json(self.path, {'version': _version(self.hashes), 'ranges': ranges})
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class CompletedFiles:
+    """Các file đã tải xong trong thư mục tải về và phiên bản của chúng"""
+
+    def __init__(self, download_dir):
+        self.path = os.path.join(download_dir, COMPLETED_FILE)
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.files = json.load(f)
+            if not isinstance(self.files, dict):
+                raise ValueError("Sai định dạng")
+        except (OSError, ValueError):
+            self.files = {}
+
+    def names(self):
+        with self._lock:
+            return list(self.files)
+
+    def is_complete(self, filename, path, hashes):
+        """True nếu path đã là bản tải xong của đúng phiên bản file trên server"""
+        with self._lock:
+            version = self.files.get(filename)
+        if version != _version(hashes):
+            return False
+        try:
+            return os.path.getsize(path) == hashes.size
+        except OSError:
+            return False
+
+    def add(self, filename, hashes):
+        with self._lock:
+            self.files[filename] = _version(hashes)
+            _write_json(self.path, self.files)
+
+    def discard(self, filename):
+        with self._lock:
+            if self.files.pop(filename, None) is not None:
+                _write_json(self.path, self.files)
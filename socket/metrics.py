@@ -0,0 +1,359 @@
+# metrics.py
+# Số liệu của server (counter, gauge, histogram) theo định dạng text của
+# Prometheus, xuất qua HTTP hoặc ghi ra file, kèm log sự kiện JSON tùy chọn.
+# Dùng chung cho tcp_server và udp_server.
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Ranh giới các bucket của histogram độ trễ (giây)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Chu kỳ ghi lại file metrics
+FILE_INTERVAL = 5.0
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    parts = []
+    for name, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{name}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _Value:
+    """Giá trị của một tổ hợp nhãn trong counter hoặc gauge"""
+
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class _HistogramValue:
+    __slots__ = ('buckets', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+
+class Metric:
+    """Một metric có thể có nhãn; metric không nhãn dùng trực tiếp inc/set/observe"""
+
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=(), fn=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Hàm trả về giá trị hiện tại, dùng cho số liệu đã được đếm ở nơi khác
+        self.fn = fn
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} cần các nhãn {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def samples(self):
+        """Các dòng (tên, nhãn, giá trị) của metric"""
+        if self.fn is not None:
+            yield self.name, {}, self.fn()
+            return
+        with self._lock:
+            children = list(self._children.items())
+        for key, child in children:
+            yield self.name, dict(zip(self.labelnames, key)), child.value
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def samples(self):
+        with self._lock:
+            children = list(self._children.items())
+        for key, child in children:
+            labels = dict(zip(self.labelnames, key))
+            with child._lock:
+                counts = list(child.counts)
+                total, count = child.sum, child.count
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                yield f'{self.name}_bucket', dict(labels, le=_format_value(float(bound))), cumulative
+            yield f'{self.name}_sum', labels, total
+            yield f'{self.name}_count', labels, count
+
+
+class MetricsRegistry:
+    """Tập các metric của một tiến trình, xuất theo định dạng text của Prometheus"""
+
+    def __init__(self, const_labels=None):
+        self.const_labels = dict(const_labels or {})
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=(), fn=None):
+        return self.register(Counter(name, documentation, labelnames, fn))
+
+    def gauge(self, name, documentation, labelnames=(), fn=None):
+        return self.register(Gauge(name, documentation, labelnames, fn))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics)
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                labels = dict(self.const_labels, **labels)
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def write_file(self, path):
+        """Ghi metrics ra file (thay thế nguyên tử), dùng cho textfile collector"""
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+    def serve_http(self, port, host='127.0.0.1'):
+        """Phục vụ GET /metrics trên host:port trong một thread nền"""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        httpd = ThreadingHTTPServer((host, port), Handler)
+        httpd.daemon_threads = True
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        return httpd
+
+    def write_periodically(self, path, interval=FILE_INTERVAL):
+        def run():
+            while True:
+                try:
+                    self.write_file(path)
+                except OSError as e:
+                    logging.error(f"Không ghi được file metrics {path}: {str(e)}")
+                time.sleep(interval)
+
+        threading.Thread(target=run, daemon=True).start()
+
+
+class EventLog:
+    """Log sự kiện dạng JSON, mỗi sự kiện một dòng"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'a', encoding='utf-8', buffering=1)
+        self._lock = threading.Lock()
+
+    def emit(self, event, **fields):
+        line = json.dumps({'ts': round(time.time(), 6), 'event': event, **fields},
+                          ensure_ascii=False)
+        with self._lock:
+            self.file.write(line + '\n')
+
+    def close(self):
+        self.file.close()
+
+
+class RequestTrace:
+    """Thời điểm nhận request, gửi byte đầu tiên và byte cuối cùng của một request"""
+
+    __slots__ = ('metrics', 'kind', 'accepted', 'received', 'first', 'filename', 'nbytes')
+
+    def __init__(self, metrics, kind, accepted=None):
+        self.metrics = metrics
+        self.kind = kind
+        self.received = time.monotonic()
+        self.accepted = self.received if accepted is None else accepted
+        self.first = None
+        # File và số byte dữ liệu đã gửi, do người xử lý request điền vào
+        self.filename = None
+        self.nbytes = 0
+
+    def first_byte(self):
+        if self.first is None:
+            self.first = time.monotonic()
+
+    def finish(self, status='ok'):
+        self.metrics._finish(self, status, time.monotonic())
+
+
+class TransferMetrics:
+    """Các metric chung của một file server (TCP hoặc UDP).
+
+    Chỉ cập nhật một lần cho mỗi kết nối và mỗi request, không phải mỗi lần
+    gửi, để không làm chậm đường gửi dữ liệu.
+    """
+
+    def __init__(self, prefix, port=None, host='127.0.0.1', path=None, event_log=None):
+        self.prefix = prefix
+        self.port = port
+        self.host = host
+        self.path = path
+        self.event_log_path = event_log
+        self.event_log = None
+        self.registry = MetricsRegistry()
+        registry = self.registry
+        self.connections = registry.counter(f'{prefix}_connections_total',
+                                            "Số kết nối đã chấp nhận")
+        self.active_connections = registry.gauge(f'{prefix}_active_connections',
+                                                 "Số kết nối đang mở")
+        self.requests = registry.counter(f'{prefix}_requests_total',
+                                         "Số request theo loại và kết quả", ('type', 'status'))
+        self.bytes_sent = registry.counter(f'{prefix}_bytes_sent_total',
+                                           "Số byte dữ liệu file đã gửi", ('file',))
+        self.retransmits = registry.counter(f'{prefix}_retransmitted_chunks_total',
+                                            "Số chunk phải gửi lại", ('file',))
+        self.first_byte_latency = registry.histogram(
+            f'{prefix}_request_first_byte_seconds',
+            "Thời gian từ lúc nhận request tới khi gửi byte đầu tiên", ('type',))
+        self.request_latency = registry.histogram(
+            f'{prefix}_request_duration_seconds',
+            "Thời gian từ lúc nhận request tới khi gửi byte cuối cùng", ('type',))
+
+    def set_worker(self, worker):
+        """Gắn nhãn worker và tách cổng/file xuất riêng cho mỗi tiến trình worker"""
+        self.registry.const_labels['worker'] = str(worker)
+        if self.port:
+            self.port += worker
+        if self.path:
+            self.path = f'{self.path}.{worker}'
+        if self.event_log_path:
+            self.event_log_path = f'{self.event_log_path}.{worker}'
+
+    def start(self):
+        """Bắt đầu xuất metrics theo cấu hình (gọi trong tiến trình phục vụ)"""
+        if self.port:
+            try:
+                self.registry.serve_http(self.port, self.host)
+                logging.info(f"Metrics tại http://{self.host}:{self.port}/metrics")
+            except OSError as e:
+                logging.error(f"Không mở được cổng metrics {self.port}: {str(e)}")
+        if self.path:
+            self.registry.write_periodically(self.path)
+        if self.event_log_path and self.event_log is None:
+            self.event_log = EventLog(self.event_log_path)
+
+    def connection_opened(self):
+        self.connections.inc()
+        self.active_connections.inc()
+
+    def connection_closed(self):
+        self.active_connections.dec()
+
+    def request(self, kind, accepted=None):
+        return RequestTrace(self, kind, accepted)
+
+    def retransmitted(self, filename, chunks=1):
+        self.retransmits.labels(filename).inc(chunks)
+
+    def _finish(self, trace, status, now):
+        first = trace.first if trace.first is not None else now
+        self.requests.labels(trace.kind, status).inc()
+        self.first_byte_latency.labels(trace.kind).observe(first - trace.received)
+        self.request_latency.labels(trace.kind).observe(now - trace.received)
+        if trace.nbytes:
+            self.bytes_sent.labels(trace.filename).inc(trace.nbytes)
+        if self.event_log is not None:
+            self.event_log.emit(
+                'request', type=trace.kind, status=status, file=trace.filename,
+                bytes=trace.nbytes, accept_to_request=round(trace.received - trace.accepted, 6),
+                first_byte=round(first - trace.received, 6),
+                last_byte=round(now - trace.received, 6))
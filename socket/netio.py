@@ -0,0 +1,104 @@
+# netio.py
+import errno
+import os
+import select
+import socket
+
+# Kích thước mỗi lần đọc/gửi khi không dùng được sendfile
+SEND_CHUNK_SIZE = 256 * 1024
+# Giới hạn số byte cho một lần gọi os.sendfile
+SENDFILE_MAX_BLOCK = 0x7FFFF000
+
+# Các lỗi cho biết sendfile không dùng được với cặp fd này
+_SENDFILE_UNSUPPORTED = {
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.ENOTSOCK,
+    errno.EOPNOTSUPP,
+    errno.ESPIPE,
+}
+
+USE_SENDFILE = hasattr(os, 'sendfile')
+
+
+class _SendfileUnsupported(Exception):
+    """sendfile không khả dụng, cần chuyển sang vòng lặp đọc/gửi"""
+
+
+def _wait_writable(sock):
+    # poll thay vì select.select, vốn lỗi khi fd vượt FD_SETSIZE (1024); sendfile
+    # chỉ có trên POSIX nên luôn có select.poll
+    timeout = sock.gettimeout()
+    poller = select.poll()
+    poller.register(sock, select.POLLOUT)
+    if not poller.poll(None if timeout is None else timeout * 1000):
+        raise socket.timeout("timed out")
+
+
+def _send_with_sendfile(sock, f, offset, count):
+    """Gửi bằng os.sendfile (zero-copy), trả về số byte đã gửi"""
+    out_fd = sock.fileno()
+    in_fd = f.fileno()
+    total = 0
+    while total < count:
+        try:
+            sent = os.sendfile(out_fd, in_fd, offset + total,
+                               min(count - total, SENDFILE_MAX_BLOCK))
+        except BlockingIOError:
+            # Socket có timeout nên ở chế độ non-blocking
+            _wait_writable(sock)
+            continue
+        except OSError as e:
+            if total == 0 and e.errno in _SENDFILE_UNSUPPORTED:
+                raise _SendfileUnsupported() from e
+            raise
+        if sent == 0:
+            # Hết file sớm hơn dự kiến
+            break
+        total += sent
+    return total
+
+
+def _send_with_read(sock, f, offset, count, chunk_size=SEND_CHUNK_SIZE):
+    """Gửi bằng vòng lặp đọc từng khối cố định vào một buffer dùng lại"""
+    buffer = bytearray(min(chunk_size, count))
+    view = memoryview(buffer)
+    f.seek(offset)
+    total = 0
+    while total < count:
+        n = f.readinto(view[:min(len(buffer), count - total)])
+        if not n:
+            break
+        sock.sendall(view[:n])
+        total += n
+    return total
+
+
+def send_file_range(sock, f, offset=0, count=None):
+    """Gửi count byte của file f bắt đầu từ offset qua sock.
+
+    Ưu tiên sendfile để dữ liệu không đi qua heap của Python; nếu không
+    được thì gửi memoryview của mmap (khi f là CachedFile) hoặc dùng vòng
+    lặp đọc/gửi với buffer cố định. Nếu count là None
+    thì gửi tới hết file. Trả về số byte đã gửi.
+    """
+    if count is None:
+        count = max(0, os.fstat(f.fileno()).st_size - offset)
+    if count <= 0:
+        return 0
+
+    if USE_SENDFILE:
+        try:
+            return _send_with_sendfile(sock, f, offset, count)
+        except _SendfileUnsupported:
+            pass
+    if hasattr(f, 'view'):
+        # File đã được mmap (FileCache): gửi thẳng memoryview, không copy qua heap.
+        # Mỗi phần một view để kích thước file được kiểm tra lại trước khi đọc
+        sent = 0
+        while sent < count:
+            view = f.view(offset + sent, min(SEND_CHUNK_SIZE, count - sent))
+            sock.sendall(view)
+            sent += len(view)
+        return sent
+    return _send_with_read(sock, f, offset, count)
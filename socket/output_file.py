@@ -0,0 +1,91 @@
+# output_file.py
+# File đích được cấp phát trước đủ kích thước; các segment ghi thẳng vào đúng
+# vị trí của mình bằng pwrite nên không cần file tạm cho từng phần và bước ghép.
+import os
+import threading
+
+# Hậu tố của file đang tải dở, đổi tên thành file đích khi tải xong
+PARTIAL_SUFFIX = '.partial'
+
+
+def preallocate(fd, size):
+    """Cấp phát trước size byte cho file, quay về ftruncate nếu hệ thống không hỗ trợ"""
+    if size and hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError:
+            # Ví dụ một số hệ thống file mạng không hỗ trợ fallocate
+            pass
+    os.ftruncate(fd, size)
+
+
+class OutputFile:
+    """File đích của một lượt tải, ghi được từ nhiều thread tại các offset bất kỳ"""
+
+    def __init__(self, path, size, resume=False):
+        """resume giữ lại dữ liệu của file .partial cũ nếu có, để tải tiếp"""
+        self.path = path
+        self.partial_path = path + PARTIAL_SUFFIX
+        self.size = size
+        flags = os.O_RDWR | os.O_CREAT
+        if not resume:
+            flags |= os.O_TRUNC
+        self.fd = os.open(self.partial_path, flags, 0o644)
+        self._lock = threading.Lock()
+        # File cũ chỉ dùng lại được nếu đúng kích thước (đã được cấp phát đủ)
+        self.resumed = resume and os.fstat(self.fd).st_size == size
+        try:
+            if resume and not self.resumed:
+                os.ftruncate(self.fd, 0)
+            preallocate(self.fd, size)
+        except OSError:
+            self.discard()
+            raise
+
+    def write_at(self, offset, data):
+        if offset < 0 or offset + len(data) > self.size:
+            raise ValueError(f"Ghi ngoài file: {offset}+{len(data)} > {self.size}")
+        view = memoryview(data)
+        while view:
+            if hasattr(os, 'pwrite'):
+                written = os.pwrite(self.fd, view, offset)
+            else:
+                # Không có pwrite (Windows): seek và write phải đi cùng nhau
+                with self._lock:
+                    os.lseek(self.fd, offset, os.SEEK_SET)
+                    written = os.write(self.fd, view)
+            view = view[written:]
+            offset += written
+
+    def read_at(self, offset, size):
+        """Đọc lại size byte đã ghi tại offset"""
+        if hasattr(os, 'pread'):
+            return os.pread(self.fd, size, offset)
+        with self._lock:
+            os.lseek(self.fd, offset, os.SEEK_SET)
+            return os.read(self.fd, size)
+
+    def sync(self):
+        """Đẩy dữ liệu đã ghi xuống đĩa"""
+        if hasattr(os, 'fdatasync'):
+            os.fdatasync(self.fd)
+        else:
+            os.fsync(self.fd)
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def commit(self):
+        """Đóng file và đổi tên thành file đích"""
+        self.close()
+        os.replace(self.partial_path, self.path)
+
+    def discard(self):
+        self.close()
+        try:
+            os.remove(self.partial_path)
+        except OSError:
+            pass
@@ -0,0 +1,97 @@
+# progress.py
+# Tổng hợp tiến độ của các lượt tải. Worker chỉ cộng số byte vào bộ đếm của
+# segment mình đang tải; một thread duy nhất đọc các bộ đếm theo chu kỳ cố
+# định, tính phần trăm, tốc độ và thời gian còn lại rồi gửi một lô cập nhật
+# cho các listener (ví dụ GUI qua root.after).
+import threading
+import time
+from collections import deque, namedtuple
+
+# Chu kỳ gửi cập nhật tiến độ
+PROGRESS_INTERVAL = 0.2
+# Tốc độ tính trên khoảng thời gian gần nhất này
+SPEED_WINDOW = 3.0
+
+ProgressUpdate = namedtuple('ProgressUpdate',
+                            'filename state received size progress speed eta')
+
+
+class ProgressAggregator:
+    """Đọc tiến độ các task theo chu kỳ và gửi cập nhật theo lô.
+
+    tasks() trả về các task cần theo dõi (có filename, state, received,
+    size, progress, done). Mỗi listener nhận một danh sách ProgressUpdate,
+    gọi từ thread của aggregator. Task đã kết thúc được báo một lần cuối
+    rồi bỏ qua; thread ngủ khi không còn task nào chưa kết thúc.
+    """
+
+    def __init__(self, tasks, interval=PROGRESS_INTERVAL, window=SPEED_WINDOW):
+        self.tasks = tasks
+        self.interval = interval
+        self.window = window
+        self.listeners = []
+        # task -> các mẫu (thời điểm, byte đã nhận) trong cửa sổ tính tốc độ
+        self._samples = {}
+        # task -> cập nhật gần nhất đã gửi
+        self._last = {}
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def wake(self):
+        """Báo có task mới, bắt đầu thread nếu chưa chạy"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def collect(self, now):
+        """Tính cập nhật của các task đã thay đổi từ lần trước"""
+        updates = []
+        for task in self.tasks():
+            last = self._last.get(task)
+            if last is not None and last.state == task.state and task.done:
+                # Đã báo trạng thái cuối cùng
+                self._samples.pop(task, None)
+                continue
+            update = self._update(task, now)
+            if update != last:
+                self._last[task] = update
+                updates.append(update)
+        return updates
+
+    def _update(self, task, now):
+        received = task.received
+        samples = self._samples.setdefault(task, deque())
+        samples.append((now, received))
+        while len(samples) > 2 and now - samples[1][0] >= self.window:
+            samples.popleft()
+        first_time, first_received = samples[0]
+        speed = 0.0
+        if now > first_time and not task.done:
+            speed = (received - first_received) / (now - first_time)
+        eta = None
+        if speed > 0 and task.size:
+            eta = max(0.0, (task.size - received) / speed)
+        return ProgressUpdate(task.filename, task.state, received, task.size,
+                              task.progress, speed, eta)
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            while True:
+                updates = self.collect(time.monotonic())
+                if updates:
+                    for listener in list(self.listeners):
+                        try:
+                            listener(updates)
+                        except Exception as e:
+                            print(f"Lỗi khi báo tiến độ: {str(e)}")
+                if all(task.done for task in self.tasks()):
+                    break
+                time.sleep(self.interval)
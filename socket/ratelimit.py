@@ -0,0 +1,245 @@
+# ratelimit.py
+# Giới hạn băng thông gửi của server: token bucket cho từng client (IP) và
+# từng kết nối, và chia giới hạn toàn cục cho các client đang tải theo trọng
+# số. Trước mỗi lần gửi người gọi đặt trước n byte và nhận lại số giây phải
+# chờ, nên dùng được cho cả thread (time.sleep) lẫn asyncio (asyncio.sleep).
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Kích thước mỗi lần gửi khi bị giới hạn băng thông
+THROTTLE_CHUNK = 64 * 1024
+# Lượng dữ liệu được gửi dồn ngay, tính bằng số giây ở tốc độ giới hạn
+BURST_SECONDS = 0.25
+DEFAULT_WEIGHT = 1.0
+
+_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_rate(value):
+    """Đổi '10M', '512K' hoặc số byte/giây thành byte/giây; 0 là không giới hạn"""
+    if value is None:
+        return 0
+    if isinstance(value, (int, float)):
+        rate = value
+    else:
+        text = str(value).strip().upper()
+        if text.endswith('B'):
+            text = text[:-1]
+        unit = _UNITS.get(text[-1:], 1)
+        rate = float(text[:-1] if text[-1:] in _UNITS else text) * unit
+    if rate < 0:
+        raise ValueError(f"Tốc độ không hợp lệ: {value}")
+    return int(rate)
+
+
+def _burst(rate):
+    return max(rate * BURST_SECONDS, THROTTLE_CHUNK)
+
+
+class TokenBucket:
+    """Token bucket cho phép nợ: reserve luôn thành công và trả về thời gian chờ"""
+
+    def __init__(self):
+        self.tokens = None
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, n, rate, now):
+        """Trừ n byte khỏi bucket, trả về số giây phải chờ trước khi gửi"""
+        if rate <= 0:
+            return 0.0
+        burst = _burst(rate)
+        with self._lock:
+            if self.tokens is None:
+                self.tokens = burst
+            else:
+                self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+            self.updated = now
+            self.tokens -= n
+            return max(0.0, -self.tokens / rate)
+
+
+class _Client:
+    def __init__(self, address):
+        self.address = address
+        self.bucket = TokenBucket()
+        self.connections = 0
+        self.active = 0
+
+
+class ConnectionThrottle:
+    """Giới hạn băng thông của một kết nối, tạo bởi BandwidthScheduler.connection"""
+
+    def __init__(self, scheduler, client):
+        self.scheduler = scheduler
+        self.client = client
+        self.bucket = TokenBucket()
+        self._next_send = 0.0
+        self._active = False
+
+    @property
+    def limited(self):
+        return self.scheduler.enabled
+
+    @contextmanager
+    def transfer(self):
+        """Đánh dấu kết nối đang tải để được chia phần giới hạn toàn cục"""
+        self.scheduler._activate(self)
+        try:
+            yield self
+        finally:
+            self.scheduler._deactivate(self)
+
+    def reserve(self, n):
+        """Đặt trước n byte, trả về số giây phải chờ trước khi gửi"""
+        scheduler = self.scheduler
+        now = time.monotonic()
+        delay = max(self.bucket.reserve(n, scheduler.connection_rate, now),
+                    self.client.bucket.reserve(n, scheduler.client_rate * scheduler.worker_share,
+                                               now))
+        share = scheduler._share(self.client)
+        if share:
+            # Mỗi kết nối được phát theo phần băng thông của nó, tổng không vượt giới hạn
+            start = max(now, self._next_send)
+            self._next_send = start + n / share
+            delay = max(delay, start - now)
+        return delay
+
+    def close(self):
+        self.scheduler._release(self)
+
+
+class BandwidthScheduler:
+    """Giới hạn băng thông toàn cục, theo client và theo kết nối.
+
+    Giới hạn toàn cục được chia cho các client đang tải theo trọng số
+    (client_weights, mặc định 1), rồi chia đều cho các kết nối của client
+    đó, nên một client mở nhiều kết nối không lấn được client khác và một
+    lượt tải nhỏ luôn có ngay phần băng thông của mình. Các giới hạn có
+    thể đổi khi server đang chạy qua configure() hoặc limits_file.
+
+    Khi chạy nhiều worker, mỗi tiến trình có scheduler riêng và chỉ dùng
+    worker_share của giới hạn toàn cục và giới hạn theo client. Tổng các
+    worker không vượt giới hạn, nhưng một client có kết nối dồn vào ít
+    worker chỉ được ít hơn giới hạn của nó, và trọng số chỉ được chia công
+    bằng giữa các client trong cùng một worker.
+    """
+
+    def __init__(self, global_rate=0, client_rate=0, connection_rate=0, limits_file=None,
+                 worker_share=1.0):
+        self.global_rate = global_rate
+        # Phần giới hạn toàn cục và theo client dành cho tiến trình này khi chạy nhiều worker
+        self.worker_share = worker_share
+        self.client_rate = client_rate
+        self.connection_rate = connection_rate
+        self.client_weights = {}
+        self.limits_file = limits_file
+        self._limits_mtime = None
+        self._clients = {}
+        self._active_weight = 0.0
+        self._lock = threading.Lock()
+        if limits_file:
+            self.reload()
+
+    @property
+    def enabled(self):
+        return bool(self.global_rate or self.client_rate or self.connection_rate)
+
+    def configure(self, global_rate=None, client_rate=None, connection_rate=None,
+                  client_weights=None):
+        """Đổi giới hạn, áp dụng ngay cho cả các lượt tải đang chạy"""
+        with self._lock:
+            if global_rate is not None:
+                self.global_rate = global_rate
+            if client_rate is not None:
+                self.client_rate = client_rate
+            if connection_rate is not None:
+                self.connection_rate = connection_rate
+            if client_weights is not None:
+                self.client_weights = dict(client_weights)
+                self._active_weight = sum(self._weight(client.address)
+                                          for client in self._clients.values() if client.active)
+
+    def reload(self):
+        """Đọc lại limits_file nếu file đã thay đổi, trả về True nếu có giới hạn mới.
+
+        File JSON có các khóa global_rate, client_rate, connection_rate (dạng
+        '10M' hoặc số byte/giây) và client_weights {địa chỉ IP: trọng số}.
+        """
+        try:
+            mtime = os.stat(self.limits_file).st_mtime_ns
+        except (OSError, TypeError):
+            return False
+        if mtime == self._limits_mtime:
+            return False
+        self._limits_mtime = mtime
+        try:
+            with open(self.limits_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            weights = {address: float(weight)
+                       for address, weight in data.get('client_weights', {}).items()}
+            if any(weight <= 0 for weight in weights.values()):
+                raise ValueError("Trọng số phải lớn hơn 0")
+            self.configure(global_rate=parse_rate(data.get('global_rate')),
+                           client_rate=parse_rate(data.get('client_rate')),
+                           connection_rate=parse_rate(data.get('connection_rate')),
+                           client_weights=weights)
+        except (OSError, ValueError, AttributeError) as e:
+            logging.error(f"Không đọc được {self.limits_file}: {str(e)}")
+            return False
+        logging.info(f"Giới hạn băng thông: toàn cục {self.global_rate} B/s, "
+                     f"client {self.client_rate} B/s, kết nối {self.connection_rate} B/s")
+        return True
+
+    def connection(self, address):
+        """Tạo ConnectionThrottle cho một kết nối mới từ địa chỉ IP address"""
+        with self._lock:
+            client = self._clients.get(address)
+            if client is None:
+                client = self._clients[address] = _Client(address)
+            client.connections += 1
+        return ConnectionThrottle(self, client)
+
+    def _weight(self, address):
+        return self.client_weights.get(address, DEFAULT_WEIGHT)
+
+    def _activate(self, throttle):
+        with self._lock:
+            throttle._active = True
+            throttle._next_send = time.monotonic()
+            client = throttle.client
+            if not client.active:
+                self._active_weight += self._weight(client.address)
+            client.active += 1
+
+    def _deactivate(self, throttle):
+        with self._lock:
+            if not throttle._active:
+                return
+            throttle._active = False
+            client = throttle.client
+            client.active -= 1
+            if not client.active:
+                self._active_weight -= self._weight(client.address)
+
+    def _release(self, throttle):
+        self._deactivate(throttle)
+        with self._lock:
+            client = throttle.client
+            client.connections -= 1
+            if not client.connections:
+                del self._clients[client.address]
+
+    def _share(self, client):
+        """Phần giới hạn toàn cục (byte/giây) của một kết nối đang tải của client"""
+        rate = self.global_rate * self.worker_share
+        if not rate:
+            return 0
+        with self._lock:
+            if not client.active or self._active_weight <= 0:
+                return rate
+            return rate * self._weight(client.address) / (self._active_weight * client.active)
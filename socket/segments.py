@@ -0,0 +1,123 @@
+# segments.py
+# Chia một file thành các segment tải song song. Worker tải xong segment của
+# mình sẽ lấy bớt phần chưa được yêu cầu của segment chậm nhất (work stealing),
+# nên kết nối chậm không giữ chân cả lượt tải.
+import threading
+import time
+from collections import deque
+
+
+class Segment:
+    """Đoạn [start, end) của file do một worker tải; end có thể bị rút ngắn khi bị lấy bớt"""
+
+    __slots__ = ('index', 'start', 'end', 'requested', 'received', 'started')
+
+    def __init__(self, index, start, end):
+        self.index = index
+        self.start = start
+        self.end = end
+        # Vị trí tiếp theo chưa gửi request, phần sau vị trí này có thể bị lấy bớt
+        self.requested = start
+        self.received = 0
+        self.started = time.monotonic()
+
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return self.received / elapsed if self.received and elapsed > 0 else None
+
+
+class SegmentScheduler:
+    """Phân phối các đoạn của một file cho các worker.
+
+    Ranh giới mới luôn nằm trên ranh giới block (block_size) để mỗi segment
+    vẫn kiểm tra được hash theo block. Không lấy bớt phần nhỏ hơn min_split.
+    ranges là các đoạn [start, end) cần tải (mặc định cả file), ví dụ các
+    phần còn thiếu khi tải tiếp; mỗi đoạn là một segment chờ worker nhận.
+    """
+
+    def __init__(self, size, block_size, piece_size, min_split, ranges=None):
+        self.size = size
+        self.block_size = block_size
+        self.piece_size = piece_size
+        self.min_split = max(min_split, block_size)
+        if ranges is None:
+            ranges = [(0, size)]
+        self.segments = [Segment(i, start, end) for i, (start, end) in enumerate(ranges)]
+        # Các segment chưa có worker nào nhận
+        self.pending = deque(self.segments)
+        self.workers = 0
+        # Được set khi worker cuối cùng kết thúc
+        self.finished = threading.Event()
+        self._lock = threading.Lock()
+
+    def worker_started(self):
+        with self._lock:
+            self.workers += 1
+
+    def worker_done(self):
+        with self._lock:
+            self.workers -= 1
+            if not self.workers:
+                self.finished.set()
+
+    def release_worker(self):
+        """Cho một worker dừng sớm nếu còn worker khác làm tiếp, trả về True nếu được"""
+        with self._lock:
+            if self.workers > 1:
+                self.workers -= 1
+                return True
+            return False
+
+    def next_piece(self, segment):
+        """Đoạn (offset, count) tiếp theo cần yêu cầu của segment, None nếu đã hết"""
+        with self._lock:
+            if segment.requested >= segment.end:
+                return None
+            offset = segment.requested
+            count = min(self.piece_size, segment.end - offset)
+            segment.requested += count
+            return offset, count
+
+    def pieces(self, segment):
+        while True:
+            piece = self.next_piece(segment)
+            if piece is None:
+                return
+            yield piece
+
+    def next_segment(self):
+        """Segment tiếp theo cho một worker rảnh: segment chưa ai nhận, hoặc phần lấy bớt"""
+        with self._lock:
+            if self.pending:
+                segment = self.pending.popleft()
+                segment.started = time.monotonic()
+                return segment
+        return self.steal()
+
+    def steal(self):
+        """Tách nửa sau phần chưa yêu cầu của segment sẽ xong muộn nhất thành segment mới"""
+        with self._lock:
+            rates = [r for r in (s.rate() for s in self.segments) if r]
+            default_rate = sum(rates) / len(rates) if rates else 1.0
+            victim = None
+            latest = 0.0
+            for segment in self.segments:
+                if segment in self.pending:
+                    continue
+                remaining = segment.end - segment.requested
+                if remaining < 2 * self.min_split:
+                    continue
+                finish = remaining / (segment.rate() or default_rate)
+                if finish > latest:
+                    victim, latest = segment, finish
+            if victim is None:
+                return None
+
+            middle = victim.requested + (victim.end - victim.requested) // 2
+            split = -(-middle // self.block_size) * self.block_size
+            if victim.end - split < self.min_split:
+                return None
+            segment = Segment(len(self.segments), split, victim.end)
+            victim.end = split
+            self.segments.append(segment)
+            return segment
@@ -0,0 +1,291 @@
+# tcp_async_server.py
+import asyncio
+import json
+import logging
+import time
+
+from tcp_protocol import (
+    MAX_CONTROL_BODY, MESSAGE_NAMES, MSG_CATALOG, MSG_COPY, MSG_DATA, MSG_DELTA, MSG_DELTA_END,
+    MSG_ERROR, MSG_GET, MSG_LIST, MSG_HASH_LIST, MSG_HASHES, MSG_PING, MSG_PONG, MSG_SUBSCRIBE,
+    STATUS_BAD_REQUEST,
+    STATUS_NAMES, ProtocolError, RemoteError, async_read_header, async_recv_exact, error_body,
+    pack_header,
+)
+from compression import compress
+from delta import OP_COPY, delta_ops
+from netio import SEND_CHUNK_SIZE
+from ratelimit import THROTTLE_CHUNK
+from tcp_server import CATALOG_INTERVAL, FileServer, RequestError
+
+
+class AsyncFileServer(FileServer):
+    """File server chạy trên một event loop asyncio thay vì một thread mỗi kết nối"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.loop = None
+        self._serve_task = None
+        self._client_tasks = set()
+
+    def serve_forever(self):
+        asyncio.run(self._serve())
+
+    def stop(self):
+        """Dừng event loop từ thread khác"""
+        if self.loop and self._serve_task:
+            self.loop.call_soon_threadsafe(self._serve_task.cancel)
+            logging.info("Server đã dừng")
+        else:
+            super().stop()
+
+    async def _serve(self):
+        self.loop = asyncio.get_running_loop()
+        self._serve_task = asyncio.current_task()
+        self.server.setblocking(False)
+        slots = asyncio.Semaphore(self.max_connections)
+        try:
+            while True:
+                # Đủ số kết nối tối đa thì ngừng accept, kết nối mới chờ trong backlog
+                await slots.acquire()
+                try:
+                    client_socket, address = await self.loop.sock_accept(self.server)
+                except BaseException:
+                    slots.release()
+                    raise
+                logging.info(f"Kết nối mới từ {address}")
+                client_socket.setblocking(False)
+                task = asyncio.create_task(self._run_client_async(client_socket, slots))
+                self._client_tasks.add(task)
+                task.add_done_callback(self._client_tasks.discard)
+        except asyncio.CancelledError:
+            logging.info("Đang tắt server...")
+        finally:
+            for task in list(self._client_tasks):
+                task.cancel()
+
+    async def _run_client_async(self, client_socket, slots):
+        try:
+            await self.handle_client_async(client_socket)
+        finally:
+            slots.release()
+
+    async def handle_client_async(self, client_socket):
+        """Xử lý kết nối từ client, cùng giao thức với FileServer.handle_client"""
+        loop = self.loop
+        accepted = time.monotonic()
+        self.socket_options.apply(client_socket)
+        self.metrics.connection_opened()
+        throttle = self._open_throttle(client_socket)
+        try:
+            while True:
+                try:
+                    frame = await async_read_header(loop, client_socket,
+                                                    options=self.socket_options)
+                except RemoteError as e:
+                    # Sai phiên bản giao thức: báo lỗi rồi đóng kết nối
+                    await self._send_error(client_socket, e.request_id, e.status, e.message)
+                    break
+                if frame is None:
+                    break
+                if frame.length > MAX_CONTROL_BODY:
+                    raise ProtocolError(f"Body quá lớn: {frame.length} bytes")
+                body = await async_recv_exact(loop, client_socket, frame.length)
+
+                trace = self.metrics.request(MESSAGE_NAMES.get(frame.type, 'unknown'), accepted)
+                try:
+                    await self.handle_request_async(client_socket, frame, body, throttle, trace)
+                except RequestError as e:
+                    trace.finish(STATUS_NAMES.get(e.status, str(e.status)))
+                    logging.error(e.message)
+                    await self._send_error(client_socket, frame.request_id, e.status, e.message)
+                except BaseException:
+                    trace.finish('aborted')
+                    raise
+                else:
+                    trace.finish()
+
+        except asyncio.CancelledError:
+            pass
+        except ProtocolError as e:
+            logging.error(f"Lỗi giao thức từ client: {str(e)}")
+        except Exception as e:
+            logging.error(f"Lỗi không mong đợi: {str(e)}")
+        finally:
+            throttle.close()
+            self.metrics.connection_closed()
+            client_socket.close()
+
+    async def handle_request_async(self, client_socket, frame, body, throttle, trace):
+        loop = self.loop
+        if frame.type == MSG_LIST:
+            # Gửi danh sách files cho client
+            await self._send_json(client_socket, MSG_CATALOG, self.catalog.snapshot(),
+                                  request_id=frame.request_id)
+
+        elif frame.type == MSG_SUBSCRIBE:
+            await self._stream_catalog_async(client_socket, frame)
+
+        elif frame.type == MSG_HASHES:
+            # Băm file có thể lâu, không chạy trên event loop
+            hashes = await loop.run_in_executor(
+                None, self._block_hashes, self._requested_file(body)[0])
+            await self._send_json(client_socket, MSG_HASH_LIST, hashes.to_dict(),
+                                  request_id=frame.request_id)
+
+        elif frame.type == MSG_PING:
+            await loop.sock_sendall(client_socket,
+                                    pack_header(MSG_PONG, request_id=frame.request_id))
+
+        elif frame.type == MSG_GET:
+            # stat, open và mmap của file cache có thể chậm trên đĩa nguội hoặc
+            # hệ thống file mạng, không chạy trên event loop
+            filename, request, entry, offset, count = await loop.run_in_executor(
+                None, self._open_range, frame, body)
+            try:
+                with throttle.transfer():
+                    await self._send_get_async(client_socket, frame, filename, request,
+                                               entry, offset, count, throttle, trace)
+            finally:
+                self.file_cache.release(entry)
+            trace.filename, trace.nbytes = filename, count
+            logging.info(f"Đã gửi {filename} từ byte {offset} đến {offset + count}")
+
+        elif frame.type == MSG_DELTA:
+            filename, request, signature = self._delta_request(body)
+            entry = await loop.run_in_executor(None, self._acquire_file, filename)
+            try:
+                with throttle.transfer():
+                    literal = await self._send_delta_async(client_socket, frame, filename,
+                                                           request, entry, signature, throttle,
+                                                           trace)
+            finally:
+                self.file_cache.release(entry)
+            trace.filename, trace.nbytes = filename, literal
+            logging.info(f"Đã gửi delta của {filename}: {literal}/{entry.size} bytes mới")
+
+        else:
+            raise RequestError(STATUS_BAD_REQUEST, f"Loại frame không hỗ trợ: {frame.type}")
+
+    async def _send_get_async(self, client_socket, frame, filename, request, entry,
+                              offset, count, throttle, trace):
+        loop = self.loop
+        codec_id = self._choose_codec(filename, request, entry, count)
+        if codec_id is None:
+            await self._send_raw_async(client_socket, frame.request_id, entry, offset, count,
+                                       throttle, trace)
+            return
+        for piece_offset, piece_count in self.compressor.pieces(offset, count):
+            # Nén tốn CPU nên chạy ngoài event loop
+            piece_codec, payload = await loop.run_in_executor(
+                None, self.compressor.compress_piece, filename, entry, codec_id,
+                piece_offset, piece_count)
+            if payload is None:
+                await self._send_raw_async(client_socket, frame.request_id, entry,
+                                           piece_offset, piece_count, throttle, trace)
+                continue
+            if throttle.limited:
+                await asyncio.sleep(throttle.reserve(len(payload)))
+            await loop.sock_sendall(client_socket, pack_header(
+                MSG_DATA, request_id=frame.request_id, flags=piece_codec,
+                offset=piece_offset, count=piece_count, length=len(payload)) + payload)
+            trace.first_byte()
+
+    async def _send_delta_async(self, client_socket, frame, filename, request, entry,
+                                signature, throttle, trace):
+        loop = self.loop
+        codec_id = self._choose_codec(filename, request, entry, entry.size)
+        # Quét file bằng cửa sổ trượt tốn CPU nên chạy ngoài event loop
+        ops = await loop.run_in_executor(
+            None, list, delta_ops(entry.view(0, entry.size), signature))
+        stats = {'literal': 0, 'copied': 0}
+        for op, offset, count, source in ops:
+            if op == OP_COPY:
+                await self._send_json(client_socket, MSG_COPY, {'source': source},
+                                      request_id=frame.request_id, offset=offset, count=count)
+                trace.first_byte()
+                stats['copied'] += count
+                continue
+            stats['literal'] += count
+            payload = None
+            if codec_id is not None:
+                payload = await loop.run_in_executor(
+                    None, compress, codec_id, entry.view(offset, count))
+            if payload is None or len(payload) >= count:
+                await self._send_raw_async(client_socket, frame.request_id, entry,
+                                           offset, count, throttle, trace)
+                continue
+            if throttle.limited:
+                await asyncio.sleep(throttle.reserve(len(payload)))
+            await loop.sock_sendall(client_socket, pack_header(
+                MSG_DATA, request_id=frame.request_id, flags=codec_id,
+                offset=offset, count=count, length=len(payload)) + payload)
+            trace.first_byte()
+        await self._send_json(client_socket, MSG_DELTA_END, stats,
+                              request_id=frame.request_id, count=entry.size)
+        trace.first_byte()
+        return stats['literal']
+
+    async def _send_raw_async(self, client_socket, request_id, entry, offset, count, throttle,
+                              trace):
+        await self.loop.sock_sendall(client_socket, pack_header(
+            MSG_DATA, request_id=request_id, offset=offset, count=count, length=count))
+        trace.first_byte()
+        if throttle.limited:
+            sent = 0
+            while sent < count:
+                n = min(THROTTLE_CHUNK, count - sent)
+                await asyncio.sleep(throttle.reserve(n))
+                chunk = await self._send_range_async(client_socket, entry, offset + sent, n)
+                sent += chunk
+                if chunk != n:
+                    break
+        else:
+            sent = await self._send_range_async(client_socket, entry, offset, count)
+        if sent != count:
+            raise ConnectionError(f"File {entry.path} bị thay đổi khi đang gửi")
+
+    async def _send_range_async(self, client_socket, entry, offset, count):
+        """Gửi đoạn file bằng sendfile của event loop, hoặc memoryview của mmap nếu không được"""
+        if not count:
+            return 0
+        try:
+            # Không dùng fallback của asyncio vì nó seek file object đang được dùng chung
+            return await self.loop.sock_sendfile(client_socket, entry.file, offset, count,
+                                                 fallback=False)
+        except asyncio.SendfileNotAvailableError:
+            # Mỗi phần một view để kích thước file được kiểm tra lại trước khi đọc
+            sent = 0
+            while sent < count:
+                view = entry.view(offset + sent, min(SEND_CHUNK_SIZE, count - sent))
+                await self.loop.sock_sendall(client_socket, view)
+                sent += len(view)
+            return sent
+
+    async def _stream_catalog_async(self, client_socket, frame):
+        """Gửi catalog rồi đẩy các thay đổi cho tới khi client đóng kết nối"""
+        snapshot = self.catalog.snapshot()
+        await self._send_json(client_socket, MSG_CATALOG, snapshot, request_id=frame.request_id)
+        version = snapshot['version']
+        # Kết nối theo dõi chỉ nhận, dữ liệu đến nghĩa là client đã đóng
+        closed = asyncio.ensure_future(self.loop.sock_recv(client_socket, 1))
+        try:
+            while True:
+                done, _ = await asyncio.wait({closed}, timeout=CATALOG_INTERVAL)
+                if done:
+                    break
+                if self.catalog.version != version:
+                    msg_type, payload = self._catalog_update(version)
+                    await self._send_json(client_socket, msg_type, payload)
+                    version = payload['version']
+        finally:
+            closed.cancel()
+
+    async def _send_json(self, client_socket, msg_type, obj, **fields):
+        body = json.dumps(obj).encode()
+        await self.loop.sock_sendall(client_socket, pack_header(
+            msg_type, length=len(body), **fields) + body)
+
+    async def _send_error(self, client_socket, request_id, status, message):
+        body = error_body(message)
+        await self.loop.sock_sendall(client_socket, pack_header(
+            MSG_ERROR, request_id=request_id, status=status, length=len(body)) + body)
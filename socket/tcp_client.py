@@ -1,16 +1,18 @@
 # client_gui.py
+import argparse
 import tkinter as tk
 from tkinter import ttk, messagebox
-import json
 import socket
 import threading
-import os
 from datetime import datetime
-from threading import Thread
 import time
+from download_engine import COMPLETED, DownloadEngine
+from fswatch import FileTailer
+from ratelimit import parse_rate
+from tcp_protocol import SocketOptions
 
 class DownloadManagerGUI:
-    def __init__(self, root):
+    def __init__(self, root, socket_options=None):
         self.root = root
         self.root.title("Download Manager")
         self.root.geometry("800x600")
@@ -19,16 +21,27 @@ class DownloadManagerGUI:
         self.host = 'localhost'
         self.port = 5000
         self.files_info = {}
-        self.active_downloads = {}
-        self.downloaded_files = set()
+        self.download_rows = {}
         
         # Thêm thư mục downloads
         self.download_dir = "downloads"
-        if not os.path.exists(self.download_dir):
-            os.makedirs(self.download_dir)
+        # Toàn bộ việc tải nằm trong engine, GUI chỉ hiển thị
+        self.engine = DownloadEngine(self.host, self.port, self.download_dir,
+                                     socket_options=socket_options)
+        # Engine gửi tiến độ của mọi file theo lô ở tần suất cố định, GUI cập nhật một lần mỗi lô
+        self.engine.add_progress_listener(
+            lambda updates: self.root.after(0, self.apply_progress, updates))
+        self.downloaded_files = set(self.engine.completed_files())
+        # Các file trong input.txt đã giao cho engine trong lần chạy này. File
+        # tải xong ở lần trước vẫn được giao lại: engine bỏ qua nếu bản trên
+        # server chưa đổi, tải tiếp file dở hoặc dựng phiên bản mới bằng DELTA
+        self.processed_files = set()
+        # Các file trong input.txt mà catalog chưa có
+        self.waiting_files = set()
         
         self.setup_gui()
-        self.connect_to_server()
+        # Kết nối trong thread nền để cửa sổ hiện ngay
+        threading.Thread(target=self.connect_to_server, daemon=True).start()
         
         # Bắt đầu thread monitor input.txt
         self.monitor_thread = threading.Thread(target=self.monitor_input_file)
@@ -65,7 +78,7 @@ class DownloadManagerGUI:
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         
         # Add download button
-        self.download_btn = ttk.Button(frame, text="Download Selected", command=self.start_download)
+        self.download_btn = ttk.Button(frame, text="Download Selected", command=self.download_selected)
         self.download_btn.pack(pady=5)
         
     def setup_downloads_frame(self):
@@ -74,7 +87,7 @@ class DownloadManagerGUI:
         frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
         
         # Create treeview for downloads
-        columns = ("File", "Progress", "Speed", "Status")
+        columns = ("File", "Progress", "Speed", "ETA", "Status")
         self.downloads_tree = ttk.Treeview(frame, columns=columns, show='headings')
         
         # Setup columns
@@ -98,34 +111,46 @@ class DownloadManagerGUI:
         self.status_var.set("Ready")
         
     def connect_to_server(self):
-        """Connect to server and get files list"""
+        """Lấy danh sách file rồi theo dõi thay đổi của catalog (chạy trong thread nền)"""
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(5)  # Thêm timeout 5 giây
-            sock.connect((self.host, self.port))
-            
-            # Get files list
-            files_data = sock.recv(4096).decode()
-            self.files_info = json.loads(files_data)
-            sock.close()
-            
-            # Update GUI
-            self.update_files_list()
-            self.status_var.set("Connected to server")
-            
+            files = self.engine.list_files()
         except ConnectionRefusedError:
             error_msg = "Không thể kết nối đến server. Hãy đảm bảo server đang chạy."
-            messagebox.showerror("Lỗi Kết Nối", error_msg)
-            self.status_var.set("Kết nối thất bại - Server không hoạt động")
+            self.root.after(0, self.show_connection_error, error_msg,
+                            "Kết nối thất bại - Server không hoạt động")
+            return
         except socket.timeout:
             error_msg = "Kết nối đến server quá thời gian chờ"
-            messagebox.showerror("Lỗi Kết Nối", error_msg)
-            self.status_var.set("Kết nối thất bại - Timeout")
+            self.root.after(0, self.show_connection_error, error_msg,
+                            "Kết nối thất bại - Timeout")
+            return
         except Exception as e:
             error_msg = f"Lỗi kết nối đến server: {str(e)}"
-            messagebox.showerror("Lỗi Kết Nối", error_msg)
-            self.status_var.set("Kết nối thất bại")
-            
+            self.root.after(0, self.show_connection_error, error_msg, "Kết nối thất bại")
+            return
+
+        self.root.after(0, self.on_catalog, files, "Connected to server")
+        # Nhận các thay đổi của catalog mà không cần kết nối lại
+        self.engine.watch_catalog(
+            lambda files, diff: self.root.after(0, self.on_catalog, files, None, diff))
+
+    def show_connection_error(self, error_msg, status):
+        messagebox.showerror("Lỗi Kết Nối", error_msg)
+        self.status_var.set(status)
+
+    def on_catalog(self, files, status=None, diff=None):
+        self.files_info = {name: meta['size'] for name, meta in files.items()}
+        # Phiên bản mới của file đã yêu cầu trong input.txt được tải lại
+        for filename in (diff or {}).get('updated', {}):
+            if filename in self.processed_files:
+                self.downloaded_files.discard(filename)
+                self.start_download(filename)
+        self.update_files_list()
+        for filename in list(self.waiting_files):
+            self.queue_input_file(filename)
+        if status:
+            self.status_var.set(status)
+
     def update_files_list(self):
         """Update the available files list in GUI"""
         # Clear existing items
@@ -146,110 +171,52 @@ class DownloadManagerGUI:
             size_bytes /= 1024
         return f"{size_bytes:.1f}TB"
         
+    def download_selected(self):
+        """Tải các file đang được chọn trong danh sách"""
+        for item in self.files_tree.selection():
+            self.start_download(self.files_tree.item(item)['values'][0])
+
     def start_download(self, filename):
-        """Bắt đầu download file với 4 threads"""
-        try:
-            file_size = self.files_info[filename]
-            chunk_size = file_size // 4
-            threads = []
-            self.download_progress = {filename: 0}
+        """Giao file cho download engine, GUI chỉ theo dõi tiến độ"""
+        if filename not in self.download_rows:
+            self.download_rows[filename] = self.downloads_tree.insert(
+                '', tk.END, values=(filename, "0.0%", "", "", "Queued"))
+        self.engine.submit(
+            filename,
+            size=self.files_info.get(filename),
+            on_done=lambda task: self.root.after(0, self.on_download_done, task),
+        )
 
-            # Tạo đường dẫn đầy đủ cho file
-            full_path = os.path.join(self.download_dir, filename)
-            
-            for i in range(4):
-                start = i * chunk_size
-                end = file_size if i == 3 else (i + 1) * chunk_size
-                
-                thread = Thread(
-                    target=self.download_chunk,
-                    args=(filename, start, end, i, full_path)
-                )
-                threads.append(thread)
-                thread.start()
+    def apply_progress(self, updates):
+        """Cập nhật tiến độ trên GUI từ một lô ProgressUpdate"""
+        for update in updates:
+            item = self.download_rows.get(update.filename)
+            if item is None:
+                continue
+            speed = f"{self.format_size(update.speed)}/s" if update.speed else ""
+            self.downloads_tree.item(item, values=(
+                update.filename, f"{update.progress * 100:.1f}%", speed,
+                self.format_eta(update.eta), update.state.capitalize()))
 
-            # Chờ tất cả threads hoàn thành
-            for thread in threads:
-                thread.join()
+    def format_eta(self, seconds):
+        if seconds is None:
+            return ""
+        seconds = int(seconds)
+        if seconds >= 3600:
+            return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+        return f"{seconds // 60}:{seconds % 60:02d}"
 
-            # Ghép các phần file lại
-            self.merge_file_chunks(filename)
-            
-            # Cập nhật trạng thái
-            self.downloaded_files.add(filename)
+    def on_download_done(self, task):
+        item = self.download_rows.get(task.filename)
+        if item is not None:
+            self.downloads_tree.item(item, values=(
+                task.filename, f"{task.progress * 100:.1f}%",
+                f"{self.format_size(task.speed)}/s", "", task.state.capitalize()))
+        if task.state == COMPLETED:
+            self.downloaded_files.add(task.filename)
             self.update_gui()
-
-        except Exception as e:
-            print(f"Lỗi download {filename}: {str(e)}")
-
-    def download_chunk(self, filename, start, end, chunk_id, full_path):
-        """Download một phần của file"""
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((self.host, self.port))
-
-            request = {
-                'filename': filename,
-                'start': start,
-                'end': end
-            }
-            sock.send(json.dumps(request).encode())
-
-            # Tạo temporary file trong thư mục downloads
-            temp_filename = f"{full_path}.part{chunk_id}"
-            received_bytes = 0
-            chunk_size = end - start
-
-            with open(temp_filename, 'wb') as f:
-                while received_bytes < chunk_size:
-                    data = sock.recv(min(4096, chunk_size - received_bytes))
-                    if not data:
-                        break
-                    f.write(data)
-                    received_bytes += len(data)
-                    
-                    # Cập nhật tiến độ
-                    progress = (received_bytes / chunk_size) * 25  # 25% cho mỗi chunk
-                    self.update_progress(filename, chunk_id, progress)
-
-        except Exception as e:
-            print(f"Lỗi download chunk {chunk_id} của {filename}: {str(e)}")
-        finally:
-            sock.close()
-
-    def merge_file_chunks(self, filename):
-        """Ghép các phần file lại với nhau"""
-        try:
-            full_path = os.path.join(self.download_dir, filename)
-            with open(full_path, 'wb') as outfile:
-                for i in range(4):
-                    chunk_name = f"{full_path}.part{i}"
-                    with open(chunk_name, 'rb') as infile:
-                        outfile.write(infile.read())
-                    os.remove(chunk_name)  # Xóa file tạm
-        except Exception as e:
-            print(f"Lỗi ghép file {filename}: {str(e)}")
-
-    def update_progress(self, filename, chunk_id, chunk_progress):
-        """Cập nhật tiến độ download"""
-        with threading.Lock():
-            current_progress = self.download_progress[filename]
-            # Cập nhật phần progress của chunk này (mỗi chunk 25%)
-            base_progress = chunk_id * 25
-            chunk_contribution = chunk_progress
-            new_progress = min(100, current_progress + chunk_contribution)
-            self.download_progress[filename] = new_progress
-            
-            # Cập nhật GUI
-            self.update_download_progress(filename, new_progress)
-
-    def update_download_progress(self, filename, progress):
-        """Cập nhật tiến độ trên GUI"""
-        for item in self.downloads_tree.get_children():
-            if self.downloads_tree.item(item)['values'][0] == filename:
-                self.downloads_tree.set(item, 'Progress', f"{progress:.1f}%")
-                self.downloads_tree.set(item, 'Status', 'Downloading' if progress < 100 else 'Completed')
-                break
+        else:
+            self.status_var.set(f"Tải {task.filename} không thành công: {task.error or task.state}")
 
     def update_gui(self):
         """Update the GUI"""
@@ -257,32 +224,40 @@ class DownloadManagerGUI:
         self.status_var.set("Download completed")
         
     def monitor_input_file(self):
-        """Kiểm tra file input.txt mỗi 5 giây"""
-        processed_files = set()  # Lưu các file đã xử lý
-        
+        """Đọc các dòng mới ghi thêm vào input.txt ngay khi file thay đổi"""
+        tailer = FileTailer('input.txt')
         while True:
             try:
-                # Đọc danh sách file từ input.txt
-                with open('input.txt', 'r') as f:
-                    files = set(f.read().splitlines())
-                
-                # Tìm các file mới chưa xử lý
-                new_files = files - processed_files
-                
-                # Download các file mới
-                for filename in new_files:
-                    if filename in self.files_info:  # Kiểm tra file có tồn tại trên server
-                        self.start_download(filename)
-                        processed_files.add(filename)  # Đánh dấu đã xử lý
-                
-                time.sleep(5)  # Đợi 5 giây trước khi kiểm tra lại
-                
+                for filename in tailer.read_lines(timeout=1.0):
+                    self.root.after(0, self.queue_input_file, filename)
             except Exception as e:
                 print(f"Lỗi khi đọc input.txt: {str(e)}")
-                time.sleep(5)
+                time.sleep(1)
+
+    def queue_input_file(self, filename):
+        """Tải file được yêu cầu trong input.txt, hoặc chờ tới khi server có file đó"""
+        if filename in self.processed_files:
+            return
+        if filename in self.files_info:  # Kiểm tra file có tồn tại trên server
+            self.processed_files.add(filename)  # Đánh dấu đã xử lý
+            self.waiting_files.discard(filename)
+            self.start_download(filename)
+        else:
+            self.waiting_files.add(filename)
         
 # main_client_gui.py
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download manager GUI")
+    parser.add_argument('--rcvbuf', type=parse_rate, default=0,
+                        help="SO_RCVBUF của mỗi kết nối, ví dụ 4M (0 = mặc định hệ thống)")
+    parser.add_argument('--sndbuf', type=parse_rate, default=0,
+                        help="SO_SNDBUF của mỗi kết nối, ví dụ 4M (0 = mặc định hệ thống)")
+    parser.add_argument('--no-nodelay', action='store_true', help="Không bật TCP_NODELAY")
+    parser.add_argument('--quickack', action='store_true',
+                        help="Bật TCP_QUICKACK (Linux), đặt lại sau mỗi lần nhận dữ liệu")
+    args = parser.parse_args()
     root = tk.Tk()
-    app = DownloadManagerGUI(root)
+    app = DownloadManagerGUI(root, SocketOptions(args.rcvbuf, args.sndbuf,
+                                                 nodelay=not args.no_nodelay,
+                                                 quickack=args.quickack))
     root.mainloop()
\ No newline at end of file
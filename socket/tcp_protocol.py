@@ -0,0 +1,492 @@
+# tcp_protocol.py
+# Giao thức frame có độ dài dùng chung cho tcp_server và tcp_client.
+#
+# Mỗi frame gồm header cố định 34 byte và body dài đúng `length` byte:
+#   magic(2) version(1) type(1) status(1) flags(1) request_id(4)
+#   offset(8) count(8) length(8)
+# offset/count mô tả đoạn của file mà frame nói tới (GET và DATA).
+# Client gửi LIST/GET, server trả CATALOG/DATA/ERROR với cùng request_id.
+# Server xử lý request theo thứ tự nhận được, nên client có thể gửi nhiều
+# GET liên tiếp (pipelining) rồi đọc các response theo đúng thứ tự đó.
+# Nếu GET có danh sách codec, server có thể trả một đoạn thành nhiều frame
+# DATA; flags của mỗi frame là mã codec (0 là thô), count là số byte gốc.
+# DELTA gửi chữ ký bản cũ mà client đang có (xem delta.py); server trả các
+# frame DATA (byte mới) và COPY (chép từ bản cũ) theo thứ tự vị trí, kết thúc
+# bằng DELTA_END.
+import itertools
+import json
+import lzma
+import socket
+import struct
+import zlib
+from collections import deque, namedtuple
+
+from compression import CODEC_RAW, decompress
+from delta import encode_request
+from integrity import BlockHashes
+
+MAGIC = b'FS'
+PROTOCOL_VERSION = 1
+HEADER = struct.Struct('!2sBBBBIQQQ')
+HEADER_SIZE = HEADER.size
+
+# Loại frame
+MSG_LIST = 1      # client -> server: xin danh sách file
+MSG_CATALOG = 2   # server -> client: danh sách file, JSON {"version", "files": {tên: {"size", "mtime_ns"}}}
+MSG_GET = 3       # client -> server: xin đoạn [offset, offset + count), body JSON {"filename"}
+MSG_DATA = 4      # server -> client: dữ liệu thô của đoạn, offset là vị trí trong file
+MSG_ERROR = 5     # server -> client: lỗi, body JSON {"error"}
+MSG_SUBSCRIBE = 6     # client -> server: nhận CATALOG rồi các thay đổi về sau trên kết nối này
+MSG_CATALOG_DIFF = 7  # server -> client: JSON {"version", "updated": {tên: {...}}, "removed": [...]}
+MSG_HASHES = 8        # client -> server: xin cây hash theo block của file, body JSON {"filename"}
+MSG_HASH_LIST = 9     # server -> client: JSON {"algorithm", "size", "mtime_ns", "block_size", "root", "hashes"}
+MSG_PING = 10         # client -> server: kiểm tra kết nối còn dùng được
+MSG_PONG = 11         # server -> client: trả lời PING, cùng request_id
+MSG_DELTA = 12        # client -> server: dòng JSON {"filename", "size", "block_size", "codecs"} + chữ ký
+MSG_COPY = 13         # server -> client: đoạn [offset, offset + count) lấy từ bản cũ, JSON {"source"}
+MSG_DELTA_END = 14    # server -> client: hết response DELTA, count là kích thước file, JSON {"literal", "copied"}
+
+# Trạng thái trong response
+STATUS_OK = 0
+STATUS_NOT_FOUND = 1
+STATUS_BAD_RANGE = 2
+STATUS_BAD_REQUEST = 3
+STATUS_UNSUPPORTED_VERSION = 4
+STATUS_SERVER_ERROR = 5
+
+# Tên dùng trong log và metrics
+MESSAGE_NAMES = {
+    MSG_LIST: 'list', MSG_CATALOG: 'catalog', MSG_GET: 'get', MSG_DATA: 'data',
+    MSG_ERROR: 'error', MSG_SUBSCRIBE: 'subscribe', MSG_CATALOG_DIFF: 'catalog_diff',
+    MSG_HASHES: 'hashes', MSG_HASH_LIST: 'hash_list', MSG_PING: 'ping', MSG_PONG: 'pong',
+    MSG_DELTA: 'delta', MSG_COPY: 'copy', MSG_DELTA_END: 'delta_end',
+}
+STATUS_NAMES = {
+    STATUS_OK: 'ok', STATUS_NOT_FOUND: 'not_found', STATUS_BAD_RANGE: 'bad_range',
+    STATUS_BAD_REQUEST: 'bad_request', STATUS_UNSUPPORTED_VERSION: 'unsupported_version',
+    STATUS_SERVER_ERROR: 'server_error',
+}
+
+# count của GET bằng giá trị này nghĩa là lấy tới hết file
+COUNT_TO_EOF = 2 ** 64 - 1
+# Giới hạn body của các frame điều khiển (JSON), không áp dụng cho DATA
+MAX_CONTROL_BODY = 16 * 1024 * 1024
+# Kích thước buffer dùng lại để nhận dữ liệu của frame DATA (mỗi lần recv_into)
+DEFAULT_READ_SIZE = 256 * 1024
+
+Frame = namedtuple('Frame', 'type status flags request_id offset count length')
+
+
+class ProtocolError(Exception):
+    """Dữ liệu nhận được không đúng giao thức"""
+
+
+class RemoteError(ProtocolError):
+    """Server trả về frame ERROR cho một request"""
+
+    def __init__(self, status, message, request_id=0):
+        super().__init__(f"[{status}] {message}")
+        self.status = status
+        self.message = message
+        self.request_id = request_id
+
+
+def pack_header(msg_type, request_id=0, offset=0, count=0, length=0,
+                status=STATUS_OK, flags=0):
+    return HEADER.pack(MAGIC, PROTOCOL_VERSION, msg_type, status, flags,
+                       request_id, offset, count, length)
+
+
+def unpack_header(data):
+    magic, version, msg_type, status, flags, request_id, offset, count, length = \
+        HEADER.unpack(data)
+    if magic != MAGIC:
+        raise ProtocolError(f"Magic không hợp lệ: {magic!r}")
+    if version != PROTOCOL_VERSION:
+        raise RemoteError(STATUS_UNSUPPORTED_VERSION,
+                          f"Không hỗ trợ phiên bản giao thức {version}", request_id)
+    return Frame(msg_type, status, flags, request_id, offset, count, length)
+
+
+def recv_exact(sock, size):
+    """Nhận đúng size byte, báo lỗi nếu kết nối đóng giữa chừng"""
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if not n:
+            raise ConnectionError(f"Kết nối bị đóng sau {received}/{size} bytes")
+        received += n
+    return bytes(buffer)
+
+
+def read_header(sock, buffer=None, options=None):
+    """Đọc header của frame tiếp theo, trả về None nếu kết nối đóng đúng ranh giới frame.
+
+    buffer (memoryview HEADER_SIZE byte) cho phép đọc vào vùng nhớ dùng lại.
+    options (SocketOptions) để bật lại TCP_QUICKACK sau khi nhận.
+    """
+    if buffer is None:
+        first = sock.recv(HEADER_SIZE)
+        if not first:
+            return None
+        if len(first) < HEADER_SIZE:
+            first += recv_exact(sock, HEADER_SIZE - len(first))
+        if options is not None:
+            options.rearm(sock)
+        return unpack_header(first)
+    received = sock.recv_into(buffer)
+    if not received:
+        return None
+    while received < HEADER_SIZE:
+        n = sock.recv_into(buffer[received:])
+        if not n:
+            raise ConnectionError(f"Kết nối bị đóng sau {received}/{HEADER_SIZE} bytes")
+        received += n
+    if options is not None:
+        options.rearm(sock)
+    return unpack_header(buffer)
+
+
+def read_body(sock, frame, limit=MAX_CONTROL_BODY):
+    if frame.length > limit:
+        raise ProtocolError(f"Body quá lớn: {frame.length} bytes")
+    return recv_exact(sock, frame.length)
+
+
+class SocketOptions:
+    """Tùy chọn socket TCP theo từng triển khai, dùng cho cả server và client.
+
+    rcvbuf/sndbuf bằng 0 giữ mặc định của hệ điều hành (tự điều chỉnh theo
+    tải); đặt cố định sẽ tắt cơ chế tự điều chỉnh đó. nodelay tắt Nagle: trên
+    kết nối dùng lại cho nhiều request, Nagle giữ frame nhỏ lại chờ ACK của
+    response trước, còn bên kia hoãn ACK, nên mỗi request mất thêm hàng chục
+    ms. quickack (chỉ Linux) gửi ACK ngay thay vì hoãn; TCP_QUICKACK không cố
+    định (kernel tự quay lại hoãn ACK) nên được bật lại bằng rearm() sau mỗi
+    lần nhận trong read_header và ServerConnection.
+    """
+
+    def __init__(self, rcvbuf=0, sndbuf=0, nodelay=True, quickack=False):
+        self.rcvbuf = rcvbuf
+        self.sndbuf = sndbuf
+        self.nodelay = nodelay
+        self.quickack = quickack
+
+    def apply(self, sock):
+        """Đặt các tùy chọn cho sock; hệ thống không hỗ trợ tùy chọn nào thì bỏ qua tùy chọn đó"""
+        options = []
+        if self.rcvbuf:
+            options.append((socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf))
+        if self.sndbuf:
+            options.append((socket.SOL_SOCKET, socket.SO_SNDBUF, self.sndbuf))
+        if self.nodelay:
+            options.append((socket.IPPROTO_TCP, socket.TCP_NODELAY, 1))
+        if self.quickack and hasattr(socket, 'TCP_QUICKACK'):
+            options.append((socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1))
+        for level, name, value in options:
+            try:
+                sock.setsockopt(level, name, value)
+            except OSError:
+                pass
+
+    def rearm(self, sock):
+        """Bật lại TCP_QUICKACK sau khi nhận dữ liệu, không làm gì nếu quickack tắt"""
+        if self.quickack and hasattr(socket, 'TCP_QUICKACK'):
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+            except OSError:
+                pass
+
+    def __repr__(self):
+        return (f"SocketOptions(rcvbuf={self.rcvbuf}, sndbuf={self.sndbuf}, "
+                f"nodelay={self.nodelay}, quickack={self.quickack})")
+
+
+DEFAULT_SOCKET_OPTIONS = SocketOptions()
+
+
+def open_connection(host, port, timeout=None, options=DEFAULT_SOCKET_OPTIONS):
+    """Kết nối TCP tới host:port, đặt tùy chọn trước khi kết nối để kích thước
+    buffer có hiệu lực cho cả window scaling"""
+    error = None
+    for family, sock_type, proto, _, address in socket.getaddrinfo(
+            host, port, 0, socket.SOCK_STREAM):
+        sock = socket.socket(family, sock_type, proto)
+        try:
+            options.apply(sock)
+            sock.settimeout(timeout)
+            sock.connect(address)
+            return sock
+        except OSError as e:
+            sock.close()
+            error = e
+    raise error or OSError(f"Không phân giải được {host}")
+
+
+def send_frame(sock, msg_type, body=b'', **fields):
+    sock.sendall(pack_header(msg_type, length=len(body), **fields) + body)
+
+
+def send_json(sock, msg_type, obj, **fields):
+    send_frame(sock, msg_type, json.dumps(obj).encode(), **fields)
+
+
+def error_body(message):
+    return json.dumps({'error': message}).encode()
+
+
+def raise_for_error(frame, body):
+    """Chuyển frame ERROR thành RemoteError"""
+    try:
+        message = json.loads(body).get('error', '')
+    except (ValueError, AttributeError):
+        message = body.decode(errors='replace')
+    raise RemoteError(frame.status, message, frame.request_id)
+
+
+async def async_recv_exact(loop, sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        n = await loop.sock_recv_into(sock, view[received:])
+        if not n:
+            raise ConnectionError(f"Kết nối bị đóng sau {received}/{size} bytes")
+        received += n
+    return bytes(buffer)
+
+
+async def async_read_header(loop, sock, options=None):
+    first = await loop.sock_recv(sock, HEADER_SIZE)
+    if not first:
+        return None
+    if len(first) < HEADER_SIZE:
+        first += await async_recv_exact(loop, sock, HEADER_SIZE - len(first))
+    if options is not None:
+        options.rearm(sock)
+    return unpack_header(first)
+
+
+class ServerConnection:
+    """Kết nối bền tới FileServer, hỗ trợ gửi nhiều GET liên tiếp trên một socket"""
+
+    def __init__(self, host, port, timeout=None, connect_timeout=None, options=None,
+                 read_size=DEFAULT_READ_SIZE):
+        """timeout áp dụng cho mọi thao tác, connect_timeout (nếu có) chỉ cho lúc kết nối.
+
+        Dữ liệu thô được nhận bằng recv_into vào một buffer read_size byte dùng lại
+        cho mọi frame, không cấp phát bytes mới cho mỗi lần recv.
+        """
+        if connect_timeout is None:
+            connect_timeout = timeout
+        self.options = options or DEFAULT_SOCKET_OPTIONS
+        self.sock = open_connection(host, port, connect_timeout, self.options)
+        self.sock.settimeout(timeout)
+        self._buffer = memoryview(bytearray(read_size))
+        self._header = memoryview(bytearray(HEADER_SIZE))
+        self._request_ids = itertools.count(1)
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _next_request_id(self):
+        return next(self._request_ids) & 0xFFFFFFFF
+
+    def request_catalog(self):
+        """Lấy catalog {"version", "files"} từ server"""
+        return self._request_catalog(MSG_LIST)
+
+    def _request_catalog(self, msg_type):
+        request_id = self._next_request_id()
+        send_frame(self.sock, msg_type, request_id=request_id)
+        frame, body = self._read_control(request_id)
+        if frame.type != MSG_CATALOG:
+            raise ProtocolError(f"Mong đợi CATALOG, nhận được frame loại {frame.type}")
+        return json.loads(body)
+
+    def subscribe_catalog(self, on_update):
+        """Theo dõi catalog cho tới khi kết nối đóng.
+
+        on_update(files, diff) được gọi với catalog đầy đủ {tên: {"size", "mtime_ns"}}
+        lúc đầu (diff là None) và sau mỗi thay đổi server đẩy về.
+        """
+        files = self._request_catalog(MSG_SUBSCRIBE)['files']
+        on_update(dict(files), None)
+        while True:
+            frame = read_header(self.sock, options=self.options)
+            if frame is None:
+                return
+            body = json.loads(read_body(self.sock, frame))
+            if frame.type == MSG_CATALOG:
+                files = body['files']
+                on_update(dict(files), None)
+            elif frame.type == MSG_CATALOG_DIFF:
+                for name in body['removed']:
+                    files.pop(name, None)
+                files.update(body['updated'])
+                on_update(dict(files), body)
+            else:
+                raise ProtocolError(f"Frame không mong đợi khi theo dõi catalog: {frame.type}")
+
+    def ping(self, timeout=None):
+        """Gửi PING và chờ PONG, báo lỗi nếu kết nối không còn dùng được"""
+        previous = self.sock.gettimeout()
+        self.sock.settimeout(timeout)
+        try:
+            request_id = self._next_request_id()
+            send_frame(self.sock, MSG_PING, request_id=request_id)
+            frame, _ = self._read_control(request_id)
+        finally:
+            self.sock.settimeout(previous)
+        if frame.type != MSG_PONG:
+            raise ProtocolError(f"Mong đợi PONG, nhận được frame loại {frame.type}")
+
+    def request_hashes(self, filename):
+        """Lấy hash từng block của file (integrity.BlockHashes)"""
+        request_id = self._next_request_id()
+        send_json(self.sock, MSG_HASHES, {'filename': filename}, request_id=request_id)
+        frame, body = self._read_control(request_id)
+        if frame.type != MSG_HASH_LIST:
+            raise ProtocolError(f"Mong đợi HASH_LIST, nhận được frame loại {frame.type}")
+        return BlockHashes.from_dict(json.loads(body))
+
+    def send_get(self, filename, offset, count, codecs=None):
+        """Gửi yêu cầu một đoạn của file mà không chờ response, trả về request_id.
+
+        codecs là danh sách codec nén mà client chấp nhận, theo thứ tự ưu tiên.
+        """
+        request_id = self._next_request_id()
+        request = {'filename': filename}
+        if codecs:
+            request['codecs'] = list(codecs)
+        body = json.dumps(request).encode()
+        send_frame(self.sock, MSG_GET, body, request_id=request_id,
+                   offset=offset, count=count)
+        return request_id
+
+    def read_response(self, request_id):
+        """Đọc header response của request_id, báo lỗi nếu server trả ERROR"""
+        frame = read_header(self.sock, self._header, self.options)
+        if frame is None:
+            raise ConnectionError("Server đã đóng kết nối")
+        if frame.type == MSG_ERROR:
+            raise_for_error(frame, read_body(self.sock, frame))
+        if frame.request_id != request_id:
+            raise ProtocolError(f"Response cho request {frame.request_id}, "
+                                f"mong đợi {request_id}")
+        return frame
+
+    def _read_control(self, request_id):
+        frame = self.read_response(request_id)
+        return frame, read_body(self.sock, frame)
+
+    def fetch_ranges(self, filename, ranges, on_data, window=8, codecs=None):
+        """Tải nhiều đoạn (offset, count) của file, pipelining tối đa `window` request.
+
+        on_data(offset, data) được gọi cho từng phần dữ liệu (đã giải nén) theo thứ tự.
+        data có thể là memoryview của buffer nhận dùng lại, chỉ hợp lệ trong lúc gọi;
+        cần giữ lại thì phải sao chép (bytes(data)).
+        """
+        pending = deque()
+        ranges = iter(ranges)
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < window:
+                item = next(ranges, None)
+                if item is None:
+                    exhausted = True
+                    break
+                offset, count = item
+                pending.append((self.send_get(filename, offset, count, codecs), offset, count))
+            if not pending:
+                break
+
+            request_id, offset, count = pending.popleft()
+            self._read_range(request_id, offset, count, on_data)
+
+    def _read_range(self, request_id, offset, count, on_data):
+        """Đọc các frame DATA liên tiếp của một đoạn; mỗi frame có thể thô hoặc đã nén"""
+        position = offset
+        end = offset + count
+        while True:
+            frame = self.read_response(request_id)
+            if (frame.type != MSG_DATA or frame.offset != position
+                    or frame.count > end - position or (count and not frame.count)):
+                raise ProtocolError(f"Response không khớp đoạn {offset}+{count}: {frame}")
+            self._read_data_frame(frame, on_data)
+            position += frame.count
+            if position == end:
+                break
+
+    def request_delta(self, filename, size, block_size, signature, on_data, on_copy,
+                      codecs=None):
+        """Tải bản mới của file dựa trên bản cũ size byte có chữ ký signature.
+
+        on_data(offset, data) nhận các byte mới như fetch_ranges, on_copy(offset,
+        source, count) yêu cầu chép count byte từ vị trí source của bản cũ; cả hai
+        được gọi theo thứ tự vị trí. Trả về {"literal", "copied"} (số byte) của server.
+        """
+        request_id = self._next_request_id()
+        request = {'filename': filename, 'size': size, 'block_size': block_size}
+        if codecs:
+            request['codecs'] = list(codecs)
+        send_frame(self.sock, MSG_DELTA, encode_request(request, signature),
+                   request_id=request_id)
+        position = 0
+        while True:
+            frame = self.read_response(request_id)
+            if frame.type == MSG_DELTA_END:
+                if frame.count != position:
+                    raise ProtocolError(f"DELTA kết thúc ở {position}, mong đợi {frame.count}")
+                return json.loads(read_body(self.sock, frame))
+            if frame.offset != position or not frame.count:
+                raise ProtocolError(f"Frame không khớp vị trí {position} của DELTA: {frame}")
+            if frame.type == MSG_COPY:
+                try:
+                    source = int(json.loads(read_body(self.sock, frame))['source'])
+                except (ValueError, KeyError, TypeError):
+                    raise ProtocolError(f"Body của frame COPY không hợp lệ: {frame}")
+                if source < 0 or source + frame.count > size:
+                    raise ProtocolError(f"COPY nằm ngoài bản cũ: {source}+{frame.count}")
+                on_copy(frame.offset, source, frame.count)
+            elif frame.type == MSG_DATA:
+                self._read_data_frame(frame, on_data)
+            else:
+                raise ProtocolError(f"Frame không mong đợi trong DELTA: {frame.type}")
+            position += frame.count
+
+    def _read_data_frame(self, frame, on_data):
+        """Đọc body của một frame DATA, thô hoặc đã nén"""
+        if frame.flags == CODEC_RAW:
+            if frame.length != frame.count:
+                raise ProtocolError(f"Frame DATA thô có độ dài sai: {frame}")
+            self._read_data(frame, on_data)
+            return
+        try:
+            data = decompress(frame.flags, read_body(self.sock, frame), frame.count)
+        except (ValueError, zlib.error, lzma.LZMAError) as e:
+            raise ProtocolError(f"Không giải nén được frame DATA: {str(e)}")
+        if len(data) != frame.count:
+            raise ProtocolError(f"Dữ liệu giải nén có độ dài sai: {frame}")
+        on_data(frame.offset, data)
+
+    def _read_data(self, frame, on_data):
+        buffer = self._buffer
+        size = len(buffer)
+        rearm = self.options.quickack
+        received = 0
+        while received < frame.length:
+            n = self.sock.recv_into(buffer, min(size, frame.length - received))
+            if not n:
+                raise ConnectionError(f"Kết nối bị đóng sau {received}/{frame.length} bytes")
+            if rearm:
+                self.options.rearm(self.sock)
+            on_data(frame.offset + received, buffer[:n])
+            received += n
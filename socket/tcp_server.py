@@ -1,9 +1,28 @@
 # server.py
+import argparse
+import selectors
 import socket
 import json
 import os
-from threading import Thread
+from threading import BoundedSemaphore, Thread
 import logging
+import time
+from catalog import Catalog, CatalogEntry
+from compression import DEFAULT_CACHE_BYTES, BlockCompressor, compress
+from delta import OP_COPY, Signature, decode_request, delta_ops
+from file_cache import DEFAULT_CACHE_ENTRIES, FileCache
+from integrity import DEFAULT_CACHE_DIR, HashIndex
+from metrics import TransferMetrics
+from netio import send_file_range
+from ratelimit import THROTTLE_CHUNK, BandwidthScheduler, parse_rate
+from tcp_protocol import (
+    COUNT_TO_EOF, DEFAULT_SOCKET_OPTIONS, MESSAGE_NAMES, MSG_CATALOG, MSG_CATALOG_DIFF, MSG_COPY,
+    MSG_DATA, MSG_DELTA, MSG_DELTA_END, MSG_ERROR, MSG_GET, MSG_HASH_LIST, MSG_HASHES, MSG_LIST,
+    MSG_PING, MSG_PONG, MSG_SUBSCRIBE,
+    STATUS_SERVER_ERROR, STATUS_BAD_RANGE, STATUS_BAD_REQUEST, STATUS_NAMES, STATUS_NOT_FOUND,
+    ProtocolError, RemoteError, SocketOptions, error_body, pack_header, read_body,
+    read_header, send_frame, send_json,
+)
 
 # Thiết lập logging
 logging.basicConfig(
@@ -11,37 +30,96 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
+# Độ dài hàng đợi accept và số kết nối được phục vụ đồng thời mặc định
+DEFAULT_BACKLOG = 128
+DEFAULT_MAX_CONNECTIONS = 1024
+# Chu kỳ kiểm tra catalog khi không có inotify, và chu kỳ kiểm tra kết nối theo dõi
+CATALOG_INTERVAL = 1.0
+
+class RequestError(Exception):
+    """Request không hợp lệ, được trả lại client dưới dạng frame ERROR"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
 class FileServer:
-    def __init__(self, host='localhost', port=5000):
+    def __init__(self, host='localhost', port=5000, backlog=DEFAULT_BACKLOG,
+                 max_connections=DEFAULT_MAX_CONNECTIONS, reuse_port=False,
+                 cache_size=DEFAULT_CACHE_ENTRIES, hash_cache_dir=DEFAULT_CACHE_DIR,
+                 compress_cache_bytes=DEFAULT_CACHE_BYTES, bandwidth=None, metrics=None,
+                 socket_options=None):
         self.host = host
         self.port = port
-        self.files_info = {}
+        self.backlog = backlog
+        self.max_connections = max_connections
+        # Cho phép nhiều tiến trình worker cùng bind một port (xem tcp_workers)
+        self.reuse_port = reuse_port
+        # Các file hay được yêu cầu được giữ mở sẵn thay vì open() mỗi request
+        self.file_cache = FileCache(cache_size)
+        # Kích thước file lấy từ os.stat, được cập nhật khi files.txt/thư mục thay đổi
+        self.catalog = Catalog('files.txt', '.', poll_interval=CATALOG_INTERVAL)
+        # Hash từng block của file, lưu trong sidecar theo mtime
+        self.hash_index = HashIndex(hash_cache_dir)
+        # Nén theo block khi client yêu cầu, cache các block đã nén của file hay dùng
+        self.compressor = BlockCompressor(compress_cache_bytes)
+        # Giới hạn băng thông gửi (BandwidthScheduler), mặc định không giới hạn
+        self.bandwidth = bandwidth or BandwidthScheduler()
+        # Số liệu kết nối/request, xuất theo cấu hình của TransferMetrics
+        self.metrics = metrics or TransferMetrics('tcp_fileserver')
+        # Kích thước buffer socket, TCP_NODELAY/TCP_QUICKACK cho các kết nối
+        self.socket_options = socket_options or DEFAULT_SOCKET_OPTIONS
+        self._register_cache_metrics()
         self.server = None
         self.load_files_info()
-        
+
+    def _register_cache_metrics(self):
+        registry = self.metrics.registry
+        prefix = self.metrics.prefix
+        registry.counter(f'{prefix}_file_cache_hits_total', "Số lần lấy file từ cache",
+                         fn=lambda: self.file_cache.hits)
+        registry.counter(f'{prefix}_file_cache_misses_total', "Số lần phải mở file",
+                         fn=lambda: self.file_cache.misses)
+        registry.counter(f'{prefix}_file_cache_evictions_total',
+                         "Số file bị loại khỏi cache vì cache đầy",
+                         fn=lambda: self.file_cache.evictions)
+        registry.counter(f'{prefix}_file_cache_invalidations_total',
+                         "Số lần mở lại file vì file đã thay đổi",
+                         fn=lambda: self.file_cache.invalidations)
+        registry.gauge(f'{prefix}_compressed_cache_bytes', "Bộ nhớ dùng cho block đã nén",
+                       fn=lambda: self.compressor.cache_bytes)
+        registry.gauge(f'{prefix}_catalog_files', "Số file trong catalog",
+                       fn=lambda: len(self.catalog.entries))
+
+    @property
+    def files_info(self):
+        """{tên file: kích thước thật} của các file đang được chia sẻ"""
+        return self.catalog.sizes()
+
     def load_files_info(self):
         """Load file information from files.txt"""
         try:
             if not os.path.exists('files.txt'):
                 logging.error("files.txt không tồn tại!")
                 self.create_sample_files_txt()
-                
-            with open('files.txt', 'r', encoding='utf-8') as f:
-                for line in f:
-                    try:
-                        filename, size = line.strip().split()
-                        if os.path.exists(filename):
-                            self.files_info[filename] = self._convert_size_to_bytes(size)
-                        else:
-                            logging.warning(f"File {filename} không tồn tại trong thư mục")
-                    except ValueError:
-                        logging.error(f"Định dạng không hợp lệ trong files.txt: {line}")
-                        
-            if not self.files_info:
+
+            self.catalog.load()
+            if not self.catalog.entries:
                 logging.warning("Không có file nào được tải lên!")
-                
+
         except Exception as e:
             logging.error(f"Lỗi khi đọc files.txt: {str(e)}")
+
+    def _watch_catalog(self):
+        """Thread nền cập nhật catalog khi files.txt hoặc các file thay đổi"""
+        while True:
+            try:
+                self.bandwidth.reload()
+                self.catalog.refresh(timeout=CATALOG_INTERVAL)
+            except Exception as e:
+                logging.error(f"Lỗi khi cập nhật catalog: {str(e)}")
+                time.sleep(CATALOG_INTERVAL)
             
     def create_sample_files_txt(self):
         """Tạo file files.txt mẫu"""
@@ -56,20 +134,13 @@ class FileServer:
     def start(self):
         """Start the server"""
         try:
-            self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.server.bind((self.host, self.port))
-            self.server.listen(5)
+            self.server = self._create_listen_socket()
             logging.info(f"Server đang chạy tại {self.host}:{self.port}")
             logging.info(f"Danh sách files có sẵn: {list(self.files_info.keys())}")
-            
-            while True:
-                client_socket, address = self.server.accept()
-                logging.info(f"Kết nối mới từ {address}")
-                client_thread = Thread(target=self.handle_client, args=(client_socket,))
-                client_thread.daemon = True
-                client_thread.start()
-                
+            Thread(target=self._watch_catalog, daemon=True).start()
+            self.metrics.start()
+            self.serve_forever()
+
         except OSError as e:
             if e.errno == 98:  # Port đã được sử dụng
                 logging.error(f"Port {self.port} đã được sử dụng")
@@ -82,7 +153,43 @@ class FileServer:
         finally:
             if self.server:
                 self.server.close()
-                
+            logging.info(f"Thống kê file cache: {self.file_cache.stats()}")
+            logging.info(f"Thống kê cache nén: {self.compressor.stats()}")
+
+    def _create_listen_socket(self):
+        """Tạo socket lắng nghe với backlog đã cấu hình"""
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        # Kết nối được accept thừa hưởng kích thước buffer của socket lắng nghe
+        self.socket_options.apply(server)
+        server.bind((self.host, self.port))
+        server.listen(self.backlog)
+        return server
+
+    def serve_forever(self):
+        """Nhận kết nối, mỗi kết nối được xử lý trên một thread riêng"""
+        slots = BoundedSemaphore(self.max_connections)
+        while True:
+            # Đủ số kết nối tối đa thì để các kết nối mới chờ trong backlog
+            slots.acquire()
+            try:
+                client_socket, address = self.server.accept()
+            except BaseException:
+                slots.release()
+                raise
+            logging.info(f"Kết nối mới từ {address}")
+            client_thread = Thread(target=self._run_client, args=(client_socket, slots))
+            client_thread.daemon = True
+            client_thread.start()
+
+    def _run_client(self, client_socket, slots):
+        try:
+            self.handle_client(client_socket)
+        finally:
+            slots.release()
+
     def stop(self):
         """Stop the server gracefully"""
         if self.server:
@@ -90,76 +197,352 @@ class FileServer:
             logging.info("Server đã dừng")
 
     def handle_client(self, client_socket):
-        """Xử lý kết nối từ client"""
+        """Xử lý kết nối từ client theo giao thức frame trong tcp_protocol"""
+        accepted = time.monotonic()
+        self.socket_options.apply(client_socket)
+        self.metrics.connection_opened()
+        throttle = self._open_throttle(client_socket)
         try:
-            # Gửi danh sách files cho client
-            files_data = json.dumps(self.files_info)
-            client_socket.send(files_data.encode())
-
-            # Nhận request download từ client
             while True:
-                request_data = client_socket.recv(4096).decode()
-                if not request_data:
+                try:
+                    frame = read_header(client_socket, options=self.socket_options)
+                except RemoteError as e:
+                    # Sai phiên bản giao thức: báo lỗi rồi đóng kết nối
+                    send_frame(client_socket, MSG_ERROR, error_body(e.message),
+                               request_id=e.request_id, status=e.status)
                     break
-                
-                request = json.loads(request_data)
-                filename = request.get('filename')
-                start = request.get('start', 0)
-                end = request.get('end')
-
-                if filename not in self.files_info:
-                    logging.error(f"File {filename} không tồn tại")
-                    continue
+                if frame is None:
+                    break
+                body = read_body(client_socket, frame)
 
-                # Đọc và gửi phần được yêu cầu của file
+                trace = self.metrics.request(MESSAGE_NAMES.get(frame.type, 'unknown'), accepted)
                 try:
-                    with open(filename, 'rb') as f:
-                        f.seek(start)
-                        # Nếu end không được chỉ định, gửi toàn bộ file
-                        if end is None:
-                            data = f.read()
-                        else:
-                            data = f.read(end - start)
-                        client_socket.sendall(data)
-                    logging.info(f"Đã gửi {filename} từ byte {start} đến {end}")
-                except FileNotFoundError:
-                    logging.error(f"Không tìm thấy file {filename}")
-                except Exception as e:
-                    logging.error(f"Lỗi khi đọc file {filename}: {str(e)}")
-
-        except json.JSONDecodeError:
-            logging.error("Lỗi decode JSON từ client")
+                    self.handle_request(client_socket, frame, body, throttle, trace)
+                except RequestError as e:
+                    trace.finish(STATUS_NAMES.get(e.status, str(e.status)))
+                    logging.error(e.message)
+                    send_frame(client_socket, MSG_ERROR, error_body(e.message),
+                               request_id=frame.request_id, status=e.status)
+                except BaseException:
+                    trace.finish('aborted')
+                    raise
+                else:
+                    trace.finish()
+
+        except ProtocolError as e:
+            logging.error(f"Lỗi giao thức từ client: {str(e)}")
         except Exception as e:
             logging.error(f"Lỗi không mong đợi: {str(e)}")
         finally:
+            throttle.close()
+            self.metrics.connection_closed()
             client_socket.close()
 
-    def _convert_size_to_bytes(self, size_str):
-        """Chuyển đổi kích thước từ dạng chuỗi (VD: '1MB') sang bytes"""
-        units = {
-            'B': 1,
-            'KB': 1024,
-            'MB': 1024 * 1024,
-            'GB': 1024 * 1024 * 1024,
-            'TB': 1024 * 1024 * 1024 * 1024
-        }
-        
-        # Tách số và đơn vị
-        size = size_str.strip()
-        if not any(unit in size for unit in units):
-            return int(size)
-        
-        number = float(''.join(filter(lambda x: x.isdigit() or x == '.', size)))
-        unit = ''.join(filter(lambda x: x.isalpha(), size)).upper()
-        
-        if unit not in units:
-            raise ValueError(f"Đơn vị không hợp lệ: {unit}")
-        
-        return int(number * units[unit])
+    def _open_throttle(self, client_socket):
+        try:
+            address = client_socket.getpeername()[0]
+        except (OSError, IndexError):
+            address = None
+        return self.bandwidth.connection(address)
+
+    def handle_request(self, client_socket, frame, body, throttle, trace):
+        """Xử lý một request đã đọc xong header và body"""
+        if frame.type == MSG_LIST:
+            # Gửi danh sách files cho client
+            send_json(client_socket, MSG_CATALOG, self.catalog.snapshot(),
+                      request_id=frame.request_id)
+
+        elif frame.type == MSG_SUBSCRIBE:
+            self._stream_catalog(client_socket, frame)
+
+        elif frame.type == MSG_HASHES:
+            filename, _ = self._requested_file(body)
+            hashes = self._block_hashes(filename)
+            send_json(client_socket, MSG_HASH_LIST, hashes.to_dict(),
+                      request_id=frame.request_id)
+
+        elif frame.type == MSG_PING:
+            send_frame(client_socket, MSG_PONG, request_id=frame.request_id)
+
+        elif frame.type == MSG_GET:
+            filename, request, entry, offset, count = self._open_range(frame, body)
+            try:
+                with throttle.transfer():
+                    self._send_get(client_socket, frame, filename, request, entry,
+                                   offset, count, throttle, trace)
+            finally:
+                self.file_cache.release(entry)
+            trace.filename, trace.nbytes = filename, count
+            logging.info(f"Đã gửi {filename} từ byte {offset} đến {offset + count}")
+
+        elif frame.type == MSG_DELTA:
+            filename, request, signature = self._delta_request(body)
+            entry = self._acquire_file(filename)
+            try:
+                with throttle.transfer():
+                    literal = self._send_delta(client_socket, frame, filename, request, entry,
+                                               signature, throttle, trace)
+            finally:
+                self.file_cache.release(entry)
+            trace.filename, trace.nbytes = filename, literal
+            logging.info(f"Đã gửi delta của {filename}: {literal}/{entry.size} bytes mới")
+
+        else:
+            raise RequestError(STATUS_BAD_REQUEST, f"Loại frame không hỗ trợ: {frame.type}")
+
+    def _send_get(self, client_socket, frame, filename, request, entry, offset, count,
+                  throttle, trace):
+        """Gửi đoạn file; trace ghi byte đầu tiên khi header DATA đầu tiên đã được
+        gửi, tức là sau cả thời gian chờ giới hạn băng thông"""
+        codec_id = self._choose_codec(filename, request, entry, count)
+        if codec_id is None:
+            self._send_raw(client_socket, frame.request_id, entry, offset, count, throttle,
+                           trace)
+            return
+        # Mỗi block được gửi trong một frame DATA riêng, nén hoặc thô
+        for piece_offset, piece_count in self.compressor.pieces(offset, count):
+            piece_codec, payload = self.compressor.compress_piece(
+                filename, entry, codec_id, piece_offset, piece_count)
+            if payload is None:
+                self._send_raw(client_socket, frame.request_id, entry,
+                               piece_offset, piece_count, throttle, trace)
+                continue
+            if throttle.limited:
+                time.sleep(throttle.reserve(len(payload)))
+            client_socket.sendall(pack_header(
+                MSG_DATA, request_id=frame.request_id, flags=piece_codec,
+                offset=piece_offset, count=piece_count, length=len(payload)) + payload)
+            trace.first_byte()
+
+    def _send_raw(self, client_socket, request_id, entry, offset, count, throttle, trace):
+        # Header DATA cho client biết chính xác đoạn sắp nhận
+        client_socket.sendall(pack_header(MSG_DATA, request_id=request_id,
+                                          offset=offset, count=count, length=count))
+        trace.first_byte()
+        if throttle.limited:
+            sent = 0
+            while sent < count:
+                # Gửi từng phần nhỏ, chờ theo thời gian scheduler trả về
+                n = min(THROTTLE_CHUNK, count - sent)
+                time.sleep(throttle.reserve(n))
+                chunk = send_file_range(client_socket, entry, offset + sent, n)
+                sent += chunk
+                if chunk != n:
+                    break
+        else:
+            sent = send_file_range(client_socket, entry, offset, count)
+        if sent != count:
+            # Header đã hứa count byte, không thể tiếp tục trên kết nối này
+            raise ConnectionError(f"File {entry.path} bị thay đổi khi đang gửi")
+
+    def _send_delta(self, client_socket, frame, filename, request, entry, signature, throttle,
+                    trace):
+        """Gửi các thao tác dựng lại file từ bản cũ của client, trả về số byte mới đã gửi.
+        Byte đầu tiên được ghi khi frame COPY hoặc DATA đầu tiên đã được gửi"""
+        codec_id = self._choose_codec(filename, request, entry, entry.size)
+        stats = {'literal': 0, 'copied': 0}
+        for op, offset, count, source in delta_ops(entry.view(0, entry.size), signature):
+            if op == OP_COPY:
+                send_json(client_socket, MSG_COPY, {'source': source},
+                          request_id=frame.request_id, offset=offset, count=count)
+                trace.first_byte()
+                stats['copied'] += count
+            else:
+                self._send_literal(client_socket, frame.request_id, entry, codec_id,
+                                   offset, count, throttle, trace)
+                stats['literal'] += count
+        send_json(client_socket, MSG_DELTA_END, stats, request_id=frame.request_id,
+                  count=entry.size)
+        trace.first_byte()
+        return stats['literal']
+
+    def _send_literal(self, client_socket, request_id, entry, codec_id, offset, count,
+                      throttle, trace):
+        """Gửi một đoạn dữ liệu mới của DELTA, nén nếu được và có lợi"""
+        payload = None
+        if codec_id is not None:
+            payload = compress(codec_id, entry.view(offset, count))
+        if payload is None or len(payload) >= count:
+            self._send_raw(client_socket, request_id, entry, offset, count, throttle, trace)
+            return
+        if throttle.limited:
+            time.sleep(throttle.reserve(len(payload)))
+        client_socket.sendall(pack_header(
+            MSG_DATA, request_id=request_id, flags=codec_id,
+            offset=offset, count=count, length=len(payload)) + payload)
+        trace.first_byte()
+
+    def _choose_codec(self, filename, request, entry, count):
+        """Codec dùng cho response, None nếu gửi thô"""
+        if not count:
+            return None
+        return self.compressor.choose_codec(filename, entry, request.get('codecs'))
+
+    def _stream_catalog(self, client_socket, frame):
+        """Gửi catalog rồi đẩy các thay đổi cho tới khi client đóng kết nối"""
+        snapshot = self.catalog.snapshot()
+        send_json(client_socket, MSG_CATALOG, snapshot, request_id=frame.request_id)
+        version = snapshot['version']
+        # Dùng selectors thay vì select.select, vốn lỗi khi fd vượt FD_SETSIZE (1024)
+        with selectors.DefaultSelector() as selector:
+            selector.register(client_socket, selectors.EVENT_READ)
+            while True:
+                # Kết nối theo dõi chỉ nhận, dữ liệu đến nghĩa là client đã đóng
+                if selector.select(0):
+                    break
+                if self.catalog.wait_for_change(version, timeout=CATALOG_INTERVAL) != version:
+                    msg_type, payload = self._catalog_update(version)
+                    send_json(client_socket, msg_type, payload)
+                    version = payload['version']
+
+    def _catalog_update(self, version):
+        """Diff kể từ version, hoặc toàn bộ catalog nếu diff không còn trong lịch sử"""
+        diff = self.catalog.changes_since(version)
+        if diff is None:
+            return MSG_CATALOG, self.catalog.snapshot()
+        return MSG_CATALOG_DIFF, diff
+
+    def _requested_file(self, body):
+        """Đọc body JSON của request, trả về (filename, request) nếu file có trong catalog"""
+        try:
+            request = json.loads(body)
+            filename = request.get('filename')
+        except (ValueError, AttributeError):
+            raise RequestError(STATUS_BAD_REQUEST, "Body của request không hợp lệ")
+
+        if self.catalog.get(filename) is None:
+            raise RequestError(STATUS_NOT_FOUND, f"File {filename} không tồn tại")
+        return filename, request
+
+    def _delta_request(self, body):
+        """Đọc body của request DELTA, trả về (filename, request, delta.Signature)"""
+        try:
+            request, data = decode_request(body)
+            signature = Signature(request.get('block_size'), request.get('size'), data)
+        except ValueError as e:
+            raise RequestError(STATUS_BAD_REQUEST, f"Request DELTA không hợp lệ: {e}")
+        filename = request.get('filename')
+        if self.catalog.get(filename) is None:
+            raise RequestError(STATUS_NOT_FOUND, f"File {filename} không tồn tại")
+        return filename, request, signature
+
+    def _block_hashes(self, filename):
+        """Cây hash của nội dung hiện tại của file (có thể mới hơn catalog)"""
+        try:
+            st = os.stat(filename)
+            return self.hash_index.get(filename, CatalogEntry(st.st_size, st.st_mtime_ns))
+        except FileNotFoundError:
+            raise RequestError(STATUS_NOT_FOUND, f"Không tìm thấy file {filename}")
+        except (OSError, ValueError) as e:
+            raise RequestError(STATUS_SERVER_ERROR, f"Không tính được hash của {filename}: {e}")
+
+    def _open_range(self, frame, body):
+        """Kiểm tra request GET, lấy file từ cache.
+
+        Trả về (filename, request, entry, offset, count).
+
+        Người gọi phải trả entry lại bằng self.file_cache.release.
+        """
+        filename, request = self._requested_file(body)
+        entry = self._acquire_file(filename)
+
+        file_size = entry.size
+        offset = frame.offset
+        # Nếu count là COUNT_TO_EOF, gửi tới hết file
+        count = file_size - offset if frame.count == COUNT_TO_EOF else frame.count
+        if offset > file_size or count < 0 or offset + count > file_size:
+            self.file_cache.release(entry)
+            raise RequestError(STATUS_BAD_RANGE,
+                               f"Đoạn {offset}+{frame.count} vượt quá kích thước "
+                               f"{file_size} của {filename}")
+        return filename, request, entry, offset, count
+
+    def _acquire_file(self, filename):
+        """Lấy file từ cache; người gọi phải trả lại bằng self.file_cache.release"""
+        try:
+            return self.file_cache.acquire(filename)
+        except OSError:
+            raise RequestError(STATUS_NOT_FOUND, f"Không tìm thấy file {filename}")
+
+def main():
+    parser = argparse.ArgumentParser(description="TCP file server")
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--mode', choices=('thread', 'async'), default='thread',
+                        help="thread: một thread mỗi kết nối; async: event loop asyncio")
+    parser.add_argument('--backlog', type=int, default=DEFAULT_BACKLOG)
+    parser.add_argument('--max-connections', type=int, default=DEFAULT_MAX_CONNECTIONS)
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_ENTRIES,
+                        help="Số file được giữ mở trong cache (0 = tắt cache)")
+    parser.add_argument('--hash-cache-dir', default=DEFAULT_CACHE_DIR,
+                        help="Thư mục lưu hash theo block của các file")
+    parser.add_argument('--compress-cache-mb', type=int,
+                        default=DEFAULT_CACHE_BYTES // (1024 * 1024),
+                        help="Bộ nhớ tối đa cho cache các block đã nén")
+    parser.add_argument('--rate-limit', type=parse_rate, default=0,
+                        help="Giới hạn băng thông gửi của server, ví dụ 50M (byte/giây)")
+    parser.add_argument('--client-rate-limit', type=parse_rate, default=0,
+                        help="Giới hạn băng thông cho mỗi địa chỉ IP client; với --workers N "
+                             "mỗi worker giới hạn client ở 1/N, nên client có kết nối dồn "
+                             "vào ít worker nhận ít hơn giới hạn")
+    parser.add_argument('--connection-rate-limit', type=parse_rate, default=0,
+                        help="Giới hạn băng thông cho mỗi kết nối")
+    parser.add_argument('--limits-file',
+                        help="File JSON chứa các giới hạn, được đọc lại khi thay đổi")
+    parser.add_argument('--metrics-port', type=int,
+                        help="Cổng HTTP xuất metrics Prometheus tại /metrics")
+    parser.add_argument('--metrics-file',
+                        help="File ghi metrics Prometheus định kỳ")
+    parser.add_argument('--event-log',
+                        help="File log sự kiện JSON, mỗi request một dòng")
+    parser.add_argument('--rcvbuf', type=parse_rate, default=0,
+                        help="SO_RCVBUF của các kết nối, ví dụ 4M (0 = mặc định hệ thống)")
+    parser.add_argument('--sndbuf', type=parse_rate, default=0,
+                        help="SO_SNDBUF của các kết nối, ví dụ 4M (0 = mặc định hệ thống)")
+    parser.add_argument('--no-nodelay', action='store_true', help="Không bật TCP_NODELAY")
+    parser.add_argument('--quickack', action='store_true',
+                        help="Bật TCP_QUICKACK (Linux), đặt lại sau mỗi request nhận được")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Số tiến trình worker dùng chung port (0 = số CPU); giới hạn "
+                             "toàn cục và theo client được chia đều cho các worker")
+    parser.add_argument('--log-level', default='INFO',
+                        choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'))
+    args = parser.parse_args()
+    logging.getLogger().setLevel(args.log_level)
+
+    if args.mode == 'async':
+        from tcp_async_server import AsyncFileServer
+        server_class = AsyncFileServer
+    else:
+        server_class = FileServer
+
+    workers = args.workers or os.cpu_count() or 1
+    # Mỗi worker có scheduler riêng, chỉ dùng phần của mình trong giới hạn
+    # toàn cục và theo client để tổng các worker không vượt giới hạn
+    bandwidth = BandwidthScheduler(args.rate_limit, args.client_rate_limit,
+                                   args.connection_rate_limit, limits_file=args.limits_file,
+                                   worker_share=1.0 / workers)
+    server = server_class(args.host, args.port, backlog=args.backlog,
+                          max_connections=args.max_connections,
+                          reuse_port=workers > 1, cache_size=args.cache_size,
+                          hash_cache_dir=args.hash_cache_dir,
+                          compress_cache_bytes=args.compress_cache_mb * 1024 * 1024,
+                          bandwidth=bandwidth,
+                          metrics=TransferMetrics('tcp_fileserver', port=args.metrics_port,
+                                                  path=args.metrics_file,
+                                                  event_log=args.event_log),
+                          socket_options=SocketOptions(args.rcvbuf, args.sndbuf,
+                                                       nodelay=not args.no_nodelay,
+                                                       quickack=args.quickack))
+    if workers > 1:
+        from tcp_workers import WorkerPool
+        WorkerPool(server, workers).run()
+        return
 
-if __name__ == "__main__":
-    server = FileServer()
     try:
         server.start()
     except KeyboardInterrupt:
-        server.stop()
\ No newline at end of file
+        server.stop()
+
+if __name__ == "__main__":
+    main()
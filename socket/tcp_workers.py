@@ -0,0 +1,117 @@
+# tcp_workers.py
+import logging
+import os
+import signal
+import socket
+import time
+
+# Worker chết trong khoảng này sau khi khởi động được coi là crash liên tục
+CRASH_WINDOW = 5.0
+MAX_RESTART_DELAY = 30.0
+
+
+class WorkerPool:
+    """Chạy nhiều tiến trình FileServer cùng lắng nghe một port bằng SO_REUSEPORT.
+
+    Catalog được nạp một lần bởi load_files_info trong tiến trình cha trước
+    khi fork, nên các worker dùng chung nó (copy-on-write). Tiến trình cha
+    chỉ giám sát và khởi động lại worker bị chết.
+    """
+
+    def __init__(self, server, workers):
+        if not hasattr(os, 'fork') or not hasattr(socket, 'SO_REUSEPORT'):
+            raise RuntimeError("Chế độ nhiều worker cần os.fork và SO_REUSEPORT")
+        self.server = server
+        self.workers = workers
+        self.children = {}  # pid -> (slot, thời điểm khởi động)
+        self.restart_delay = {}  # slot -> thời gian chờ trước khi khởi động lại
+        self._stopping = False
+
+    def run(self):
+        """Khởi động các worker và giám sát cho tới khi nhận tín hiệu dừng"""
+        try:
+            # Kiểm tra trước port có bind được không để tránh vòng lặp restart vô ích
+            self.server._create_listen_socket().close()
+        except OSError as e:
+            logging.error(f"Không thể lắng nghe tại {self.server.host}:{self.server.port}: {e}")
+            return
+
+        signal.signal(signal.SIGTERM, self._handle_stop_signal)
+        logging.info(f"Khởi động {self.workers} worker tại "
+                     f"{self.server.host}:{self.server.port}")
+        try:
+            for slot in range(self.workers):
+                self._spawn(slot)
+            self._supervise()
+        except KeyboardInterrupt:
+            logging.info("Đang tắt các worker...")
+        finally:
+            self._stopping = True
+            self._stop_children()
+
+    def _handle_stop_signal(self, signum, frame):
+        raise KeyboardInterrupt
+
+    def _spawn(self, slot):
+        pid = os.fork()
+        if pid == 0:
+            # Tiến trình con: chạy server rồi thoát, không quay lại vòng giám sát
+            code = 0
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                # Mỗi worker xuất metrics riêng, có nhãn worker
+                self.server.metrics.set_worker(slot)
+                self.server.start()
+            except BaseException:
+                logging.exception(f"Worker {slot} gặp lỗi")
+                code = 1
+            finally:
+                os._exit(code)
+        self.children[pid] = (slot, time.monotonic())
+        logging.info(f"Worker {slot} chạy với pid {pid}")
+
+    def _supervise(self):
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            if pid not in self.children:
+                continue
+            slot, started = self.children.pop(pid)
+            if self._stopping:
+                continue
+
+            logging.warning(f"Worker {slot} (pid {pid}) đã dừng với trạng thái {status}, "
+                            f"khởi động lại")
+            # Tăng dần thời gian chờ nếu worker chết ngay sau khi khởi động
+            if time.monotonic() - started < CRASH_WINDOW:
+                delay = min(MAX_RESTART_DELAY, self.restart_delay.get(slot, 0.5) * 2)
+            else:
+                delay = 0.5
+            self.restart_delay[slot] = delay
+            time.sleep(delay)
+            self._spawn(slot)
+
+    def _stop_children(self):
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + 5
+        while self.children and time.monotonic() < deadline:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid:
+                self.children.pop(pid, None)
+            else:
+                time.sleep(0.05)
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        self.children.clear()
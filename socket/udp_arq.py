@@ -0,0 +1,242 @@
+# udp_arq.py
+# Selective-repeat ARQ for the UDP file transfer. The server keeps a sliding
+# window of chunks in flight with a retransmission timer per chunk; the client
+# reports what it has received with compact SACK bitmaps, so only the chunks
+# that were actually lost are sent again. How many chunks are in flight is
+# decided by a congestion controller from udp_congestion.
+import heapq
+import struct
+from collections import deque
+
+from udp_congestion import AimdController, RttEstimator
+
+# Chunks the sender may send beyond the first unacknowledged one; this is also
+# the largest congestion window and the length of the SACK bitmap
+WINDOW_SIZE = 512
+# A missing chunk is resent early once a chunk sent this many transmissions
+# after it has been acknowledged (it was lost rather than reordered)
+REORDER_THRESHOLD = 3
+
+# SACK packet: prefix, first missing chunk, number of bits, then one bit per
+# chunk starting at that base (least significant bit first)
+SACK_PREFIX = b'SACK|'
+SACK_HEADER = struct.Struct('!II')
+
+
+class ChunkBitmap:
+    """One bit per chunk of a file"""
+
+    def __init__(self, total):
+        self.total = total
+        self.bits = bytearray((total + 7) // 8)
+        self.count = 0
+
+    def __contains__(self, chunk):
+        return bool(self.bits[chunk >> 3] & (1 << (chunk & 7)))
+
+    def add(self, chunk):
+        """Mark a chunk, returns False if it was already marked"""
+        mask = 1 << (chunk & 7)
+        if self.bits[chunk >> 3] & mask:
+            return False
+        self.bits[chunk >> 3] |= mask
+        self.count += 1
+        return True
+
+    def first_missing(self, start=0):
+        """First unmarked chunk at or after start, total if there is none"""
+        chunk = start
+        while chunk < self.total:
+            if not chunk & 7 and self.bits[chunk >> 3] == 0xFF:
+                chunk += 8
+            elif chunk in self:
+                chunk += 1
+            else:
+                return chunk
+        return self.total
+
+
+def encode_sack(received, base, window=WINDOW_SIZE):
+    """SACK for a receiver whose first missing chunk is base"""
+    count = max(0, min(window, received.total - base))
+    # Bit i of the little-endian integer is chunk base + i
+    value = int.from_bytes(received.bits[base >> 3:((base + count) >> 3) + 1], 'little')
+    value = (value >> (base & 7)) & ((1 << count) - 1)
+    bits = value.to_bytes((count + 7) // 8, 'little')
+    return SACK_PREFIX + SACK_HEADER.pack(base, count) + bits
+
+
+def decode_sack(packet):
+    """Returns (base, chunks acknowledged beyond base); raises ValueError if malformed"""
+    header = packet[len(SACK_PREFIX):len(SACK_PREFIX) + SACK_HEADER.size]
+    if not packet.startswith(SACK_PREFIX) or len(header) != SACK_HEADER.size:
+        raise ValueError("Malformed SACK")
+    base, count = SACK_HEADER.unpack(header)
+    bits = packet[len(SACK_PREFIX) + SACK_HEADER.size:]
+    if len(bits) != (count + 7) // 8:
+        raise ValueError("Malformed SACK bitmap")
+    acked = [base + i for i in range(count) if bits[i >> 3] & (1 << (i & 7))]
+    return base, acked
+
+
+class SendWindow:
+    """Sender side of the ARQ: decides which chunk goes out next.
+
+    Retransmissions (timed out, or reported missing by a later SACK) go
+    before new chunks. Nothing is sent while the chunks in flight fill the
+    controller's congestion window, and new chunks must be within `window`
+    chunks of the first unacknowledged one.
+    """
+
+    def __init__(self, total, window=WINDOW_SIZE, controller=None):
+        self.total = total
+        self.window = window
+        self.controller = controller or AimdController(window)
+        self.rtt = RttEstimator()
+        self.acked = ChunkBitmap(total)
+        # First unacknowledged chunk and next chunk never sent
+        self.base = 0
+        self.next_chunk = 0
+        self.retransmissions = 0
+        # Raised while the receiver can rebuild lost chunks from parity (fec),
+        # so a chunk is not resent before its group's parity had a chance
+        self.reorder_threshold = REORDER_THRESHOLD
+        # Unacknowledged chunk -> (transmission number, time) of its last send
+        self._sent = {}
+        # Chunks sent more than once give no RTT sample (Karn's algorithm)
+        self._retransmitted = set()
+        # (deadline, transmission number, chunk); stale entries are skipped
+        self._timers = []
+        self._resend = deque()
+        self._queued = set()
+        self._transmissions = 0
+        self._newest_acked = 0
+        # Losses of chunks sent before this transmission belong to a window
+        # that was already reduced
+        self._recovery_point = 0
+
+    @property
+    def done(self):
+        return self.base >= self.total
+
+    @property
+    def in_flight(self):
+        """Chunks sent and neither acknowledged nor presumed lost"""
+        return len(self._sent) - len(self._resend)
+
+    def next_to_send(self, now):
+        """Chunk to transmit next, or None until a SACK or a timer frees one"""
+        self._expire(now)
+        if self.in_flight >= self.controller.cwnd:
+            return None
+        while self._resend:
+            chunk = self._resend.popleft()
+            self._queued.discard(chunk)
+            if chunk not in self.acked:
+                return chunk
+        # A resuming receiver acknowledges chunks it kept before they are sent
+        limit = min(self.total, self.base + self.window)
+        while self.next_chunk < limit and self.next_chunk in self.acked:
+            self.next_chunk += 1
+        if self.next_chunk < limit:
+            self.next_chunk += 1
+            return self.next_chunk - 1
+        return None
+
+    def on_sent(self, chunk, now):
+        """Start the timer of a chunk just sent, returns True if it was a retransmission"""
+        self._transmissions += 1
+        retransmission = chunk in self._sent
+        if retransmission:
+            self.retransmissions += 1
+            self._retransmitted.add(chunk)
+        self._sent[chunk] = (self._transmissions, now)
+        heapq.heappush(self._timers, (now + self.rtt.rto, self._transmissions, chunk))
+        return retransmission
+
+    def on_send_failed(self, chunk):
+        """Give back a chunk from next_to_send that could not be sent, it goes out first next time"""
+        if chunk not in self._sent and chunk == self.next_chunk - 1:
+            self.next_chunk = chunk
+        elif chunk not in self._queued:
+            self._queued.add(chunk)
+            self._resend.appendleft(chunk)
+
+    def next_deadline(self):
+        """Time the earliest pending retransmission timer fires, None if there is none"""
+        while self._timers:
+            _, transmission, chunk = self._timers[0]
+            if self._sent.get(chunk, (None,))[0] == transmission:
+                return self._timers[0][0]
+            heapq.heappop(self._timers)
+        return None
+
+    def on_sack(self, base, acked, now):
+        changed = False
+        # Acknowledged chunks that were in flight; those never sent (a
+        # resuming receiver already had them) do not grow the window
+        newly_acked = 0
+        # Send time of the most recently sent chunk this SACK acknowledges;
+        # earlier chunks may have waited for the client's delayed SACK
+        newest = None
+        for chunk in list(range(self.base, min(base, self.total))) + acked:
+            if chunk >= self.total or not self.acked.add(chunk):
+                continue
+            changed = True
+            sent = self._sent.pop(chunk, None)
+            if sent is None:
+                continue
+            newly_acked += 1
+            if chunk in self._queued:
+                # Arrived after all, no longer waiting to be resent
+                self._queued.discard(chunk)
+                self._resend.remove(chunk)
+            if chunk in self._retransmitted:
+                self._retransmitted.discard(chunk)
+            elif newest is None or sent[0] > newest[0]:
+                newest = sent
+            self._newest_acked = max(self._newest_acked, sent[0])
+        if not changed:
+            return
+        if newly_acked:
+            rtt = None
+            if newest is not None:
+                rtt = now - newest[1]
+                self.rtt.sample(rtt)
+            self.controller.on_ack(newly_acked, rtt, self.rtt)
+        self.base = self.acked.first_missing(self.base)
+        self.next_chunk = max(self.next_chunk, self.base)
+
+        # Chunks sent well before one that already arrived were lost
+        lost = False
+        for chunk, (transmission, _) in self._sent.items():
+            if transmission + self.reorder_threshold < self._newest_acked and chunk not in self._queued:
+                self._queue_resend(chunk)
+                lost = lost or transmission > self._recovery_point
+        if lost:
+            self.controller.on_loss()
+            self._recovery_point = self._transmissions
+
+    def on_repaired_loss(self):
+        """The receiver rebuilt lost chunks itself; still a congestion signal,
+        reduced at most once per recovery point like other losses"""
+        if self._newest_acked > self._recovery_point:
+            self.controller.on_loss()
+            self._recovery_point = self._transmissions
+
+    def _expire(self, now):
+        timed_out = False
+        while self._timers and self._timers[0][0] <= now:
+            _, transmission, chunk = heapq.heappop(self._timers)
+            if self._sent.get(chunk, (None,))[0] == transmission:
+                self._queue_resend(chunk)
+                timed_out = timed_out or transmission > self._recovery_point
+        if timed_out:
+            self.rtt.backoff()
+            self.controller.on_timeout()
+            self._recovery_point = self._transmissions
+
+    def _queue_resend(self, chunk):
+        if chunk not in self._queued:
+            self._queued.add(chunk)
+            self._resend.append(chunk)
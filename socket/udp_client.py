@@ -1,15 +1,41 @@
+import argparse
 import socket
 import os
 import hashlib
+import struct
 import threading
 import time
 import sys
 
+import fec
+from output_file import OutputFile
+from udp_arq import WINDOW_SIZE, ChunkBitmap, encode_sack
+from udp_protocol import new_session_id, pack_packet, unpack_packet
+
 BUFFER_SIZE = 1024
 CHUNK_SIZE = 1024 * 32
 SERVER_PORT = 1234
 SERVER_IP = '192.168.1.18'
-MAX_THREADS = 5
+# Acknowledge after this many new chunks, or after SACK_INTERVAL at the latest
+ACK_EVERY = 2
+SACK_INTERVAL = 0.002
+# Give up when no chunk has arrived for this long
+TRANSFER_TIMEOUT = 10.0
+# The last SACK is repeated since the server stops only once it gets one
+FINAL_SACKS = 3
+# Socket receive buffer, room for bursts while chunks are being verified
+RECEIVE_BUFFER = 4 * 1024 * 1024
+# DOWNLOAD is sent again if FILE_INFO has not arrived after this long
+DOWNLOAD_RETRY = 1.0
+DOWNLOAD_ATTEMPTS = 5
+DOWNLOADS_DIR = "downloads"
+# Chunks already written to a partial download, kept beside it in <file>.chunks:
+# magic, chunk size, total chunks, size of the last chunk (0 until it arrived),
+# size and mtime of the server's file, then one bit per chunk
+JOURNAL_SUFFIX = '.chunks'
+JOURNAL_MAGIC = b'UDPV'
+JOURNAL_HEADER = struct.Struct('!4sIIIQQ')
+JOURNAL_INTERVAL = 1.0
 
 
 class ProgressBar:
@@ -42,17 +68,86 @@ class ProgressBar:
             sys.stdout.write('\n')
 
 
+class ChunkJournal:
+    """Chunks of a partial download that are on disk, saved so a restarted client resumes"""
+
+    def __init__(self, path, total_chunks, version=(0, 0)):
+        self.path = path + JOURNAL_SUFFIX
+        self.received = ChunkBitmap(total_chunks)
+        # (size, mtime_ns) of the file on the server, from FILE_INFO
+        self.version = version
+        self.last_size = 0
+        self._saved_count = 0
+        self._saved = 0.0
+
+    def load(self):
+        """Take over the chunks of an earlier attempt at the same version of the file,
+        returns True if there were any. A journal of another version is removed"""
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+            magic, chunk_size, total, last_size, size, mtime_ns = JOURNAL_HEADER.unpack_from(data)
+        except (OSError, struct.error):
+            return False
+        received = ChunkBitmap(self.received.total)
+        bits = data[JOURNAL_HEADER.size:]
+        if (magic != JOURNAL_MAGIC or chunk_size != CHUNK_SIZE or total != received.total
+                or len(bits) != len(received.bits) or (size, mtime_ns) != self.version):
+            # The file changed on the server; its old chunks must not be mixed in
+            self.remove()
+            return False
+        received.bits[:] = bits
+        received.count = bin(int.from_bytes(bits, 'little')).count('1')
+        if total and total - 1 in received and not 0 < last_size <= CHUNK_SIZE:
+            return False
+        self.received, self.last_size = received, last_size
+        self._saved_count = received.count
+        return received.count > 0
+
+    def save(self, output, force=False):
+        """Write the bitmap if chunks were added; their data is synced to disk first"""
+        now = time.monotonic()
+        if self.received.count == self._saved_count or (not force and now - self._saved < JOURNAL_INTERVAL):
+            return
+        self._saved = now
+        self._saved_count = self.received.count
+        output.sync()
+        header = JOURNAL_HEADER.pack(JOURNAL_MAGIC, CHUNK_SIZE, self.received.total, self.last_size,
+                                     *self.version)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(header + self.received.bits)
+        os.replace(tmp, self.path)
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
 class FileClient:
-    def __init__(self):
+    def __init__(self, server_ip=SERVER_IP, server_port=SERVER_PORT, use_fec=False):
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock.settimeout(5.0)  # Set socket timeout
-        self.server_addr = (SERVER_IP, SERVER_PORT)
-        self.received_chunks = {}
-        self.missing_chunks = set()
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER)
+        except OSError:
+            pass
+        self.server_addr = (server_ip, server_port)
+        # Every download runs in a new session so packets of an earlier one are ignored
+        self.session_id = new_session_id()
+        # Chunks are written straight into the output file at their offset;
+        # only the journal's bitmap of the chunks received stays in memory
+        self.output = None
+        self.journal = None
+        self.received = ChunkBitmap(0)
+        # Ask for parity chunks; fec_decoder is set when the server agreed
+        self.use_fec = use_fec
+        self.fec_decoder = None
         self.current_file = None
         self.total_chunks = 0
         self.progress_bar = None
-        self.lock = threading.Lock()
 
     def calculate_checksum(self, data):
         return hashlib.md5(data).hexdigest()
@@ -65,127 +160,241 @@ class FileClient:
         calculated_checksum = self.calculate_checksum(chunk_data)
         return calculated_checksum == received_checksum
 
-    def receive_file_chunk(self):
+    def parse_chunk(self, data):
+        """Returns (chunk_num, chunk_data) of a valid chunk packet, None otherwise"""
+        try:
+            header_end = data.index(b'|', data.index(b'|', data.index(b'|') + 1) + 1) + 1
+            header = data[:header_end - 1].decode()
+            chunk_data = data[header_end:]
+
+            chunk_num, chunk_size, checksum = header.split('|')
+            chunk_num = int(chunk_num)
+            chunk_size = int(chunk_size)
+        except (ValueError, IndexError) as e:
+            print(f"\nError parsing chunk: {e}")
+            return None
+        if (not 0 <= chunk_num < self.total_chunks or len(chunk_data) != chunk_size
+                or chunk_size > CHUNK_SIZE):
+            return None
+        if not self.verify_chunk(chunk_num, chunk_data, checksum):
+            return None
+        return chunk_num, chunk_data
+
+    def send(self, payload):
+        self.sock.sendto(pack_packet(self.session_id, payload), self.server_addr)
+
+    def receive(self, size=CHUNK_SIZE + 1024):
+        """Payload of the next datagram of the current session"""
         while True:
+            data, addr = self.sock.recvfrom(size)
             try:
-                data, _ = self.sock.recvfrom(CHUNK_SIZE + 1024)
-
-                # Split packet into header and data
+                session_id, payload = unpack_packet(data)
+            except ValueError:
+                continue
+            if session_id == self.session_id and addr == self.server_addr:
+                return payload
+
+    def send_sack(self, base):
+        self.send(encode_sack(self.received, base, WINDOW_SIZE))
+
+    def store_chunk(self, chunk_num, chunk_data):
+        """Write a verified chunk at its offset, then mark it received"""
+        self.output.write_at(chunk_num * CHUNK_SIZE, chunk_data)
+        if chunk_num == self.total_chunks - 1:
+            self.journal.last_size = len(chunk_data)
+        self.received.add(chunk_num)
+
+    def read_chunk(self, chunk_num):
+        size = self.journal.last_size if chunk_num == self.total_chunks - 1 else CHUNK_SIZE
+        return self.output.read_at(chunk_num * CHUNK_SIZE, size)
+
+    def add_parity(self, packet):
+        """Returns (chunk_num, chunk_data) if the parity packet rebuilt a lost chunk"""
+        if self.fec_decoder is None:
+            return None
+        try:
+            return self.fec_decoder.add_parity(packet)
+        except ValueError:
+            return None
+
+    def receive_file_chunks(self):
+        """Receive chunks until the file is complete, acknowledging them with SACKs.
+
+        A SACK goes out after ACK_EVERY new chunks, right away when a chunk
+        arrives out of order or twice (something was lost, or our last SACK
+        was), and SACK_INTERVAL after any chunk not yet acknowledged. With
+        FEC, a chunk rebuilt from parity is acknowledged right away and the
+        server is told how many were rebuilt so it can size parity groups.
+        A resumed download starts with a SACK of the chunks already on disk.
+        """
+        base = self.received.first_missing()
+        unacked = 0
+        last_data = last_sack = time.monotonic()
+        self.sock.settimeout(SACK_INTERVAL)
+        try:
+            if self.received.count:
+                self.send_sack(base)
+            while base < self.total_chunks:
                 try:
-                    header_end = data.index(b'|', data.index(b'|', data.index(b'|') + 1) + 1) + 1
-                    header = data[:header_end - 1].decode()
-                    chunk_data = data[header_end:]
-
-                    chunk_num, chunk_size, checksum = header.split('|')
-                    chunk_num = int(chunk_num)
-                    chunk_size = int(chunk_size)
-
-                    if self.verify_chunk(chunk_num, chunk_data, checksum):
-                        with self.lock:
-                            self.received_chunks[chunk_num] = chunk_data
-                            if chunk_num in self.missing_chunks:
-                                self.missing_chunks.remove(chunk_num)
-                        if self.progress_bar:
-                            self.progress_bar.update(len(self.received_chunks))
-                    else:
-                        self.missing_chunks.add(chunk_num)
-
-                    if len(self.received_chunks) == self.total_chunks:
+                    packet = self.receive()
+                except socket.timeout:
+                    packet = None
+                now = time.monotonic()
+
+                chunk = None
+                urgent = rebuilt = False
+                if packet is None:
+                    pass
+                elif packet.startswith(fec.PARITY_PREFIX):
+                    last_data = now
+                    chunk = self.add_parity(packet)
+                    rebuilt = chunk is not None
+                else:
+                    chunk = self.parse_chunk(packet)
+                    if chunk is not None:
+                        last_data = now
+                        urgent = chunk[0] != base
+
+                # A new chunk may complete a parity group enough to rebuild another
+                while chunk is not None:
+                    chunk_num, chunk_data = chunk
+                    if chunk_num in self.received:
+                        urgent = True
                         break
-
-                except (ValueError, IndexError) as e:
-                    print(f"\nError parsing chunk: {e}")
-                    continue
-
-            except socket.timeout:
-                break
-            except Exception as e:
-                print(f"\nError receiving chunk: {e}")
-                break
-
-    def request_missing_chunks(self):
-        missing = set(range(self.total_chunks)) - set(self.received_chunks.keys())
-        if missing:
-            self.missing_chunks = missing
-            chunks_str = ",".join(map(str, missing))
-            message = f"MISSING_CHUNKS:{self.current_file}|{chunks_str}"
-            self.sock.sendto(message.encode(), self.server_addr)
+                    self.store_chunk(chunk_num, chunk_data)
+                    unacked += 1
+                    base = self.received.first_missing(base)
+                    if self.progress_bar:
+                        self.progress_bar.update(self.received.count)
+                    chunk = self.fec_decoder.on_chunk(chunk_num) if self.fec_decoder else None
+                    rebuilt = rebuilt or chunk is not None
+
+                if rebuilt:
+                    urgent = True
+                    self.send(f"RECOVERED|{self.fec_decoder.recovered}".encode())
+                elif now - last_data > TRANSFER_TIMEOUT:
+                    return False
+
+                if urgent or unacked >= ACK_EVERY or (unacked and now - last_sack >= SACK_INTERVAL):
+                    self.send_sack(base)
+                    unacked = 0
+                    last_sack = now
+                self.journal.save(self.output)
+
+            for _ in range(FINAL_SACKS):
+                self.send_sack(base)
             return True
-        return False
-
-    def save_file(self, filename):
-        if not self.received_chunks:
-            return False
+        finally:
+            self.sock.settimeout(5.0)
+
+    def open_output(self, filename, version):
+        """Preallocate the output file, resuming a partial download of the same version
+        of the file if there is one; otherwise the partial file is truncated"""
+        os.makedirs(DOWNLOADS_DIR, exist_ok=True)
+        path = os.path.join(DOWNLOADS_DIR, filename)
+        self.journal = ChunkJournal(path, self.total_chunks, version)
+        resume = self.journal.load()
+        # The size is only known once the last chunk arrived, the file is cut to it at the end
+        self.output = OutputFile(path, self.total_chunks * CHUNK_SIZE, resume=resume)
+        if resume and not self.output.resumed:
+            # The partial file is gone or has another size, its journal is stale
+            self.journal = ChunkJournal(path, self.total_chunks, version)
+        self.received = self.journal.received
+        if self.received.count:
+            print(f"Resuming {filename}: {self.received.count}/{self.total_chunks} chunks on disk")
+
+    def save_file(self):
+        """Cut the complete file to its size and move it in place"""
+        size = (self.total_chunks - 1) * CHUNK_SIZE + self.journal.last_size if self.total_chunks else 0
+        os.ftruncate(self.output.fd, size)
+        self.output.commit()
+        self.journal.remove()
+        self.output = None
+        return True
+
+    def close_output(self):
+        """Keep what an unfinished download wrote, with its journal, for the next attempt"""
+        if self.output is None:
+            return
+        try:
+            self.journal.save(self.output, force=True)
+        except OSError as e:
+            print(f"\nError saving download journal: {e}")
+        self.output.close()
+        self.output = None
+
+    def receive_response(self):
+        """Next control message from the server, skipping chunks that overtook it"""
+        while True:
+            try:
+                return self.receive().decode()
+            except UnicodeDecodeError:
+                continue
 
+    def request_file_info(self, filename):
+        """Send DOWNLOAD until the server answers; the request or FILE_INFO may be lost"""
+        self.sock.settimeout(DOWNLOAD_RETRY)
         try:
-            # Create downloads directory if it doesn't exist
-            downloads_dir = "downloads"
-            if not os.path.exists(downloads_dir):
-                os.makedirs(downloads_dir)
-
-            # Save file in downloads directory
-            file_path = os.path.join(downloads_dir, f"{filename}")
-            with open(file_path, 'wb') as f:
-                for chunk_num in range(self.total_chunks):
-                    if chunk_num in self.received_chunks:
-                        f.write(self.received_chunks[chunk_num])
-            return True
-        except Exception as e:
-            print(f"\nError saving file: {e}")
-            return False
+            for _ in range(DOWNLOAD_ATTEMPTS):
+                request = f"DOWNLOAD:{filename}"
+                if self.use_fec:
+                    request += "|" + fec.encode_option(fec.FEC_MIN_GROUP, fec.FEC_MAX_GROUP)
+                self.send(request.encode())
+                try:
+                    while True:
+                        response = self.receive_response()
+                        if response.startswith(("FILE_INFO|", "FILE_NOT_FOUND", "BUSY")):
+                            return response
+                except socket.timeout:
+                    continue
+            raise socket.timeout(f"No answer to DOWNLOAD:{filename}")
+        finally:
+            self.sock.settimeout(5.0)
 
     def download_file(self, filename):
         self.current_file = filename
-        self.received_chunks.clear()
-        self.missing_chunks.clear()
-
-        # Request file download
-        self.sock.sendto(f"DOWNLOAD:{filename}".encode(), self.server_addr)
+        self.session_id = new_session_id()
 
         try:
-            # Receive file info
-            data, _ = self.sock.recvfrom(BUFFER_SIZE)
-            response = data.decode()
+            # Request file download and receive file info
+            response = self.request_file_info(filename)
 
             if response == "FILE_NOT_FOUND":
                 print(f"File {filename} not found on server")
                 return False
+            if response == "BUSY":
+                print(f"Server is busy, cannot download {filename}")
+                return False
 
             try:
-                _, _, total_chunks = response.split("|")
-                self.total_chunks = int(total_chunks)
+                # FILE_INFO|<name>|<total chunks>|<size>|<mtime_ns>, with |FEC|<min>|<max>
+                # if parity will be sent
+                fields = response.split("|")
+                self.total_chunks = int(fields[2])
+                version = (int(fields[3]), int(fields[4]))
             except (ValueError, IndexError):
                 print("Invalid file info received")
                 return False
+            self.open_output(filename, version)
+            self.fec_decoder = None
+            if fec.parse_option(fields[5:]):
+                self.fec_decoder = fec.FecDecoder(self.received, self.read_chunk)
 
             # Initialize progress bar
             self.progress_bar = ProgressBar(
                 total=self.total_chunks,
                 prefix=f"Downloading {filename}"
             )
-
-            # Start receiving threads
-            receive_threads = []
-            for _ in range(MAX_THREADS):
-                thread = threading.Thread(target=self.receive_file_chunk)
-                thread.start()
-                receive_threads.append(thread)
-
-            # Wait for threads to complete
-            for thread in receive_threads:
-                thread.join()
-
-            # Request missing chunks up to 3 times
-            retries = 0
-            while self.request_missing_chunks() and retries < 3:
-                self.receive_file_chunk()
-                retries += 1
-
-            if len(self.received_chunks) == self.total_chunks:
-                print(f"\nDownload completed: {filename}")
-                return self.save_file(filename)
+            if self.received.count:
+                self.progress_bar.update(self.received.count)
+
+            if self.receive_file_chunks():
+                rebuilt = (f" ({self.fec_decoder.recovered} chunks rebuilt from parity)"
+                           if self.fec_decoder else "")
+                print(f"\nDownload completed: {filename}{rebuilt}")
+                return self.save_file()
             else:
-                print(f"\nDownload incomplete: {filename} ({len(self.received_chunks)}/{self.total_chunks} chunks)")
+                print(f"\nDownload incomplete: {filename} ({self.received.count}/{self.total_chunks} chunks)")
                 return False
 
         except socket.timeout:
@@ -194,12 +403,16 @@ class FileClient:
         except Exception as e:
             print(f"\nError downloading file: {e}")
             return False
+        finally:
+            self.close_output()
+            # End the session; the server also drops it on its own once idle
+            self.send(b"DISCONNECT")
 
     def start(self):
         try:
             # Request available files
-            self.sock.sendto(b"REQUEST_FILES", self.server_addr)
-            data, _ = self.sock.recvfrom(BUFFER_SIZE)
+            self.send(b"REQUEST_FILES")
+            data = self.receive()
             available_files = dict(f.split(":") for f in data.decode().split("|"))
             print("Available files:", available_files)
 
@@ -219,7 +432,7 @@ class FileClient:
                     print(f"File {filename} not available on server")
 
             # Disconnect from server
-            self.sock.sendto(b"DISCONNECT", self.server_addr)
+            self.send(b"DISCONNECT")
 
         except Exception as e:
             print(f"Error: {e}")
@@ -228,5 +441,11 @@ class FileClient:
 
 
 if __name__ == "__main__":
-    client = FileClient()
+    parser = argparse.ArgumentParser(description="UDP file client")
+    parser.add_argument('--host', default=SERVER_IP)
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('--fec', action='store_true',
+                        help="Ask for XOR parity chunks to rebuild lost chunks without retransmission")
+    args = parser.parse_args()
+    client = FileClient(args.host, args.port, use_fec=args.fec)
     client.start()
\ No newline at end of file
@@ -0,0 +1,152 @@
+# udp_congestion.py
+# RTT estimation, congestion control and pacing for the UDP sender. The
+# controllers size the congestion window (in chunks) from the client's SACK
+# feedback, and the pacer spreads the window over one round trip instead of
+# sending it as a burst.
+import math
+
+# RFC 6298 estimator constants and bounds of the retransmission timeout
+RTT_ALPHA = 1 / 8
+RTT_BETA = 1 / 4
+INITIAL_RTO = 0.2
+MIN_RTO = 0.02
+MAX_RTO = 2.0
+
+INITIAL_CWND = 10
+MIN_CWND = 2
+# Window reduction factor on loss
+AIMD_DECREASE = 0.5
+# Delay-based control keeps between DELAY_ALPHA and DELAY_BETA chunks queued in the path
+DELAY_ALPHA = 2
+DELAY_BETA = 6
+# Pacing rate relative to cwnd / srtt, higher in slow start so the window can grow
+SLOW_START_GAIN = 2.0
+PACING_GAIN = 1.25
+# Datagrams the pacer may send back to back when it has fallen behind
+PACING_BURST = 4
+
+CONTROLLERS = ('aimd', 'delay')
+
+
+class RttEstimator:
+    """Smoothed RTT and retransmission timeout from SACK samples (RFC 6298)"""
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.min_rtt = None
+        self.rto = INITIAL_RTO
+
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar += RTT_BETA * (abs(self.srtt - rtt) - self.rttvar)
+            self.srtt += RTT_ALPHA * (rtt - self.srtt)
+        self.min_rtt = rtt if self.min_rtt is None else min(self.min_rtt, rtt)
+        self.rto = min(MAX_RTO, max(MIN_RTO, self.srtt + 4 * self.rttvar))
+
+    def backoff(self):
+        """Double the timeout after a retransmission timer fired"""
+        self.rto = min(MAX_RTO, self.rto * 2)
+
+
+class AimdController:
+    """Slow start, then additive increase and multiplicative decrease on loss"""
+
+    name = 'aimd'
+
+    def __init__(self, max_cwnd, initial_cwnd=INITIAL_CWND):
+        self.max_cwnd = max_cwnd
+        self.cwnd = min(initial_cwnd, max_cwnd)
+        self.ssthresh = math.inf
+        self.losses = 0
+
+    @property
+    def slow_start(self):
+        return self.cwnd < self.ssthresh
+
+    def on_ack(self, acked, rtt, rtt_estimator):
+        if self.slow_start:
+            self.cwnd += acked
+        else:
+            self.cwnd += acked / self.cwnd
+        self.cwnd = min(self.cwnd, self.max_cwnd)
+
+    def on_loss(self):
+        """Chunks were lost, called at most once per round trip"""
+        self.losses += 1
+        self.ssthresh = max(MIN_CWND, self.cwnd * AIMD_DECREASE)
+        self.cwnd = self.ssthresh
+
+    def on_timeout(self):
+        self.losses += 1
+        self.ssthresh = max(MIN_CWND, self.cwnd * AIMD_DECREASE)
+        self.cwnd = MIN_CWND
+
+    def pacing_rate(self, rtt_estimator):
+        """Chunks per second, None to send as fast as the window allows"""
+        if rtt_estimator.srtt is None or rtt_estimator.srtt <= 0:
+            return None
+        gain = SLOW_START_GAIN if self.slow_start else PACING_GAIN
+        return gain * self.cwnd / rtt_estimator.srtt
+
+
+class DelayController(AimdController):
+    """Vegas-style control: grow or shrink the window by the queueing delay it causes.
+
+    The number of chunks sitting in queues is estimated as
+    cwnd * (1 - min_rtt / rtt); the window grows while it is below
+    DELAY_ALPHA and shrinks above DELAY_BETA, so the path is kept full
+    without building long queues. Loss still halves the window.
+    """
+
+    name = 'delay'
+
+    def on_ack(self, acked, rtt, rtt_estimator):
+        if rtt is None or not rtt_estimator.min_rtt:
+            return super().on_ack(acked, rtt, rtt_estimator)
+        queued = self.cwnd * (1 - rtt_estimator.min_rtt / rtt)
+        if self.slow_start:
+            if queued > DELAY_ALPHA:
+                self.ssthresh = self.cwnd
+            else:
+                self.cwnd += acked
+        elif queued < DELAY_ALPHA:
+            self.cwnd += acked / self.cwnd
+        elif queued > DELAY_BETA:
+            self.cwnd = max(MIN_CWND, self.cwnd - acked / self.cwnd)
+        self.cwnd = min(self.cwnd, self.max_cwnd)
+
+
+def create_controller(name, max_cwnd):
+    if name == 'aimd':
+        return AimdController(max_cwnd)
+    if name == 'delay':
+        return DelayController(max_cwnd)
+    raise ValueError(f"Unknown congestion controller: {name}")
+
+
+class Pacer:
+    """Spaces datagrams evenly at the pacing rate, measured on a monotonic clock"""
+
+    def __init__(self, burst=PACING_BURST):
+        self.burst = burst
+        self.next_time = 0.0
+
+    def delay(self, now):
+        """Seconds until the next datagram may be sent"""
+        return max(0.0, self.next_time - now)
+
+    def pause(self, now, seconds):
+        """Hold the next datagram back, for example after the socket refused one"""
+        self.next_time = max(self.next_time, now + seconds)
+
+    def on_sent(self, now, rate):
+        if not rate:
+            self.next_time = now
+            return
+        interval = 1 / rate
+        # Credit for time spent idle is capped at `burst` datagrams
+        self.next_time = max(self.next_time, now - self.burst * interval) + interval
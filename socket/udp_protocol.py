@@ -0,0 +1,23 @@
+# udp_protocol.py
+# Framing shared by udp_server and udp_client: every datagram in either
+# direction starts with the 4-byte session ID the client picked, so one server
+# socket can carry many sessions and packets of an old session are ignored.
+import random
+import struct
+
+SESSION_HEADER = struct.Struct('!I')
+
+
+def new_session_id():
+    return random.randrange(1, 2 ** 32)
+
+
+def pack_packet(session_id, payload):
+    return SESSION_HEADER.pack(session_id) + payload
+
+
+def unpack_packet(data):
+    """Returns (session_id, payload); raises ValueError if the datagram is too short"""
+    if len(data) < SESSION_HEADER.size:
+        raise ValueError("Datagram shorter than the session header")
+    return SESSION_HEADER.unpack_from(data)[0], data[SESSION_HEADER.size:]
@@ -1,3 +1,5 @@
+import argparse
+import select
 import socket
 import os
 import hashlib
@@ -5,21 +7,77 @@ import threading
 from queue import Queue
 import time
 
+import fec
+from metrics import TransferMetrics
+from udp_arq import REORDER_THRESHOLD, SACK_PREFIX, WINDOW_SIZE, SendWindow, decode_sack
+from udp_congestion import CONTROLLERS, Pacer, create_controller
+from udp_protocol import pack_packet, unpack_packet
+
 BUFFER_SIZE = 1024
 CHUNK_SIZE = 1024 * 32
 SERVER_PORT = 1234
 SERVER_IP = '192.168.1.18'
 ENCODING = 'utf-8'
 MAX_THREADS = 5
+# Give up on a transfer when the client has sent no feedback for this long
+TRANSFER_TIMEOUT = 10.0
+# Sessions without a transfer are dropped after this long without a packet
+SESSION_TIMEOUT = 30.0
+MAX_SESSIONS = 256
+# Longest wait for client feedback while every send window is full
+FEEDBACK_POLL = 0.05
+# Pause before trying again when the socket refuses a chunk (ENOBUFS, EAGAIN)
+SEND_RETRY_DELAY = 0.001
+DEFAULT_CONTROLLER = 'aimd'
+
+
+class Session:
+    """One client session, identified by the session ID in its packets; runs one transfer at a time"""
+
+    def __init__(self, session_id, addr, now):
+        self.session_id = session_id
+        self.addr = addr
+        self.last_seen = now
+        self.transfer = None
+
+
+class Transfer:
+    """A file being sent in a session, driven by the server's event loop"""
+
+    def __init__(self, filename, f, window, trace, now, encoder=None):
+        self.filename = filename
+        self.file = f
+        # Size and mtime of the file being sent, so a client only resumes the same version
+        st = os.fstat(f.fileno())
+        self.version = (st.st_size, st.st_mtime_ns)
+        self.window = window
+        self.trace = trace
+        # fec.FecEncoder when the client asked for parity chunks
+        self.fec = encoder
+        self.pacer = Pacer()
+        self.last_feedback = now
+        # Chunk packets sent, added to the packets_sent counter once the transfer ends
+        self.packets = 0
 
 
 class FileServer:
-    def __init__(self):
+    def __init__(self, metrics=None, host=SERVER_IP, port=SERVER_PORT,
+                 congestion=DEFAULT_CONTROLLER, max_sessions=MAX_SESSIONS):
+        self.host = host
+        self.port = port
+        # Congestion controller for each transfer, one of udp_congestion.CONTROLLERS
+        self.congestion = congestion
+        self.max_sessions = max_sessions
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sock.bind((SERVER_IP, SERVER_PORT))
+        self.sock.bind((host, port))
         self.available_files = {}
-        self.current_client = None
+        # Session ID -> Session, all served by the event loop in serve_forever
+        self.sessions = {}
+        self._next_expiry = 0.0
         self.chunk_queue = Queue()
+        self.metrics = metrics or TransferMetrics('udp_fileserver')
+        self.packets_sent = self.metrics.registry.counter(
+            'udp_fileserver_packets_sent_total', "Number of chunk packets sent")
 
     def convert_size(self, size_str):
         units = {
@@ -54,117 +112,258 @@ class FileServer:
     def calculate_checksum(self, data):
         return hashlib.md5(data).hexdigest()
 
-    def send_chunk(self, chunk_num, chunk_data, client_addr):
+    def send_packet(self, session, payload):
+        self.sock.sendto(pack_packet(session.session_id, payload), session.addr)
+
+    def send_chunk(self, session, chunk_num, chunk_data):
         try:
             checksum = self.calculate_checksum(chunk_data)
             header = f"{chunk_num}|{len(chunk_data)}|{checksum}".encode()
             packet = header + b'|' + chunk_data
-            self.sock.sendto(packet, client_addr)
-            time.sleep(0.001)  # Small delay to prevent network congestion
+            self.send_packet(session, packet)
             return True
         except Exception as e:
             print(f"Error sending chunk {chunk_num}: {e}")
             return False
 
-    def transfer_file(self, filename, client_addr):
-        if filename not in self.available_files:
-            self.sock.sendto(b"FILE_NOT_FOUND", client_addr)
+    def send_parity(self, session, packet):
+        self.send_packet(session, packet)
+
+    def start_transfer(self, session, filename, now, fec_groups=None):
+        """Start sending a file in a session, replacing the transfer it was running.
+        fec_groups is the (min, max) parity group size the client accepts, None for no FEC"""
+        transfer = session.transfer
+        if transfer is not None and transfer.filename == filename and not transfer.window.acked.count:
+            # The client asked again because FILE_INFO was lost
+            self.send_packet(session, self.file_info(transfer))
             return
+        if transfer is not None:
+            self.finish_transfer(session, 'aborted')
 
+        trace = self.metrics.request('download')
+        if filename not in self.available_files:
+            self.send_packet(session, b"FILE_NOT_FOUND")
+            trace.finish('not_found')
+            return
         try:
-            file_size = self.available_files[filename]
-            total_chunks = (file_size + CHUNK_SIZE - 1) // CHUNK_SIZE
-
-            # Send file info
-            file_info = f"FILE_INFO|{filename}|{total_chunks}".encode()
-            self.sock.sendto(file_info, client_addr)
-            time.sleep(0.1)  # Wait for client to prepare
-
-            # Read and send file chunks
-            with open(filename, 'rb') as f:
-                for chunk_num in range(total_chunks):
-                    chunk_data = f.read(CHUNK_SIZE)
-                    if not chunk_data:
-                        break
-
-                    # Try sending chunk up to 3 times
-                    for _ in range(3):
-                        if self.send_chunk(chunk_num, chunk_data, client_addr):
-                            break
-                        time.sleep(0.1)
-
-            print(f"Finished sending {filename} to {client_addr}")
-
+            f = open(filename, 'rb')
         except FileNotFoundError:
-            self.sock.sendto(b"FILE_NOT_FOUND", client_addr)
-        except Exception as e:
-            print(f"Error transferring file: {e}")
-            self.sock.sendto(b"TRANSFER_ERROR", client_addr)
+            self.send_packet(session, b"FILE_NOT_FOUND")
+            trace.finish('not_found')
+            return
 
-    def handle_missing_chunks(self, data, client_addr):
+        file_size = self.available_files[filename]
+        total_chunks = (file_size + CHUNK_SIZE - 1) // CHUNK_SIZE
+        window = SendWindow(total_chunks,
+                            controller=create_controller(self.congestion, WINDOW_SIZE))
+        encoder = fec.FecEncoder(*fec_groups) if fec_groups else None
+        session.transfer = Transfer(filename, f, window, trace, now, encoder)
+        self.update_fec(session.transfer)
+        self.send_packet(session, self.file_info(session.transfer))
+        trace.first_byte()
+        trace.filename = filename
+
+    def file_info(self, transfer):
+        size, mtime_ns = transfer.version
+        info = f"FILE_INFO|{transfer.filename}|{transfer.window.total}|{size}|{mtime_ns}"
+        if transfer.fec:
+            info += "|" + fec.encode_option(transfer.fec.min_group, transfer.fec.max_group)
+        return info.encode()
+
+    def update_fec(self, transfer):
+        """Resize parity groups to the loss rate; a lost chunk is only resent
+        once its whole group and the parity have been sent"""
+        if transfer.fec:
+            transfer.fec.adapt(transfer.window.retransmissions)
+            transfer.window.reorder_threshold = REORDER_THRESHOLD + transfer.fec.group
+
+    def send_next(self, session, now):
+        """Send the next chunk of the session's transfer if its window and pacer allow"""
+        transfer = session.transfer
+        window = transfer.window
+        if transfer.pacer.delay(now):
+            return False
+        chunk_num = window.next_to_send(now)
+        if chunk_num is None:
+            return False
+        transfer.file.seek(chunk_num * CHUNK_SIZE)
+        chunk_data = transfer.file.read(CHUNK_SIZE)
+        if not self.send_chunk(session, chunk_num, chunk_data):
+            # The chunk is not in flight, so no timer would ever resend it
+            window.on_send_failed(chunk_num)
+            transfer.pacer.pause(now, SEND_RETRY_DELAY)
+            return False
+        transfer.packets += 1
+        retransmission = window.on_sent(chunk_num, now)
+        if retransmission:
+            self.metrics.retransmitted(transfer.filename)
+        else:
+            transfer.trace.nbytes += len(chunk_data)
+        rate = window.controller.pacing_rate(window.rtt)
+        transfer.pacer.on_sent(now, rate)
+        if transfer.fec and not retransmission:
+            for parity in transfer.fec.add(chunk_num, chunk_data,
+                                           last=chunk_num == window.total - 1):
+                self.send_parity(session, parity)
+                transfer.pacer.on_sent(now, rate)
+                self.update_fec(transfer)
+        return True
+
+    def next_wakeup(self, transfer, now):
+        """Seconds until the transfer can send again: next pacing slot or retransmission timer"""
+        deadline = transfer.window.next_deadline()
+        wait = FEEDBACK_POLL if deadline is None else max(0.0, deadline - now)
+        delay = transfer.pacer.delay(now)
+        return min(wait, delay) if delay else wait
+
+    def finish_transfer(self, session, status=None):
+        transfer, session.transfer = session.transfer, None
+        transfer.file.close()
+        self.packets_sent.inc(transfer.packets)
+        window = transfer.window
+        if status is None:
+            srtt = window.rtt.srtt or 0.0
+            repaired = (f", {transfer.fec.recovered} rebuilt from parity (group {transfer.fec.group})"
+                        if transfer.fec else "")
+            print(f"Finished sending {transfer.filename} to {session.addr} "
+                  f"({window.retransmissions} retransmissions{repaired}, "
+                  f"cwnd {window.controller.cwnd:.0f}, srtt {srtt * 1000:.2f}ms)")
+            transfer.trace.finish()
+        else:
+            print(f"Transfer of {transfer.filename} to {session.addr} ended: {status}")
+            transfer.trace.finish(status)
+
+    def handle_packet(self, data, client_addr, now):
         try:
-            _, file_info = data.decode().split(":", 1)
-            filename, chunks = file_info.split("|")
-            missing_chunks = [int(c) for c in chunks.split(",")]
-
-            if filename not in self.available_files:
+            session_id, payload = unpack_packet(data)
+        except ValueError:
+            return
+        session = self.sessions.get(session_id)
+        if session is not None:
+            if session.addr != client_addr:
+                # Session ID already used by another client
                 return
+            session.last_seen = now
 
-            with open(filename, 'rb') as f:
-                for chunk_num in missing_chunks:
-                    f.seek(chunk_num * CHUNK_SIZE)
-                    chunk_data = f.read(CHUNK_SIZE)
-                    if chunk_data:
-                        self.send_chunk(chunk_num, chunk_data, client_addr)
-                        time.sleep(0.01)  # Small delay between retransmissions
-        except Exception as e:
-            print(f"Error handling missing chunks: {e}")
-
-    def handle_client(self):
-        while True:
+        if payload.startswith(SACK_PREFIX):
+            if session is None or session.transfer is None:
+                # Late acknowledgement of a transfer that already finished
+                return
             try:
-                data, client_addr = self.sock.recvfrom(BUFFER_SIZE)
+                base, acked = decode_sack(payload)
+            except ValueError:
+                return
+            transfer = session.transfer
+            transfer.window.on_sack(base, acked, now)
+            transfer.last_feedback = now
+            if transfer.window.done:
+                self.finish_transfer(session)
+            return
 
-                if not self.current_client:
-                    self.current_client = client_addr
-                elif client_addr != self.current_client:
-                    self.sock.sendto(b"BUSY", client_addr)
+        message = payload.decode()
+
+        if message == "REQUEST_FILES":
+            # Send available files list
+            trace = self.metrics.request('list')
+            files_list = "|".join(f"{name}:{size}" for name, size in self.available_files.items())
+            self.sock.sendto(pack_packet(session_id, files_list.encode()), client_addr)
+            trace.finish()
+
+        elif message.startswith("DOWNLOAD:"):
+            # DOWNLOAD:<name>, optionally followed by |FEC|<min group>|<max group>
+            filename, *options = message[len("DOWNLOAD:"):].split("|")
+            if session is None:
+                if len(self.sessions) >= self.max_sessions:
+                    self.sock.sendto(pack_packet(session_id, b"BUSY"), client_addr)
+                    return
+                session = self.sessions[session_id] = Session(session_id, client_addr, now)
+            self.start_transfer(session, filename, now, fec.parse_option(options))
+
+        elif message.startswith("RECOVERED|"):
+            # Cumulative number of chunks the client rebuilt from parity
+            transfer = session.transfer if session is not None else None
+            if transfer is not None and transfer.fec:
+                if transfer.fec.on_recovered(int(message.split("|")[1])):
+                    transfer.window.on_repaired_loss()
+                transfer.last_feedback = now
+
+        elif message == "DISCONNECT":
+            self.sock.sendto(pack_packet(session_id, b"GOODBYE"), client_addr)
+            if session is not None:
+                if session.transfer is not None:
+                    self.finish_transfer(session, 'aborted')
+                del self.sessions[session_id]
+
+    def expire_sessions(self, now):
+        """Abort transfers whose client went silent and drop idle sessions, at most once a second"""
+        if now < self._next_expiry:
+            return
+        self._next_expiry = now + 1.0
+        for session_id, session in list(self.sessions.items()):
+            transfer = session.transfer
+            if transfer is not None and now - transfer.last_feedback > TRANSFER_TIMEOUT:
+                self.finish_transfer(session, 'timeout')
+            if session.transfer is None and now - session.last_seen > SESSION_TIMEOUT:
+                del self.sessions[session_id]
+
+    def serve_forever(self):
+        """Event loop: give each transfer one chunk per pass as its window and pacer
+        allow, then handle whatever packets have arrived"""
+        while True:
+            now = time.monotonic()
+            sent = False
+            timeout = FEEDBACK_POLL
+            for session in list(self.sessions.values()):
+                if session.transfer is None:
                     continue
-
-                message = data.decode()
-
-                if message == "REQUEST_FILES":
-                    # Send available files list
-                    files_list = "|".join(f"{name}:{size}" for name, size in self.available_files.items())
-                    self.sock.sendto(files_list.encode(), client_addr)
-
-                elif message.startswith("DOWNLOAD:"):
-                    filename = message.split(":")[1]
-                    self.transfer_file(filename, client_addr)
-
-                elif message.startswith("MISSING_CHUNKS:"):
-                    self.handle_missing_chunks(data, client_addr)
-
-                elif message == "DISCONNECT":
-                    self.sock.sendto(b"GOODBYE", client_addr)
-                    if client_addr == self.current_client:
-                        self.current_client = None
-
-            except Exception as e:
-                print(f"Error handling client: {e}")
-                continue
+                try:
+                    if self.send_next(session, now):
+                        sent = True
+                    else:
+                        timeout = min(timeout, self.next_wakeup(session.transfer, now))
+                except Exception as e:
+                    print(f"Error transferring file: {e}")
+                    self.send_packet(session, b"TRANSFER_ERROR")
+                    self.finish_transfer(session, 'error')
+            if sent:
+                timeout = 0
+
+            while select.select([self.sock], [], [], timeout)[0]:
+                timeout = 0
+                try:
+                    data, client_addr = self.sock.recvfrom(BUFFER_SIZE)
+                    self.handle_packet(data, client_addr, time.monotonic())
+                except Exception as e:
+                    print(f"Error handling client: {e}")
+            self.expire_sessions(time.monotonic())
 
     def start(self):
         self.read_available_files()
-        print(f"Server started on {SERVER_IP}:{SERVER_PORT}")
+        self.metrics.start()
+        print(f"Server started on {self.host}:{self.port} ({self.congestion} congestion control)")
         try:
-            self.handle_client()
+            self.serve_forever()
         except KeyboardInterrupt:
             print("\nServer shutting down...")
-            if self.current_client:
-                self.sock.sendto(b"SERVER_SHUTDOWN", self.current_client)
+            for session in self.sessions.values():
+                self.send_packet(session, b"SERVER_SHUTDOWN")
 
 
 if __name__ == "__main__":
-    server = FileServer()
+    parser = argparse.ArgumentParser(description="UDP file server")
+    parser.add_argument('--host', default=SERVER_IP)
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('--congestion', choices=CONTROLLERS, default=DEFAULT_CONTROLLER,
+                        help="aimd: loss-based AIMD; delay: Vegas-style delay-based control")
+    parser.add_argument('--max-sessions', type=int, default=MAX_SESSIONS,
+                        help="Concurrent client sessions; further clients get BUSY")
+    parser.add_argument('--metrics-port', type=int,
+                        help="HTTP port serving Prometheus metrics at /metrics")
+    parser.add_argument('--metrics-file', help="File the Prometheus metrics are written to")
+    parser.add_argument('--event-log', help="JSON event log, one line per request")
+    args = parser.parse_args()
+    server = FileServer(TransferMetrics('udp_fileserver', port=args.metrics_port,
+                                        path=args.metrics_file, event_log=args.event_log),
+                        host=args.host, port=args.port, congestion=args.congestion,
+                        max_sessions=args.max_sessions)
     server.start()
\ No newline at end of file